@@ -81,6 +81,14 @@ class VisitRequest(models.Model):
         ordering = ['-created_at']
         verbose_name = "Demande de visite"
         verbose_name_plural = "Demandes de visite"
+        constraints = [
+            # Une seule demande en attente par demandeur et par propriété
+            models.UniqueConstraint(
+                fields=['property', 'requester'],
+                condition=models.Q(status='pending'),
+                name='unique_pending_visit_request'
+            ),
+        ]
     
     def __str__(self):
         return f"Visite demandée par {self.requester.username} - {self.property.title}"
\ No newline at end of file
@@ -100,4 +100,25 @@ class PropertyAPITests(APITestCase):
         url = reverse('property-list-create')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
\ No newline at end of file
+        self.assertEqual(len(response.data), 1)
+    
+    def test_duplicate_pending_visit_request_rejected(self):
+        """Test qu'une seconde demande de visite en attente est refusée"""
+        self.client.force_authenticate(user=self.buyer)
+        url = reverse('visit-request-list-create')
+        data = {
+            'property': self.property.id,
+            'requested_date': '2030-01-15T10:00:00Z',
+            'description': 'Visite le matin'
+        }
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(VisitRequest.objects.filter(requester=self.buyer).count(), 1)
+        
+        # Une fois la première demande traitée, une nouvelle demande est possible
+        VisitRequest.objects.filter(requester=self.buyer).update(status='rejected')
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
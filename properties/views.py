@@ -1,4 +1,6 @@
+from django.db import transaction, IntegrityError
 from rest_framework import generics, permissions, status, serializers
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 from .models import Property, PropertyImage, PropertyReport, VisitRequest
 from .serializers import (PropertySerializer, PropertyCreateSerializer, PropertyImageSerializer,
@@ -164,21 +166,22 @@ class VisitRequestListCreateView(generics.ListCreateAPIView):
     
     def perform_create(self, serializer):
         """Validation et création des demandes de visite"""
-        property_id = self.request.data.get('property')
-        try:
-            property_obj = Property.objects.get(id=property_id)
-        except Property.DoesNotExist:
-            raise serializers.ValidationError("La propriété spécifiée n'existe pas.")
+        property_obj = serializer.validated_data['property']
         
         # Un propriétaire ne peut pas demander une visite de sa propre propriété
-        if property_obj.owner == self.request.user:
-            raise permissions.PermissionDenied("Vous ne pouvez pas demander une visite de votre propre propriété.")
+        if property_obj.owner_id == self.request.user.pk:
+            raise PermissionDenied("Vous ne pouvez pas demander une visite de votre propre propriété.")
         
         # Vérifier que la propriété est disponible
         if not property_obj.is_available:
-            raise permissions.PermissionDenied("Cette propriété n'est plus disponible.")
+            raise PermissionDenied("Cette propriété n'est plus disponible.")
         
-        serializer.save(requester=self.request.user)
+        # Contrainte unique_pending_visit_request : une seule demande en attente
+        try:
+            with transaction.atomic():
+                serializer.save(requester=self.request.user)
+        except IntegrityError:
+            raise serializers.ValidationError("Vous avez déjà une demande de visite en attente pour cette propriété.")
 
 
 class VisitRequestDetailView(generics.RetrieveUpdateDestroyAPIView):
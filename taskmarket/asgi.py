@@ -7,10 +7,40 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'taskmarket.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+django_application = get_asgi_application()
+
+
+def start_background_tasks():
+    """Reprise des notifications en attente (arrêt brutal d'un worker précédent)"""
+    from django.conf import settings
+    if settings.TELEGRAM_BOT_TOKEN:
+        from telegram_bot.digests import get_digests
+        get_digests().start()
+
+
+async def application(scope, receive, send):
+    """
+    Requêtes HTTP servies par Django ; le protocole lifespan démarre les
+    tâches de fond du bot Telegram et le ferme proprement à l'arrêt du serveur.
+    """
+    if scope['type'] != 'lifespan':
+        await django_application(scope, receive, send)
+        return
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.to_thread(start_background_tasks)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            from telegram_bot.client import shutdown_bot_client
+            await asyncio.to_thread(shutdown_bot_client)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,78 @@
+"""
+Chemin rapide des requêtes d'API sans état.
+
+Une requête vers /api/ authentifiée uniquement par un en-tête
+`Authorization: Token ...` (sans cookie de session) n'a besoin ni de
+session, ni de protection CSRF, ni d'utilisateur Django, ni de messages :
+DRF authentifie la requête lui-même. StatelessApiMiddleware la marque et les
+versions « Lean » des middlewares correspondants la laissent passer sans
+traitement. L'admin, l'API navigable et les clients à session conservent la
+pile complète.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+
+def is_stateless_api_request(request) -> bool:
+    return (
+        request.path_info.startswith(settings.API_FAST_PATH_PREFIX)
+        and request.META.get('HTTP_AUTHORIZATION', '').startswith('Token ')
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+    )
+
+
+class StatelessApiMiddleware:
+    """
+    Marque les requêtes d'API sans état (à placer avant SessionMiddleware).
+
+    Compatible synchrone et asynchrone : sous ASGI, la chaîne n'est pas
+    adaptée autour de ce middleware (pas de passage par un thread).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # Sans entrée/sortie : en mode asynchrone, la coroutine de la suite
+        # de la chaîne est renvoyée telle quelle et attendue par l'appelant
+        request.stateless_api = settings.API_FAST_PATH_ENABLED and is_stateless_api_request(request)
+        return self.get_response(request)
+
+
+class _SkipForStatelessApi:
+    """Court-circuite le middleware pour les requêtes marquées sans état"""
+
+    def __call__(self, request):
+        if getattr(request, 'stateless_api', False):
+            # En mode asynchrone get_response renvoie une coroutine, attendue
+            # par l'appelant : ni process_request ni passage par un thread
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class LeanSessionMiddleware(_SkipForStatelessApi, SessionMiddleware):
+    pass
+
+
+class LeanCsrfViewMiddleware(_SkipForStatelessApi, CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        # process_view est appelé par le handler, hors de __call__
+        if getattr(request, 'stateless_api', False):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class LeanAuthenticationMiddleware(_SkipForStatelessApi, AuthenticationMiddleware):
+    pass
+
+
+class LeanMessageMiddleware(_SkipForStatelessApi, MessageMiddleware):
+    pass
@@ -50,11 +50,13 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Requêtes d'API par token : session, CSRF, auth et messages court-circuités
+    'taskmarket.middleware.StatelessApiMiddleware',
+    'taskmarket.middleware.LeanSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'taskmarket.middleware.LeanCsrfViewMiddleware',
+    'taskmarket.middleware.LeanAuthenticationMiddleware',
+    'taskmarket.middleware.LeanMessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -151,7 +153,7 @@ CORS_ALLOW_ALL_ORIGINS = True
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -165,8 +167,131 @@ TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL', '')
 # URL de base pour les webhooks
 TELEGRAM_WEBHOOK_PATH = '/api/telegram/webhook/'
 
+# API Bot Telegram (modifiable pour un serveur local ou un faux serveur de test)
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
+TELEGRAM_API_FILE_URL = os.getenv('TELEGRAM_API_FILE_URL', 'https://api.telegram.org/file/bot')
+
 # Configuration spécifique au bot
 TELEGRAM_BOT_NAME = os.getenv('TELEGRAM_BOT_NAME', 'TaskMarketBot')
 
 # Durée de validité des codes de liaison (en minutes)
-TELEGRAM_LINK_CODE_EXPIRY_MINUTES = 30
\ No newline at end of file
+TELEGRAM_LINK_CODE_EXPIRY_MINUTES = 30
+
+# Traitement des updates en arrière-plan : updates traités simultanément et taille de la file
+TELEGRAM_UPDATE_WORKERS = int(os.getenv('TELEGRAM_UPDATE_WORKERS', '4'))
+TELEGRAM_UPDATE_QUEUE_SIZE = int(os.getenv('TELEGRAM_UPDATE_QUEUE_SIZE', '200'))
+
+# Délai (en secondes) avant de revérifier un update dont le chat a un update
+# précédent traité par un autre processus. Un update resté 'processing' après
+# l'arrêt brutal d'un worker bloque son chat jusqu'à process_telegram_updates
+TELEGRAM_UPDATE_ORDER_DELAY = float(os.getenv('TELEGRAM_UPDATE_ORDER_DELAY', '0.2'))
+
+# Nombre d'update_id mémorisés par processus pour ignorer les re-livraisons
+TELEGRAM_UPDATE_DEDUP_SIZE = int(os.getenv('TELEGRAM_UPDATE_DEDUP_SIZE', '10000'))
+
+# Fenêtre (en heures) pendant laquelle un update_id déjà reçu est ignoré. Telegram
+# ne re-livre un update que peu de temps, mais peut réutiliser un update_id
+# après une semaine sans update : la déduplication ne porte pas au-delà
+TELEGRAM_UPDATE_DEDUP_HOURS = int(os.getenv('TELEGRAM_UPDATE_DEDUP_HOURS', '24'))
+
+# Conservation (en jours) des updates traités, purgés par prune_telegram_updates
+TELEGRAM_UPDATE_RETENTION_DAYS = int(os.getenv('TELEGRAM_UPDATE_RETENTION_DAYS', '3'))
+
+# Client HTTP partagé du bot (pool de connexions et timeouts en secondes)
+TELEGRAM_HTTP_POOL_SIZE = int(os.getenv('TELEGRAM_HTTP_POOL_SIZE', '8'))
+TELEGRAM_HTTP_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_HTTP_CONNECT_TIMEOUT', '5'))
+TELEGRAM_HTTP_READ_TIMEOUT = float(os.getenv('TELEGRAM_HTTP_READ_TIMEOUT', '10'))
+TELEGRAM_HTTP_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_HTTP_WRITE_TIMEOUT', '10'))
+TELEGRAM_HTTP_POOL_TIMEOUT = float(os.getenv('TELEGRAM_HTTP_POOL_TIMEOUT', '2'))
+
+# File d'envoi des messages : débits en messages/seconde (limites Telegram)
+TELEGRAM_SEND_WORKERS = int(os.getenv('TELEGRAM_SEND_WORKERS', '4'))
+TELEGRAM_SEND_GLOBAL_RATE = float(os.getenv('TELEGRAM_SEND_GLOBAL_RATE', '30'))
+TELEGRAM_SEND_CHAT_RATE = float(os.getenv('TELEGRAM_SEND_CHAT_RATE', '1'))
+TELEGRAM_SEND_CHAT_BURST = float(os.getenv('TELEGRAM_SEND_CHAT_BURST', '3'))
+TELEGRAM_SEND_MAX_RETRIES = int(os.getenv('TELEGRAM_SEND_MAX_RETRIES', '5'))
+
+# Cache partagé (états de conversation du bot). En production avec plusieurs
+# workers, REDIS_URL doit pointer vers un cache commun à tous les processus.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Cache des tokens d'API (users.authentication.CachedTokenAuthentication) :
+# durée de vie en secondes, les entrées étant invalidées à la déconnexion et
+# à chaque modification de l'utilisateur
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', '60'))
+
+# Tableau de bord (/api/users/dashboard/) : durée de vie en cache (secondes),
+# invalidé par versions à chaque modification des données concernées
+DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', '300'))
+
+# Chemin rapide des requêtes d'API sans état (taskmarket.middleware) : les
+# requêtes sous ce préfixe authentifiées par `Authorization: Token` et sans
+# cookie de session ne chargent ni session, ni utilisateur, ni messages
+API_FAST_PATH_ENABLED = os.getenv('API_FAST_PATH_ENABLED', 'True') == 'True'
+API_FAST_PATH_PREFIX = '/api/'
+
+# États de conversation : durée de vie en cache (secondes) et intervalle
+# d'écriture différée en base (secondes)
+TELEGRAM_CONVERSATION_CACHE_TTL = int(os.getenv('TELEGRAM_CONVERSATION_CACHE_TTL', '86400'))
+TELEGRAM_CONVERSATION_FLUSH_INTERVAL = float(os.getenv('TELEGRAM_CONVERSATION_FLUSH_INTERVAL', '2'))
+
+# Verrou par chat pris dans le cache partagé (secondes avant expiration si le
+# processus qui le détient s'arrête). États et verrous vivant dans le cache,
+# plusieurs workers web exigent REDIS_URL : LocMemCache est propre à chaque processus
+TELEGRAM_CONVERSATION_LOCK_TTL = float(os.getenv('TELEGRAM_CONVERSATION_LOCK_TTL', '30'))
+
+# Journal des messages reçus : écrit par lots de N lignes ou toutes les N secondes,
+# conservé N jours (voir la commande prune_telegram_messages)
+TELEGRAM_MESSAGE_LOG_BATCH_SIZE = int(os.getenv('TELEGRAM_MESSAGE_LOG_BATCH_SIZE', '100'))
+TELEGRAM_MESSAGE_LOG_FLUSH_INTERVAL = float(os.getenv('TELEGRAM_MESSAGE_LOG_FLUSH_INTERVAL', '1'))
+TELEGRAM_MESSAGE_RETENTION_DAYS = int(os.getenv('TELEGRAM_MESSAGE_RETENTION_DAYS', '90'))
+
+# Photos reçues par le bot : téléchargements simultanés par processus et taille
+# maximale (l'API Bot ne permet pas de télécharger au-delà de 20 Mo)
+TELEGRAM_PHOTO_DOWNLOAD_WORKERS = int(os.getenv('TELEGRAM_PHOTO_DOWNLOAD_WORKERS', '4'))
+TELEGRAM_PHOTO_MAX_FILE_SIZE = int(os.getenv('TELEGRAM_PHOTO_MAX_FILE_SIZE', str(20 * 1024 * 1024)))
+
+# Albums photo : délai d'attente de la photo suivante et attente maximale (secondes)
+TELEGRAM_MEDIA_GROUP_WINDOW = float(os.getenv('TELEGRAM_MEDIA_GROUP_WINDOW', '1'))
+TELEGRAM_MEDIA_GROUP_MAX_WAIT = float(os.getenv('TELEGRAM_MEDIA_GROUP_MAX_WAIT', '5'))
+
+# Commande /list : propriétés par page et durée de vie de la projection en cache (secondes)
+TELEGRAM_LIST_PAGE_SIZE = int(os.getenv('TELEGRAM_LIST_PAGE_SIZE', '5'))
+TELEGRAM_LIST_CACHE_TTL = int(os.getenv('TELEGRAM_LIST_CACHE_TTL', '3600'))
+
+# Cache des comptes Telegram liés : entrées locales au processus, durée de vie
+# locale (délai maximal de prise en compte d'une déliaison faite ailleurs) et
+# durée de vie dans le cache partagé (secondes)
+TELEGRAM_USER_CACHE_SIZE = int(os.getenv('TELEGRAM_USER_CACHE_SIZE', '10000'))
+TELEGRAM_USER_LOCAL_TTL = float(os.getenv('TELEGRAM_USER_LOCAL_TTL', '30'))
+TELEGRAM_USER_CACHE_TTL = int(os.getenv('TELEGRAM_USER_CACHE_TTL', '3600'))
+
+# Proportion des payloads reçus par le webhook écrits dans les logs (0 à 1)
+TELEGRAM_WEBHOOK_LOG_SAMPLE_RATE = float(os.getenv('TELEGRAM_WEBHOOK_LOG_SAMPLE_RATE', '0.01'))
+
+# Requêtes inline (@bot villa Douala) : résultats par page, durée de cache des
+# réponses côté Telegram, intervalle de synchronisation de l'index avec la base
+# et de sa reconstruction complète (secondes)
+TELEGRAM_INLINE_PAGE_SIZE = int(os.getenv('TELEGRAM_INLINE_PAGE_SIZE', '20'))
+TELEGRAM_INLINE_CACHE_TIME = int(os.getenv('TELEGRAM_INLINE_CACHE_TIME', '30'))
+TELEGRAM_INLINE_REFRESH_INTERVAL = int(os.getenv('TELEGRAM_INLINE_REFRESH_INTERVAL', '30'))
+TELEGRAM_INLINE_REBUILD_INTERVAL = int(os.getenv('TELEGRAM_INLINE_REBUILD_INTERVAL', '3600'))
+
+# Notifications des propriétaires : durée de la fenêtre de regroupement par
+# destinataire (secondes) et nombre d'événements détaillés par message. Les
+# événements en attente sont en base : après un arrêt brutal, ils sont envoyés
+# par le balayage d'un worker au plus une fenêtre après leur échéance
+TELEGRAM_DIGEST_WINDOW = float(os.getenv('TELEGRAM_DIGEST_WINDOW', '600'))
+TELEGRAM_DIGEST_MAX_EVENTS = int(os.getenv('TELEGRAM_DIGEST_MAX_EVENTS', '15'))
@@ -35,11 +35,13 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Ajouté pour la production
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Requêtes d'API par token : session, CSRF, auth et messages court-circuités
+    'taskmarket.middleware.StatelessApiMiddleware',
+    'taskmarket.middleware.LeanSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'taskmarket.middleware.LeanCsrfViewMiddleware',
+    'taskmarket.middleware.LeanAuthenticationMiddleware',
+    'taskmarket.middleware.LeanMessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
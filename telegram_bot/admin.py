@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import TelegramUser, TelegramLinkCode, TelegramMessage, TelegramConversation
+from .models import TelegramUser, TelegramLinkCode, TelegramMessage, TelegramConversation, TelegramUpdate
+from .conversations import invalidate_conversations
 
 
 @admin.register(TelegramUser)
@@ -47,11 +48,11 @@ class TelegramLinkCodeAdmin(admin.ModelAdmin):
 @admin.register(TelegramMessage)
 class TelegramMessageAdmin(admin.ModelAdmin):
     """Configuration admin pour les messages Telegram"""
-    list_display = ['telegram_user', 'message_type', 'content_preview', 'processed', 'created_at']
-    list_filter = ['message_type', 'processed', 'created_at']
+    list_display = ['telegram_user', 'message_type', 'content_preview', 'processed', 'parser_version', 'created_at']
+    list_filter = ['message_type', 'processed', 'parser_version', 'created_at']
     search_fields = ['content', 'telegram_user__user__username']
     ordering = ['-created_at']
-    readonly_fields = ['telegram_user', 'message_type', 'content', 'telegram_message_id', 'created_at']
+    readonly_fields = ['telegram_user', 'message_type', 'content', 'telegram_message_id', 'parsed_data', 'parser_version', 'created_at']
     
     def content_preview(self, obj):
         """Aperçu du contenu du message"""
@@ -68,7 +69,7 @@ class TelegramMessageAdmin(admin.ModelAdmin):
     
     def get_readonly_fields(self, request, obj=None):
         if obj:  # En mode édition
-            return ['telegram_user', 'message_type', 'content', 'telegram_message_id', 'created_at']
+            return ['telegram_user', 'message_type', 'content', 'telegram_message_id', 'parsed_data', 'parser_version', 'created_at']
         return self.readonly_fields
 
 
@@ -90,6 +91,21 @@ class TelegramConversationAdmin(admin.ModelAdmin):
         return 'Vide'
     context_preview.short_description = 'Contexte'
     
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # L'état modifié en base remplace celui mis en cache par le bot
+        invalidate_conversations([obj.telegram_user.telegram_id])
+    
+    def delete_model(self, request, obj):
+        telegram_id = obj.telegram_user.telegram_id
+        super().delete_model(request, obj)
+        invalidate_conversations([telegram_id])
+    
+    def delete_queryset(self, request, queryset):
+        telegram_ids = list(queryset.values_list('telegram_user__telegram_id', flat=True))
+        super().delete_queryset(request, queryset)
+        invalidate_conversations(telegram_ids)
+    
     fieldsets = (
         ('Utilisateur', {
             'fields': ('telegram_user',)
@@ -101,4 +117,18 @@ class TelegramConversationAdmin(admin.ModelAdmin):
             'fields': ('updated_at',),
             'classes': ('collapse',)
         })
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(TelegramUpdate)
+class TelegramUpdateAdmin(admin.ModelAdmin):
+    """Configuration admin pour les updates Telegram persistés"""
+    list_display = ['update_id', 'chat_id', 'status', 'attempts', 'created_at', 'processed_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['update_id', 'chat_id']
+    ordering = ['-created_at']
+    readonly_fields = ['update_id', 'chat_id', 'media_group_id', 'payload', 'attempts', 'error', 'created_at', 'processed_at']
+    
+    def has_add_permission(self, request):
+        # Les updates sont créés par le webhook
+        return False
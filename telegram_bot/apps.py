@@ -4,4 +4,8 @@ from django.apps import AppConfig
 class TelegramBotConfig(AppConfig):
     """Configuration de l'application Telegram Bot"""
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'telegram_bot'
\ No newline at end of file
+    name = 'telegram_bot'
+    
+    def ready(self):
+        # Enregistrement des signaux d'invalidation des caches du bot
+        from . import signals  # noqa: F401
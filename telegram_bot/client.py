@@ -0,0 +1,145 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+from typing import Optional, Any, Awaitable, Callable, Coroutine
+
+from django.conf import settings
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+
+class BotClient:
+    """
+    Bot Telegram partagé par le processus.
+
+    Le client HTTP de python-telegram-bot est lié à une boucle asyncio : le bot
+    vit donc dans une boucle dédiée (thread 'telegram-bot-loop') et les appels
+    venant des threads synchrones y sont soumis via run().
+    """
+
+    def __init__(self, token: str):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever,
+            name='telegram-bot-loop',
+            daemon=True
+        )
+        self._thread.start()
+        self._shutdown_hooks = []
+        self.bot = Bot(
+            token=token,
+            base_url=settings.TELEGRAM_API_BASE_URL,
+            base_file_url=settings.TELEGRAM_API_FILE_URL,
+            request=self._build_request()
+        )
+
+    @staticmethod
+    def _build_request() -> HTTPXRequest:
+        """Client HTTP avec pool de connexions et timeouts configurables"""
+        return HTTPXRequest(
+            connection_pool_size=settings.TELEGRAM_HTTP_POOL_SIZE,
+            connect_timeout=settings.TELEGRAM_HTTP_CONNECT_TIMEOUT,
+            read_timeout=settings.TELEGRAM_HTTP_READ_TIMEOUT,
+            write_timeout=settings.TELEGRAM_HTTP_WRITE_TIMEOUT,
+            pool_timeout=settings.TELEGRAM_HTTP_POOL_TIMEOUT,
+        )
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Exécute une coroutine sur la boucle du bot et attend son résultat"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return future.result(timeout)
+
+    def add_shutdown_hook(self, hook: Callable[[], Awaitable]):
+        """Enregistre une coroutine à exécuter sur la boucle avant l'arrêt"""
+        self._shutdown_hooks.append(hook)
+
+    def shutdown(self):
+        """Exécute les hooks d'arrêt, ferme les connexions HTTP puis arrête la boucle"""
+        if not self.loop.is_running():
+            return
+        for hook in self._shutdown_hooks:
+            try:
+                self.run(hook())
+            except Exception as e:
+                logger.warning(f"Erreur lors de l'arrêt du client Telegram: {str(e)}")
+        try:
+            self.run(self._close_requests(), timeout=settings.TELEGRAM_HTTP_CONNECT_TIMEOUT)
+            self.run(self._cancel_tasks(), timeout=5)
+        except Exception as e:
+            logger.warning(f"Erreur lors de la fermeture du bot Telegram: {str(e)}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        if not self.loop.is_running():
+            self.loop.close()
+
+    async def _close_requests(self):
+        """
+        Ferme les pools HTTP du bot. Bot.shutdown() ne fait rien tant que
+        Bot.initialize() (qui appelle getMe) n'a pas été attendu : les deux
+        HTTPXRequest (getUpdates et autres méthodes) sont donc fermés directement.
+        """
+        await self.bot.shutdown()
+        await asyncio.gather(*(request.shutdown() for request in self.bot._request))
+
+    @staticmethod
+    async def _cancel_tasks():
+        """Annule les tâches de fond restantes (files, balayages)"""
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+_client = None
+_service = None
+_lock = threading.Lock()
+
+
+def get_bot_client() -> BotClient:
+    """
+    Retourne le client du processus courant, créé à la demande.
+    Un processus forké (worker gunicorn) recrée son propre client.
+    """
+    global _client, _service
+    client = _client
+    if client is None or client.pid != os.getpid():
+        with _lock:
+            if _client is None or _client.pid != os.getpid():
+                _client = BotClient(settings.TELEGRAM_BOT_TOKEN)
+                _service = None
+            client = _client
+    return client
+
+
+def get_bot() -> Bot:
+    """Raccourci vers le bot partagé"""
+    return get_bot_client().bot
+
+
+def get_bot_service():
+    """Retourne le TelegramBotService partagé par le processus"""
+    global _service
+    client = get_bot_client()
+    if _service is None or _service.client is not client:
+        with _lock:
+            if _service is None or _service.client is not client:
+                from .services import TelegramBotService
+                _service = TelegramBotService(client=client)
+    return _service
+
+
+@atexit.register
+def shutdown_bot_client():
+    """Arrêt propre du client à la fin du processus"""
+    global _client, _service
+    with _lock:
+        if _client is not None and _client.pid == os.getpid():
+            _client.shutdown()
+        _client = None
+        _service = None
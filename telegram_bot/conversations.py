@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import threading
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Set
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import TelegramConversation
+from .identity import resolve_telegram_user
+from .client import BotClient, get_bot_client
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_key(telegram_id: int) -> str:
+    return f"telegram:conversation:{telegram_id}"
+
+
+def _lock_key(telegram_id: int) -> str:
+    return f"telegram:conversation-lock:{telegram_id}"
+
+
+class ConversationState:
+    """
+    État de conversation d'un chat, tel que lu depuis le cache.
+    `updated_at` est la date de modification en base sur laquelle l'état est
+    basé : une écriture différée n'écrase jamais une modification plus récente
+    (admin, commande de nettoyage).
+    """
+
+    def __init__(self, telegram_id: int, pk: Optional[int], telegram_user_id: Optional[int],
+                 state: str = 'idle', context_data: Optional[Dict[str, Any]] = None, updated_at=None):
+        self.telegram_id = telegram_id
+        self.pk = pk
+        self.telegram_user_id = telegram_user_id
+        self.state = state
+        self.context_data = context_data or {}
+        self.updated_at = updated_at
+
+    @property
+    def is_persistent(self) -> bool:
+        """Seuls les comptes liés ont une conversation en base"""
+        return self.pk is not None
+
+    def reset(self):
+        """Retour à l'état inactif"""
+        self.state = 'idle'
+        self.context_data = {}
+
+    def to_cache(self) -> Dict[str, Any]:
+        return {
+            'pk': self.pk,
+            'telegram_user_id': self.telegram_user_id,
+            'state': self.state,
+            'context_data': self.context_data,
+            'updated_at': self.updated_at,
+        }
+
+    @classmethod
+    def from_cache(cls, telegram_id: int, data: Dict[str, Any]) -> 'ConversationState':
+        data = dict(data)
+        data.pop('dirty', None)
+        return cls(telegram_id, **data)
+
+
+class ConversationStore:
+    """
+    Cache des états de conversation avec verrou par chat et écriture différée.
+
+    Les lectures se font dans le cache partagé (une requête en base au premier
+    message seulement). Les modifications sont écrites immédiatement dans le
+    cache, marquées à écrire, puis en base par lots toutes les
+    `flush_interval` secondes et à l'arrêt du client.
+
+    Le cache fait foi entre processus : le verrou par chat y est pris, et le
+    flush écrit l'état courant du cache (éventuellement modifié par un autre
+    processus) plutôt qu'une copie locale. Avec plusieurs workers, le cache
+    doit être partagé (REDIS_URL).
+    """
+
+    # Intervalle d'interrogation du verrou partagé tenu par un autre processus (secondes)
+    LOCK_POLL_INTERVAL = 0.02
+
+    def __init__(self, client: BotClient, ttl: int, flush_interval: float, lock_ttl: float = 30):
+        self.client = client
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.lock_ttl = lock_ttl
+        self._locks: Dict[int, List] = {}
+        self._dirty: Set[int] = set()
+        self._dirty_lock = threading.Lock()
+        self._flusher = None
+        client.add_shutdown_hook(self.flush)
+
+    @asynccontextmanager
+    async def lock(self, telegram_id: int):
+        """
+        Verrou sérialisant le traitement des messages d'un chat, entre tâches
+        et entre processus. Le verrou asyncio local évite aux tâches du
+        processus d'interroger le cache ; il est supprimé dès qu'aucune tâche
+        ne l'utilise.
+        """
+        entry = self._locks.get(telegram_id)
+        if entry is None:
+            entry = self._locks[telegram_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._shared_lock(telegram_id):
+                    yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(telegram_id, None)
+
+    @asynccontextmanager
+    async def _shared_lock(self, telegram_id: int):
+        """
+        Clé du cache partagé posée par cache.add. Elle expire après `lock_ttl`
+        secondes si le processus qui la détient s'arrête brutalement.
+        """
+        key = _lock_key(telegram_id)
+        token = uuid.uuid4().hex
+        while not await cache.aadd(key, token, self.lock_ttl):
+            await asyncio.sleep(self.LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            # Pas de suppression si la clé a expiré et été reprise entre-temps
+            if await cache.aget(key) == token:
+                await cache.adelete(key)
+
+    async def get(self, telegram_id: int) -> ConversationState:
+        """Retourne l'état de conversation du chat, créé si nécessaire"""
+        data = await cache.aget(_cache_key(telegram_id))
+        if data is not None:
+            return ConversationState.from_cache(telegram_id, data)
+
+        conversation = await sync_to_async(self._load)(telegram_id)
+        if conversation.is_persistent:
+            await cache.aset(_cache_key(telegram_id), conversation.to_cache(), self.ttl)
+        return conversation
+
+    async def save(self, conversation: ConversationState):
+        """Écrit l'état dans le cache et programme son écriture en base"""
+        if not conversation.is_persistent:
+            return
+        await cache.aset(
+            _cache_key(conversation.telegram_id),
+            {**conversation.to_cache(), 'dirty': True},
+            self.ttl
+        )
+        with self._dirty_lock:
+            self._dirty.add(conversation.telegram_id)
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def discard(self, telegram_id: int):
+        """Abandonne une écriture en attente (l'état en base fait foi)"""
+        with self._dirty_lock:
+            self._dirty.discard(telegram_id)
+
+    async def flush(self):
+        """Écrit en base les états modifiés, tels qu'ils sont dans le cache"""
+        with self._dirty_lock:
+            pending, self._dirty = self._dirty, set()
+        if not pending:
+            return
+
+        try:
+            cached = await cache.aget_many([_cache_key(telegram_id) for telegram_id in pending])
+            # Entrées invalidées (modification en base) ou déjà écrites par un autre processus ignorées
+            entries = {
+                telegram_id: cached[_cache_key(telegram_id)]
+                for telegram_id in pending
+                if cached.get(_cache_key(telegram_id), {}).get('dirty')
+            }
+            written = await sync_to_async(self._write)([
+                ConversationState.from_cache(telegram_id, data) for telegram_id, data in entries.items()
+            ]) if entries else {}
+        except Exception:
+            # Transaction annulée : les états sont remis en attente
+            with self._dirty_lock:
+                self._dirty |= pending
+            raise
+
+        for telegram_id, data in entries.items():
+            # Un message a pu être traité pendant l'écriture (ici ou dans un
+            # autre processus) : le cache est mis à jour sous le verrou du chat
+            async with self.lock(telegram_id):
+                await self._after_write(telegram_id, data, written.get(telegram_id))
+
+    async def _after_write(self, telegram_id: int, written_data: Dict[str, Any], updated_at):
+        key = _cache_key(telegram_id)
+        if updated_at is None:
+            # Modifiée en base entre-temps : l'état est abandonné, le cache invalidé
+            self.discard(telegram_id)
+            await cache.adelete(key)
+            return
+
+        data = await cache.aget(key)
+        if data is None:
+            # Invalidée ou expirée pendant l'écriture
+            return
+        if data == written_data:
+            data['dirty'] = False
+        # Sinon modifiée pendant l'écriture à partir de l'état écrit : elle
+        # reste à écrire (en attente dans le processus qui l'a modifiée)
+        data['updated_at'] = updated_at
+        await cache.aset(key, data, self.ttl)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Erreur lors de l'écriture des conversations: {str(e)}")
+
+    @staticmethod
+    def _load(telegram_id: int) -> ConversationState:
+        telegram_user = resolve_telegram_user(telegram_id)
+        if telegram_user is None:
+            return ConversationState(telegram_id, None, None)
+
+        conversation, _ = TelegramConversation.objects.get_or_create(telegram_user=telegram_user)
+        return ConversationState(
+            telegram_id,
+            conversation.pk,
+            telegram_user.pk,
+            conversation.state,
+            conversation.context_data,
+            conversation.updated_at
+        )
+
+    @staticmethod
+    def _write(conversations) -> Dict[int, Any]:
+        """
+        Écritures conditionnelles ; retourne la nouvelle date de modification
+        des conversations écrites, par telegram_id (absentes : en conflit)
+        """
+        written = {}
+        now = timezone.now()
+        with transaction.atomic():
+            for conversation in conversations:
+                updated = TelegramConversation.objects.filter(
+                    pk=conversation.pk,
+                    updated_at=conversation.updated_at
+                ).update(
+                    state=conversation.state,
+                    context_data=conversation.context_data,
+                    updated_at=now
+                )
+                if updated:
+                    written[conversation.telegram_id] = now
+                else:
+                    logger.warning(
+                        f"Conversation {conversation.telegram_id} modifiée en base, écriture différée abandonnée"
+                    )
+        return written
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    """Retourne le store de conversations du client du processus courant"""
+    global _store
+    client = get_bot_client()
+    if _store is None or _store.client is not client:
+        with _store_lock:
+            if _store is None or _store.client is not client:
+                _store = ConversationStore(
+                    client=client,
+                    ttl=settings.TELEGRAM_CONVERSATION_CACHE_TTL,
+                    flush_interval=settings.TELEGRAM_CONVERSATION_FLUSH_INTERVAL,
+                    lock_ttl=settings.TELEGRAM_CONVERSATION_LOCK_TTL
+                )
+    return _store
+
+
+def invalidate_conversations(telegram_ids):
+    """
+    Invalide le cache après une modification directe en base (admin,
+    commande de nettoyage). Utilisable hors de la boucle du bot.
+    """
+    telegram_ids = list(telegram_ids)
+    cache.delete_many([_cache_key(telegram_id) for telegram_id in telegram_ids])
+    if _store is not None:
+        for telegram_id in telegram_ids:
+            _store.discard(telegram_id)
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, List, Any, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import TelegramUser, TelegramDigestEvent
+from .client import BotClient, get_bot_client
+from .outbox import get_outbox
+
+logger = logging.getLogger(__name__)
+
+
+def _sent_key(owner_id: int) -> str:
+    return f"telegram:digest:{owner_id}"
+
+
+def render_digest(events: List[str], max_events: int) -> str:
+    """Texte du message regroupant les événements d'une fenêtre"""
+    if len(events) == 1:
+        return events[0]
+    lines = [f"🔔 {len(events)} nouveautés sur vos propriétés", ""]
+    lines.extend(f"• {event}" for event in events[:max_events])
+    if len(events) > max_events:
+        lines.append(f"… et {len(events) - max_events} autres")
+    return "\n".join(lines)
+
+
+def record_digest_event(owner_id: int, text: str):
+    """Enregistre un événement à notifier (dans la transaction qui le déclenche)"""
+    TelegramDigestEvent.objects.create(owner_id=owner_id, text=text)
+
+
+def claim_digest_events(owner_id: int) -> List[str]:
+    """
+    Retire de la base les événements en attente du propriétaire et retourne
+    leurs textes. Les lignes sont verrouillées : deux processus ne les
+    envoient pas deux fois.
+    """
+    with transaction.atomic():
+        events = list(
+            TelegramDigestEvent.objects.select_for_update()
+            .filter(owner_id=owner_id)
+            .order_by('pk')
+            .values_list('pk', 'text')
+        )
+        if events:
+            TelegramDigestEvent.objects.filter(pk__in=[pk for pk, _ in events]).delete()
+    return [text for _, text in events]
+
+
+class DigestBuffer:
+    """
+    Regroupe les notifications destinées à un même propriétaire.
+
+    Les événements sont enregistrés en base (TelegramDigestEvent). Le premier
+    ouvre une fenêtre de `window` secondes à la fin de laquelle tous les
+    événements en attente du propriétaire, quel que soit le processus qui les
+    a reçus, sont envoyés en un seul message. Une clé du cache partagé
+    garantit au plus un envoi par destinataire et par fenêtre : un digest prêt
+    trop tôt est reporté à la fin de la fenêtre en cours. Les événements
+    prioritaires (transaction acceptée) sont envoyés immédiatement, avec les
+    événements déjà en attente. Un balayage périodique envoie les événements
+    dont le processus s'est arrêté avant la fin de leur fenêtre.
+    """
+
+    def __init__(self, client: BotClient, window: float, max_events: int):
+        self.client = client
+        self.window = window
+        self.max_events = max_events
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self._sweeper = None
+        self._stats_lock = threading.Lock()
+        self._sent = 0
+        self._events = 0
+        self._deferred = 0
+        self._unlinked = 0
+        client.add_shutdown_hook(self.drain)
+
+    def notify(self, owner_id: int, immediate: bool = False):
+        """
+        Programme le digest d'un propriétaire dont un événement vient d'être
+        enregistré (depuis n'importe quel thread)
+        """
+        self.client.loop.call_soon_threadsafe(self._schedule, owner_id, immediate)
+
+    def start(self):
+        """Démarre le balayage des événements en attente (depuis n'importe quel thread)"""
+        self.client.loop.call_soon_threadsafe(self._ensure_started)
+
+    def pending(self) -> int:
+        """Nombre de destinataires ayant un digest programmé dans ce processus"""
+        return len(self._timers)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                'pending': len(self._timers),
+                'sent': self._sent,
+                'events': self._events,
+                'deferred': self._deferred,
+                'unlinked': self._unlinked,
+            }
+
+    async def drain(self):
+        """Envoie immédiatement les digests programmés (arrêt propre)"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for owner_id in list(self._timers):
+            self._flush(owner_id, immediate=True)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _ensure_started(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    def _schedule(self, owner_id: int, immediate: bool, delay: Optional[float] = None):
+        self._ensure_started()
+        if immediate:
+            self._flush(owner_id, immediate=True)
+        elif owner_id not in self._timers:
+            self._timers[owner_id] = asyncio.get_running_loop().call_later(
+                self.window if delay is None else delay, self._flush, owner_id
+            )
+
+    def _flush(self, owner_id: int, immediate: bool = False):
+        timer = self._timers.pop(owner_id, None)
+        if timer is not None:
+            timer.cancel()
+        task = asyncio.get_running_loop().create_task(self._send(owner_id, immediate))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, owner_id: int, immediate: bool):
+        try:
+            key = _sent_key(owner_id)
+            if immediate:
+                await cache.aset(key, time.time(), self.window)
+            elif not await cache.aadd(key, time.time(), self.window):
+                # Un digest a déjà été envoyé dans la fenêtre (par un autre
+                # processus) : report à la fin de cette fenêtre
+                sent_at = await cache.aget(key)
+                remaining = self.window - (time.time() - sent_at) if sent_at else self.window
+                with self._stats_lock:
+                    self._deferred += 1
+                self._schedule(owner_id, immediate=False, delay=max(remaining, 0.01))
+                return
+
+            chat_id = await TelegramUser.objects.filter(
+                user_id=owner_id,
+                is_active=True
+            ).values_list('telegram_id', flat=True).afirst()
+            events = await sync_to_async(claim_digest_events)(owner_id)
+            if not events:
+                # Déjà envoyés par un autre processus
+                return
+            if chat_id is None:
+                with self._stats_lock:
+                    self._unlinked += 1
+                return
+
+            await get_outbox().send(chat_id, render_digest(events, self.max_events))
+            with self._stats_lock:
+                self._sent += 1
+                self._events += len(events)
+        except Exception as e:
+            logger.error(f"Erreur lors de l'envoi du digest de l'utilisateur {owner_id}: {str(e)}")
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self._sweep()
+            except Exception as e:
+                logger.error(f"Erreur lors du balayage des digests: {str(e)}")
+
+    async def _sweep(self):
+        """Envoie les événements plus anciens qu'une fenêtre sans digest programmé ici"""
+        threshold = timezone.now() - timedelta(seconds=self.window)
+        owners = [
+            owner_id async for owner_id in TelegramDigestEvent.objects.filter(
+                created_at__lt=threshold
+            ).order_by('owner_id').values_list('owner_id', flat=True).distinct()
+        ]
+        for owner_id in owners:
+            if owner_id not in self._timers:
+                self._flush(owner_id)
+
+
+_digests = None
+_digests_lock = threading.Lock()
+
+
+def get_digests() -> DigestBuffer:
+    """Retourne le regroupement de notifications du client du processus courant"""
+    global _digests
+    client = get_bot_client()
+    if _digests is None or _digests.client is not client:
+        with _digests_lock:
+            if _digests is None or _digests.client is not client:
+                _digests = DigestBuffer(
+                    client=client,
+                    window=settings.TELEGRAM_DIGEST_WINDOW,
+                    max_events=settings.TELEGRAM_DIGEST_MAX_EVENTS
+                )
+    return _digests
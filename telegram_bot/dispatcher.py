@@ -0,0 +1,525 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Callable, Optional, Dict, Any
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from telegram import Update
+
+from .models import TelegramUpdate, TelegramUpdateReceipt
+from .client import BotClient, get_bot_client, get_bot_service
+from .caches import BoundedLRU
+from .media_groups import album_delay, claim_album, earlier_albums
+
+logger = logging.getLogger(__name__)
+
+
+_seen_updates = None
+
+
+def get_seen_updates() -> BoundedLRU:
+    """update_id récemment reçus par ce processus"""
+    global _seen_updates
+    if _seen_updates is None:
+        _seen_updates = BoundedLRU(
+            settings.TELEGRAM_UPDATE_DEDUP_SIZE,
+            ttl=dedup_window().total_seconds()
+        )
+    return _seen_updates
+
+
+def dedup_window() -> timedelta:
+    """Durée pendant laquelle un update_id déjà reçu est considéré comme une re-livraison"""
+    return timedelta(hours=settings.TELEGRAM_UPDATE_DEDUP_HOURS)
+
+
+# Types d'update traités par TelegramBotService.handle_update ; les autres
+# (publications de canaux, sondages, membres de chats...) sont ignorés avant
+# toute persistance ou construction d'objet
+SUPPORTED_UPDATE_TYPES = ('message', 'edited_message', 'callback_query', 'inline_query')
+
+
+def is_supported_update(data: Dict[str, Any]) -> bool:
+    """Vérifie sur le JSON brut que l'update est d'un type traité par le bot"""
+    return any(key in data for key in SUPPORTED_UPDATE_TYPES)
+
+
+# Types d'update jetables, traités sans persistance ni file : une requête
+# inline est envoyée à chaque frappe et seule la réponse immédiate compte
+DIRECT_UPDATE_TYPES = ('inline_query',)
+
+
+def is_direct_update(data: Dict[str, Any]) -> bool:
+    return any(key in data for key in DIRECT_UPDATE_TYPES)
+
+
+def answer_directly(data: Dict[str, Any]) -> concurrent.futures.Future:
+    """
+    Traite un update jetable sur la boucle du bot, sans attendre (appelable
+    depuis n'importe quel thread ou boucle). Les erreurs sont journalisées
+    par le service.
+    """
+    return asyncio.run_coroutine_threadsafe(_handle_directly(data), get_bot_client().loop)
+
+
+async def _handle_directly(data: Dict[str, Any]):
+    service = get_bot_service()
+    await service.handle_update(Update.de_json(data, service.bot))
+
+
+# Types d'update portant un message (et donc un chat)
+_MESSAGE_KEYS = ('message', 'edited_message', 'channel_post', 'edited_channel_post')
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """
+    Identifiant du chat d'un update brut (à défaut, celui de l'émetteur),
+    sans construire l'objet Update
+    """
+    for key in _MESSAGE_KEYS:
+        if key in data:
+            return data[key].get('chat', {}).get('id')
+    callback_query = data.get('callback_query')
+    if callback_query is not None and callback_query.get('message'):
+        return callback_query['message'].get('chat', {}).get('id')
+    for value in data.values():
+        if isinstance(value, dict) and isinstance(value.get('from'), dict):
+            return value['from'].get('id')
+    return None
+
+
+def update_media_group_id(data: Dict[str, Any]) -> Optional[str]:
+    """Album d'un nouveau message (une modification de message est traitée seule)"""
+    message = data.get('message')
+    return message.get('media_group_id') if isinstance(message, dict) else None
+
+
+def store_update(data: Dict[str, Any]) -> Optional[int]:
+    """
+    Persiste un update reçu de Telegram et retourne sa clé primaire, ou None
+    si cet update_id a déjà été reçu dans la fenêtre de déduplication
+    (re-livraison par Telegram).
+    """
+    seen_updates = get_seen_updates()
+    update_id = data['update_id']
+    if update_id in seen_updates:
+        return None
+
+    now = timezone.now()
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                TelegramUpdateReceipt.objects.create(update_id=update_id, received_at=now)
+        except IntegrityError:
+            # Déjà reçu : accepté seulement si le reçu a expiré (update_id réutilisé).
+            # L'UPDATE conditionnel ne réussit que pour un seul processus
+            if not TelegramUpdateReceipt.objects.filter(
+                update_id=update_id,
+                received_at__lt=now - dedup_window()
+            ).update(received_at=now):
+                seen_updates.set(update_id)
+                return None
+
+        stored_pk = TelegramUpdate.objects.create(
+            update_id=update_id,
+            payload=data,
+            chat_id=update_chat_id(data),
+            media_group_id=update_media_group_id(data)
+        ).pk
+
+    seen_updates.set(update_id)
+    return stored_pk
+
+
+async def process_update(update_pk: int, retry_later: Optional[Callable[[float], None]] = None) -> Optional[bool]:
+    """
+    Traite un update persisté. Le passage à l'état 'processing' est
+    conditionnel : un update déjà pris par un autre worker est ignoré
+    (retourne None, ni succès ni échec).
+
+    Les albums du chat reçus avant l'update sont traités d'abord. Une partie
+    d'album déclenche le traitement de l'album complet ; tant qu'il ne l'est
+    pas, l'update reste 'pending' et `retry_later(délai)` est appelé (à
+    défaut, l'attente se fait ici).
+
+    L'ordre par chat vaut entre processus : tant qu'un update précédent du
+    chat est traité ailleurs (ou attend le balayage), l'update reste 'pending'
+    et `retry_later(délai)` est appelé (à défaut, retourne None).
+    """
+    await sync_to_async(close_old_connections)()
+
+    stored = await TelegramUpdate.objects.filter(pk=update_pk, status='pending').afirst()
+    if stored is None:
+        return None
+
+    if stored.chat_id is not None:
+        albums = await sync_to_async(earlier_albums)(stored.chat_id, stored.pk, stored.media_group_id)
+        if albums and await sync_to_async(has_earlier_unfinished)(stored):
+            return _wait_for_chat(retry_later)
+        for media_group_id in albums:
+            await process_album(stored.chat_id, media_group_id)
+        if await sync_to_async(has_earlier_unfinished)(stored):
+            return _wait_for_chat(retry_later)
+
+    if stored.media_group_id:
+        while True:
+            delay = await sync_to_async(album_delay)(stored.chat_id, stored.media_group_id)
+            if delay is None:
+                return await process_album(stored.chat_id, stored.media_group_id)
+            if retry_later is not None:
+                retry_later(delay)
+                return None
+            await asyncio.sleep(delay)
+
+    claimed = await TelegramUpdate.objects.filter(pk=update_pk, status='pending').aupdate(
+        status='processing',
+        attempts=F('attempts') + 1
+    )
+    if not claimed:
+        return None
+
+    service = get_bot_service()
+    try:
+        # Updates persistés avant le filtrage du webhook : inutile de les décoder
+        if is_supported_update(stored.payload):
+            update = Update.de_json(stored.payload, service.bot)
+            await service.handle_update(update)
+    except Exception as e:
+        logger.error(f"Erreur lors du traitement de l'update {stored.update_id}: {str(e)}")
+        await TelegramUpdate.objects.filter(pk=update_pk).aupdate(
+            status='failed',
+            error=str(e),
+            processed_at=timezone.now()
+        )
+        return False
+
+    await TelegramUpdate.objects.filter(pk=update_pk).aupdate(
+        status='done',
+        processed_at=timezone.now()
+    )
+    return True
+
+
+def has_earlier_unfinished(stored: TelegramUpdate) -> bool:
+    """
+    Un update précédent du chat est en cours de traitement, ou en attente hors
+    album (pris par un autre processus, ou refusé et en attente du balayage).
+    Les albums précédents en attente sont traités avec l'update.
+    """
+    earlier = TelegramUpdate.objects.filter(chat_id=stored.chat_id, pk__lt=stored.pk).filter(
+        Q(status='processing') | Q(status='pending', media_group_id__isnull=True)
+    )
+    if stored.media_group_id:
+        earlier = earlier.exclude(media_group_id=stored.media_group_id)
+    return earlier.exists()
+
+
+def _wait_for_chat(retry_later: Optional[Callable[[float], None]]) -> None:
+    """Update laissé 'pending' derrière un update précédent de son chat"""
+    if retry_later is not None:
+        retry_later(settings.TELEGRAM_UPDATE_ORDER_DELAY)
+    return None
+
+
+async def process_album(chat_id: int, media_group_id: str) -> Optional[bool]:
+    """Traite en une fois les parties en attente d'un album (None si déjà prises)"""
+    parts = await sync_to_async(claim_album)(chat_id, media_group_id)
+    if not parts:
+        return None
+
+    pks = [part.pk for part in parts]
+    service = get_bot_service()
+    try:
+        messages = {}
+        for part in parts:
+            message = Update.de_json(part.payload, service.bot).message
+            # Une re-livraison du même message n'est comptée qu'une fois
+            messages[message.message_id] = message
+        await service.handle_media_group([messages[message_id] for message_id in sorted(messages)])
+    except Exception as e:
+        logger.error(f"Erreur lors du traitement de l'album {media_group_id}: {str(e)}")
+        await TelegramUpdate.objects.filter(pk__in=pks).aupdate(
+            status='failed',
+            error=str(e),
+            processed_at=timezone.now()
+        )
+        return False
+
+    await TelegramUpdate.objects.filter(pk__in=pks).aupdate(
+        status='done',
+        processed_at=timezone.now()
+    )
+    return True
+
+
+class UpdateDispatcher:
+    """
+    Traitement des updates persistés, sur la boucle asyncio du bot.
+
+    Les updates sont répartis sur `workers` files selon leur chat
+    (chat_id % workers), chaque file étant traitée par un seul worker : les
+    updates d'un même chat sont traités dans leur ordre d'arrivée, ceux de
+    chats différents en parallèle. Entre processus (plusieurs workers web),
+    un update dont le chat a un update précédent traité ailleurs est
+    revérifié dans sa file après TELEGRAM_UPDATE_ORDER_DELAY secondes (voir
+    process_update). Au plus `queue_size` updates sont en
+    attente au total ; au-delà, l'update reste 'pending' en base et sera
+    repris par le balayage périodique. Les updates suivants du même chat sont
+    alors refusés eux aussi jusqu'à ce que le balayage les ait remis en file
+    dans l'ordre : un update ne passe jamais devant un update refusé de son chat.
+    """
+
+    def __init__(self, client: BotClient, workers: int, queue_size: int, sweep_delay: int = 5):
+        self.client = client
+        self.workers = max(workers, 1)
+        self.queue_size = queue_size
+        self.sweep_delay = sweep_delay
+        self._queues = None
+        self._sweeper = None
+        self._stats_lock = threading.Lock()
+        self._backlog = 0
+        self._in_flight = 0
+        # Updates en attente d'être revérifiés (album incomplet, update
+        # précédent du chat traité par un autre processus)
+        self._waiting = 0
+        self._processed = 0
+        self._failed = 0
+        self._skipped = 0
+        self._rejected = 0
+        # Updates en file ou en cours de traitement, ignorés par le balayage
+        self._queued = set()
+        # Chats ayant des updates refusés : nombre de refus, par chat
+        self._deferred_chats: Dict[int, int] = {}
+        self._shards = [
+            {'depth': 0, 'processed': 0, 'latencies': deque(maxlen=200)}
+            for _ in range(self.workers)
+        ]
+
+    def shard_for(self, update_pk: int, chat_id: Optional[int] = None) -> int:
+        """File d'un update : celle de son chat (à défaut, répartition par update)"""
+        return (chat_id if chat_id is not None else update_pk) % self.workers
+
+    def submit(self, update_pk: int, chat_id: Optional[int] = None, sweeping: bool = False) -> bool:
+        """
+        Place un update dans la file de son chat sans bloquer (appelable depuis
+        n'importe quel thread). Retourne False si l'update est refusé : file
+        pleine (backpressure), ou updates précédents du chat encore en attente
+        du balayage (`sweeping` : appel par le balayage, qui les remet en file).
+        """
+        shard = self.shard_for(update_pk, chat_id)
+        with self._stats_lock:
+            if update_pk in self._queued:
+                return True
+            if chat_id in self._deferred_chats and not sweeping:
+                self._reject(update_pk, chat_id)
+                return False
+            if self._backlog >= self.queue_size:
+                self._reject(update_pk, chat_id)
+                logger.warning(f"File des updates pleine, update {update_pk} différé")
+                return False
+            self._queued.add(update_pk)
+            self._backlog += 1
+            self._shards[shard]['depth'] += 1
+
+        asyncio.run_coroutine_threadsafe(
+            self._enqueue(shard, update_pk, time.monotonic()),
+            self.client.loop
+        )
+        return True
+
+    def _reject(self, update_pk: int, chat_id: Optional[int]):
+        """Refus d'un update (verrou des statistiques tenu)"""
+        self._rejected += 1
+        if chat_id is not None:
+            self._deferred_chats[chat_id] = self._deferred_chats.get(chat_id, 0) + 1
+
+    def is_full(self) -> bool:
+        with self._stats_lock:
+            return self._backlog >= self.queue_size
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiques de la file pour la supervision"""
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self._backlog,
+                'queue_capacity': self.queue_size,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'processed': self._processed,
+                'failed': self._failed,
+                'skipped': self._skipped,
+                'rejected': self._rejected,
+                'deferred_chats': len(self._deferred_chats),
+                'shards': [
+                    {
+                        'shard': index,
+                        'queue_depth': shard['depth'],
+                        'processed': shard['processed'],
+                        **_latency_stats(shard['latencies']),
+                    }
+                    for index, shard in enumerate(self._shards)
+                ],
+            }
+
+    async def join(self, interval: float = 0.01):
+        """Attend que tous les updates soumis aient été traités"""
+        while True:
+            with self._stats_lock:
+                if not self._backlog and not self._in_flight and not self._waiting:
+                    return
+            await asyncio.sleep(interval)
+
+    def shutdown(self):
+        """Arrête le balayage périodique"""
+        if self._sweeper is not None:
+            self.client.loop.call_soon_threadsafe(self._sweeper.cancel)
+            self._sweeper = None
+
+    async def _enqueue(self, shard: int, update_pk: int, enqueued_at: float):
+        self._ensure_started()
+        self._queues[shard].put_nowait((update_pk, enqueued_at))
+
+    def _ensure_started(self):
+        """Crée les files et les workers sur la boucle du bot (appelé depuis la boucle)"""
+        loop = asyncio.get_running_loop()
+        if self._queues is None:
+            self._queues = [asyncio.Queue() for _ in range(self.workers)]
+            for shard in range(self.workers):
+                loop.create_task(self._worker(shard))
+        if self._sweeper is None:
+            self._sweeper = loop.create_task(self._sweep_loop())
+
+    async def _worker(self, shard: int):
+        queue = self._queues[shard]
+        while True:
+            update_pk, enqueued_at = await queue.get()
+            with self._stats_lock:
+                self._backlog -= 1
+                self._shards[shard]['depth'] -= 1
+                self._in_flight += 1
+            result = False
+            retried = []
+
+            def retry_later(delay, update_pk=update_pk):
+                # Album incomplet ou chat occupé ailleurs : revérifié dans la même file, qu'il ne quitte pas
+                retried.append(update_pk)
+                asyncio.get_running_loop().call_later(delay, self._retry, shard, update_pk)
+
+            try:
+                result = await process_update(update_pk, retry_later)
+            except Exception as e:
+                logger.error(f"Erreur inattendue dans le dispatcher: {str(e)}")
+            finally:
+                with self._stats_lock:
+                    self._in_flight -= 1
+                    if retried:
+                        self._waiting += 1
+                    else:
+                        self._queued.discard(update_pk)
+                        self._count(shard, result, enqueued_at)
+
+    def _count(self, shard: int, result: Optional[bool], enqueued_at: float):
+        """Statistiques d'un update traité (verrou des statistiques tenu)"""
+        if result is None:
+            # Déjà pris par un autre worker ou processus
+            self._skipped += 1
+            return
+        if result:
+            self._processed += 1
+        else:
+            self._failed += 1
+        self._shards[shard]['processed'] += 1
+        self._shards[shard]['latencies'].append(time.monotonic() - enqueued_at)
+
+    def _retry(self, shard: int, update_pk: int):
+        """Remet en file un update dont l'attente est écoulée"""
+        with self._stats_lock:
+            self._waiting -= 1
+            self._backlog += 1
+            self._shards[shard]['depth'] += 1
+        self._queues[shard].put_nowait((update_pk, time.monotonic()))
+
+    async def _sweep_loop(self):
+        """Remet en file les updates restés 'pending' (file pleine, redémarrage)"""
+        while True:
+            await asyncio.sleep(self.sweep_delay)
+            try:
+                await self._sweep()
+            except Exception as e:
+                logger.error(f"Erreur lors du balayage des updates en attente: {str(e)}")
+
+    async def _sweep(self):
+        with self._stats_lock:
+            free_slots = self.queue_size - self._backlog
+            queued = list(self._queued)
+            deferred = dict(self._deferred_chats)
+        if free_slots <= 0:
+            return
+
+        # Updates anciens, et tous ceux des chats ayant des updates refusés,
+        # dans leur ordre d'arrivée ; ceux déjà en file sont ignorés
+        threshold = timezone.now() - timedelta(seconds=self.sweep_delay)
+        pending = [
+            row async for row in TelegramUpdate.objects.filter(
+                Q(created_at__lt=threshold) | Q(chat_id__in=list(deferred)),
+                status='pending'
+            ).exclude(pk__in=queued).order_by('pk').values_list('pk', 'chat_id')[:free_slots]
+        ]
+        for update_pk, chat_id in pending:
+            if not self.submit(update_pk, chat_id, sweeping=True):
+                return
+
+        if not deferred:
+            return
+        with self._stats_lock:
+            queued = list(self._queued)
+        waiting = {
+            chat_id async for chat_id in TelegramUpdate.objects.filter(
+                status='pending',
+                chat_id__in=list(deferred)
+            ).exclude(pk__in=queued).values_list('chat_id', flat=True)
+        }
+        with self._stats_lock:
+            for chat_id, rejections in deferred.items():
+                # Chat libéré s'il n'a plus d'update en attente et aucun nouveau refus
+                if chat_id not in waiting and self._deferred_chats.get(chat_id) == rejections:
+                    del self._deferred_chats[chat_id]
+
+
+def _latency_stats(latencies) -> Dict[str, Any]:
+    """Latence (attente en file + traitement) moyenne et 95e centile, en ms"""
+    values = sorted(latencies)
+    if not values:
+        return {'latency_avg_ms': None, 'latency_p95_ms': None}
+    return {
+        'latency_avg_ms': round(sum(values) / len(values) * 1000, 1),
+        'latency_p95_ms': round(values[max(int(len(values) * 0.95) - 1, 0)] * 1000, 1),
+    }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> UpdateDispatcher:
+    """Retourne le dispatcher du processus courant (recréé avec le client après un fork)"""
+    global _dispatcher
+    client = get_bot_client()
+    if _dispatcher is None or _dispatcher.client is not client:
+        with _dispatcher_lock:
+            if _dispatcher is None or _dispatcher.client is not client:
+                _dispatcher = UpdateDispatcher(
+                    client=client,
+                    workers=settings.TELEGRAM_UPDATE_WORKERS,
+                    queue_size=settings.TELEGRAM_UPDATE_QUEUE_SIZE
+                )
+    return _dispatcher
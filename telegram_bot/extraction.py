@@ -0,0 +1,42 @@
+import re
+from typing import Optional, Callable, List, Tuple
+
+
+class PrioritizedPatterns:
+    """
+    Liste ordonnée de patterns compilés une seule fois.
+
+    Le premier pattern de la liste qui correspond l'emporte (avec sa
+    correspondance la plus à gauche), les patterns suivants n'étant essayés
+    que si sa valeur est refusée par `accept`.
+    """
+
+    def __init__(self, patterns: List[str], flags: int = 0):
+        self.patterns = tuple(re.compile(pattern, flags) for pattern in patterns)
+
+    def first(self, text: str, accept: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """Retourne le groupe capturé par le premier pattern accepté"""
+        for pattern in self.patterns:
+            match = pattern.search(text)
+            if match is None:
+                continue
+            value = match.group(1) if pattern.groups else match.group(0)
+            if accept is None or accept(value):
+                return value
+        return None
+
+
+class KeywordMatcher:
+    """
+    Détection d'un vocabulaire de mots-clés, le premier mot-clé du
+    vocabulaire présent dans le texte l'emportant.
+    """
+
+    def __init__(self, vocabulary: dict):
+        self.vocabulary: Tuple[Tuple[str, str], ...] = tuple(vocabulary.items())
+
+    def first(self, text: str) -> Optional[str]:
+        for keyword, value in self.vocabulary:
+            if keyword in text:
+                return value
+        return None
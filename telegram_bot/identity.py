@@ -0,0 +1,107 @@
+import threading
+from typing import Optional, Dict, Any
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import TelegramUser
+from .caches import BoundedLRU
+
+# Marqueur des comptes non liés (cache négatif)
+_NOT_LINKED = 'not-linked'
+
+_local = None
+_local_lock = threading.Lock()
+_shared_stats = {'hits': 0, 'misses': 0}
+
+
+def _cache_key(telegram_id: int) -> str:
+    return f"telegram:user:{telegram_id}"
+
+
+def get_local_identities() -> BoundedLRU:
+    """
+    Cache local au processus (court TTL : une invalidation faite par un autre
+    processus y est visible au plus tard après TELEGRAM_USER_LOCAL_TTL secondes)
+    """
+    global _local
+    if _local is None:
+        with _local_lock:
+            if _local is None:
+                _local = BoundedLRU(settings.TELEGRAM_USER_CACHE_SIZE, ttl=settings.TELEGRAM_USER_LOCAL_TTL)
+    return _local
+
+
+def _queryset():
+    # L'utilisateur TaskMarket est chargé avec le compte lié pour les contrôles de droits
+    return TelegramUser.objects.select_related('user').filter(is_active=True)
+
+
+def _from_local(telegram_id: int):
+    return get_local_identities().get(telegram_id)
+
+
+def _remember(telegram_id: int, telegram_user: Optional[TelegramUser]):
+    get_local_identities().set(telegram_id, telegram_user or _NOT_LINKED)
+
+
+def _count_shared(hit: bool):
+    with _local_lock:
+        _shared_stats['hits' if hit else 'misses'] += 1
+
+
+def resolve_telegram_user(telegram_id: int) -> Optional[TelegramUser]:
+    """
+    Compte Telegram actif (avec son utilisateur) pour un telegram_id, ou None.
+    Cache local, puis cache partagé, puis base.
+    """
+    cached = _from_local(telegram_id)
+    if cached is not None:
+        return None if cached == _NOT_LINKED else cached
+
+    cached = cache.get(_cache_key(telegram_id))
+    _count_shared(cached is not None)
+    if cached is None:
+        telegram_user = _queryset().filter(telegram_id=telegram_id).first()
+        cache.set(_cache_key(telegram_id), telegram_user or _NOT_LINKED, settings.TELEGRAM_USER_CACHE_TTL)
+    else:
+        telegram_user = None if cached == _NOT_LINKED else cached
+
+    _remember(telegram_id, telegram_user)
+    return telegram_user
+
+
+async def aresolve_telegram_user(telegram_id: int) -> Optional[TelegramUser]:
+    """Version asynchrone de resolve_telegram_user (boucle du bot)"""
+    cached = _from_local(telegram_id)
+    if cached is not None:
+        return None if cached == _NOT_LINKED else cached
+
+    cached = await cache.aget(_cache_key(telegram_id))
+    _count_shared(cached is not None)
+    if cached is None:
+        telegram_user = await _queryset().filter(telegram_id=telegram_id).afirst()
+        await cache.aset(_cache_key(telegram_id), telegram_user or _NOT_LINKED, settings.TELEGRAM_USER_CACHE_TTL)
+    else:
+        telegram_user = None if cached == _NOT_LINKED else cached
+
+    _remember(telegram_id, telegram_user)
+    return telegram_user
+
+
+def invalidate_telegram_user(telegram_id: int):
+    """À appeler après une liaison, une déliaison ou un changement d'état du compte"""
+    cache.delete(_cache_key(telegram_id))
+    get_local_identities().pop(telegram_id)
+
+
+def identity_stats() -> Dict[str, Any]:
+    """Taux de succès des caches d'identité, pour la supervision"""
+    with _local_lock:
+        shared = dict(_shared_stats)
+    lookups = shared['hits'] + shared['misses']
+    shared['hit_rate'] = round(shared['hits'] / lookups, 3) if lookups else None
+    return {
+        'local': get_local_identities().stats(),
+        'shared': shared,
+    }
@@ -0,0 +1,74 @@
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from properties.models import Property
+
+# Préfixe des callback_data des boutons de pagination de /list
+LIST_CALLBACK_PREFIX = 'list:'
+
+# Projection compacte d'une propriété : (id, titre, localisation, prix, disponible)
+ListingRow = Tuple[int, str, str, float, bool]
+
+
+def _cache_key(owner_id: int) -> str:
+    return f"telegram:listing:{owner_id}"
+
+
+def _load_listing(owner_id: int) -> List[ListingRow]:
+    return [
+        (pk, title, location, float(price), is_available)
+        for pk, title, location, price, is_available in Property.objects.filter(owner_id=owner_id)
+        .order_by('-created_at', '-pk')
+        .values_list('pk', 'title', 'location', 'price', 'is_available')
+    ]
+
+
+def get_owner_listing(owner_id: int) -> List[ListingRow]:
+    """
+    Propriétés d'un propriétaire sous forme compacte, depuis le cache partagé.
+    La projection est invalidée à chaque modification de ses propriétés.
+    """
+    return cache.get_or_set(
+        _cache_key(owner_id),
+        lambda: _load_listing(owner_id),
+        settings.TELEGRAM_LIST_CACHE_TTL
+    )
+
+
+def invalidate_owner_listing(owner_id: int):
+    cache.delete(_cache_key(owner_id))
+
+
+def format_price(price: float) -> str:
+    return f"{price:,.0f}".replace(',', ' ')
+
+
+def render_listing_page(listing: List[ListingRow], page: int,
+                        page_size: Optional[int] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Texte et clavier de navigation d'une page de /list"""
+    page_size = page_size or settings.TELEGRAM_LIST_PAGE_SIZE
+    if not listing:
+        return "🏠 Vous n'avez encore aucune propriété.\n\nUtilisez /add pour en ajouter une.", None
+
+    pages = (len(listing) + page_size - 1) // page_size
+    page = min(max(page, 0), pages - 1)
+    start = page * page_size
+
+    lines = [f"🏠 Vos propriétés ({len(listing)}) — page {page + 1}/{pages}", ""]
+    for index, (pk, title, location, price, is_available) in enumerate(listing[start:start + page_size], start + 1):
+        status = "✅ Disponible" if is_available else "⛔ Indisponible"
+        lines.append(f"{index}. {title}")
+        lines.append(f"   📍 {location} · 💰 {format_price(price)} FCFA · {status}")
+
+    if pages == 1:
+        return "\n".join(lines), None
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️ Précédent", callback_data=f"{LIST_CALLBACK_PREFIX}{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Suivant ▶️", callback_data=f"{LIST_CALLBACK_PREFIX}{page + 1}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons])
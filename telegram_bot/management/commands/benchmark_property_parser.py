@@ -0,0 +1,77 @@
+import json
+import re
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from telegram_bot.services import PropertyParserService
+
+CORPUS_PATH = Path(__file__).resolve().parents[2] / 'corpus' / 'property_listings.json'
+
+
+def _sequential_search(patterns, text):
+    """Référence : un re.search par pattern, sans compilation préalable"""
+    for pattern in patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            return match.group(1)
+    return None
+
+
+class Command(BaseCommand):
+    """Commande pour mesurer le débit du parseur de propriétés"""
+    help = 'Mesure le nombre de messages analysés par seconde sur le corpus d\'annonces'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Nombre de passages sur le corpus (défaut: 200)'
+        )
+        
+        parser.add_argument(
+            '--corpus',
+            type=str,
+            default=str(CORPUS_PATH),
+            help='Fichier JSON du corpus (liste d\'objets avec une clé "text")'
+        )
+    
+    def handle(self, *args, **options):
+        """Exécute la mesure"""
+        with open(options['corpus'], encoding='utf-8') as corpus_file:
+            texts = [entry['text'] for entry in json.load(corpus_file)]
+        iterations = options['iterations']
+        total = len(texts) * iterations
+        parser = PropertyParserService()
+        
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for text in texts:
+                parser.parse_property_info(text)
+        engine_rate = total / (time.perf_counter() - start)
+        
+        # Extraction seule, patterns précompilés contre re.search à chaque appel
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for text in texts:
+                text_lower = text.lower()
+                parser._extract_price(text_lower)
+                parser._extract_size(text_lower)
+                parser._extract_location(text)
+                parser._detect_property_type(text_lower)
+        extraction_rate = total / (time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for text in texts:
+                text_lower = text.lower()
+                _sequential_search(parser.price_patterns, text_lower)
+                _sequential_search(parser.size_patterns, text_lower)
+                _sequential_search(parser.location_patterns, text)
+                next((t for t in parser.property_types if t in text_lower), None)
+        sequential_rate = total / (time.perf_counter() - start)
+        
+        self.stdout.write(f'{len(texts)} annonces x {iterations} passages')
+        self.stdout.write(f'parse_property_info : {engine_rate:,.0f} messages/s')
+        self.stdout.write(f'extraction précompilée : {extraction_rate:,.0f} messages/s')
+        self.stdout.write(f'extraction re.search : {sequential_rate:,.0f} messages/s')
@@ -1,7 +1,10 @@
+import time
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
 from telegram_bot.models import TelegramConversation, TelegramLinkCode
+from telegram_bot.conversations import invalidate_conversations
 
 
 class Command(BaseCommand):
@@ -16,6 +19,20 @@ class Command(BaseCommand):
             help='Timeout en heures pour les conversations inactives (défaut: 24h)'
         )
         
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Nombre de lignes traitées par lot (défaut: 500)'
+        )
+        
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Pause en secondes entre deux lots (défaut: 0)'
+        )
+        
         parser.add_argument(
             '--dry-run',
             action='store_true',
@@ -26,29 +43,28 @@ class Command(BaseCommand):
         """Exécute le nettoyage"""
         timeout_hours = options['conversation_timeout']
         dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.sleep = options['sleep']
         
         # Calcul de la date limite
         timeout_date = timezone.now() - timedelta(hours=timeout_hours)
         
         # Nettoyage des conversations inactives
-        inactive_conversations = TelegramConversation.objects.filter(
-            state__ne='idle',
+        inactive_conversations = TelegramConversation.objects.exclude(state='idle').filter(
             updated_at__lt=timeout_date
         )
         
-        conv_count = inactive_conversations.count()
-        
         if dry_run:
             self.stdout.write(
                 self.style.WARNING(
-                    f'[DRY RUN] {conv_count} conversations seraient réinitialisées'
+                    f'[DRY RUN] {inactive_conversations.count()} conversations seraient réinitialisées'
                 )
             )
         else:
-            # Réinitialiser les conversations inactives
-            inactive_conversations.update(
-                state='idle',
-                context_data={}
+            conv_count = self._process_in_batches(
+                inactive_conversations,
+                self._reset_conversations,
+                'conversations réinitialisées'
             )
             
             self.stdout.write(
@@ -63,16 +79,18 @@ class Command(BaseCommand):
             is_used=False
         )
         
-        codes_count = expired_codes.count()
-        
         if dry_run:
             self.stdout.write(
                 self.style.WARNING(
-                    f'[DRY RUN] {codes_count} codes de liaison expirés seraient supprimés'
+                    f'[DRY RUN] {expired_codes.count()} codes de liaison expirés seraient supprimés'
                 )
             )
         else:
-            expired_codes.delete()
+            codes_count = self._process_in_batches(
+                expired_codes,
+                self._delete_codes,
+                'codes de liaison supprimés'
+            )
             
             self.stdout.write(
                 self.style.SUCCESS(
@@ -83,4 +101,60 @@ class Command(BaseCommand):
         if not dry_run:
             self.stdout.write(
                 self.style.SUCCESS('Nettoyage terminé avec succès !')
-            )
\ No newline at end of file
+            )
+    
+    def _process_in_batches(self, queryset, action, label):
+        """
+        Parcourt le queryset par lots ordonnés par clé primaire. Chaque lot est
+        traité dans une transaction courte ; `action` ré-applique le filtre
+        et retourne le nombre de lignes réellement modifiées.
+        """
+        last_pk = 0
+        total = 0
+        while True:
+            pks = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:self.batch_size]
+            )
+            if not pks:
+                break
+            
+            last_pk = pks[-1]
+            total += action(queryset.filter(pk__in=pks))
+            self.stdout.write(f'{total} {label} (dernier id: {last_pk})')
+            
+            if self.sleep:
+                time.sleep(self.sleep)
+        return total
+    
+    @staticmethod
+    def _reset_conversations(batch):
+        """
+        Réinitialise un lot de conversations. Les lignes verrouillées par une
+        autre transaction sont ignorées, et le filtre d'inactivité est ré-évalué
+        au moment de la mise à jour : une conversation reprise entre-temps n'est
+        pas touchée.
+        """
+        with transaction.atomic():
+            rows = list(
+                batch.select_for_update(skip_locked=True, of=('self',))
+                .values_list('pk', 'telegram_user__telegram_id')
+            )
+            if not rows:
+                return 0
+            # updated_at est modifié pour que les écritures différées du bot
+            # encore en attente sur ces conversations soient abandonnées
+            updated = batch.filter(pk__in=[pk for pk, _ in rows]).update(
+                state='idle',
+                context_data={},
+                updated_at=timezone.now()
+            )
+        invalidate_conversations(telegram_id for _, telegram_id in rows)
+        return updated
+    
+    @staticmethod
+    def _delete_codes(batch):
+        """Supprime un lot de codes (un code utilisé entre-temps est conservé)"""
+        deleted, _ = batch.delete()
+        return deleted
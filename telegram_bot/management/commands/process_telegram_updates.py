@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datetime import timedelta
+from telegram_bot.models import TelegramUpdate
+from telegram_bot.client import get_bot_client
+from telegram_bot.dispatcher import process_update
+
+
+class Command(BaseCommand):
+    """Commande pour traiter les updates Telegram restés en attente"""
+    help = 'Traite les updates Telegram en attente et relance ceux bloqués en cours de traitement'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-minutes',
+            type=int,
+            default=10,
+            help='Délai après lequel un update en cours est considéré bloqué (défaut: 10 min)'
+        )
+        
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Relance également les updates en échec'
+        )
+        
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=1000,
+            help='Nombre maximum d\'updates traités (défaut: 1000)'
+        )
+    
+    def handle(self, *args, **options):
+        """Exécute le traitement"""
+        stale_date = timezone.now() - timedelta(minutes=options['stale_minutes'])
+        
+        # Les updates bloqués (worker interrompu) repassent en attente
+        requeued = TelegramUpdate.objects.filter(
+            status='processing',
+            created_at__lt=stale_date
+        ).update(status='pending')
+        
+        if options['retry_failed']:
+            requeued += TelegramUpdate.objects.filter(status='failed').update(status='pending')
+        
+        if requeued:
+            self.stdout.write(f'{requeued} updates remis en attente')
+        
+        pending_ids = list(
+            TelegramUpdate.objects.filter(status='pending')
+            .order_by('pk')
+            .values_list('pk', flat=True)[:options['limit']]
+        )
+        
+        # Le traitement s'exécute sur la boucle du bot partagé
+        client = get_bot_client()
+        processed = 0
+        for update_pk in pending_ids:
+            if client.run(process_update(update_pk)):
+                processed += 1
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{processed}/{len(pending_ids)} updates traités avec succès'
+            )
+        )
@@ -0,0 +1,103 @@
+import gzip
+import json
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from telegram_bot.models import TelegramMessage
+
+
+class Command(BaseCommand):
+    """Commande pour appliquer la politique de rétention des messages Telegram"""
+    help = 'Archive et/ou supprime par lots les messages Telegram plus anciens que la durée de rétention'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.TELEGRAM_MESSAGE_RETENTION_DAYS,
+            help=f'Durée de rétention en jours (défaut: {settings.TELEGRAM_MESSAGE_RETENTION_DAYS})'
+        )
+
+        parser.add_argument(
+            '--archive',
+            default=None,
+            help='Fichier JSON Lines (compressé si .gz) où archiver les messages avant suppression'
+        )
+
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Nombre de messages supprimés par lot (défaut: 1000)'
+        )
+
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Pause en secondes entre deux lots (défaut: 0)'
+        )
+
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mode simulation - affiche ce qui serait supprimé sans le faire'
+        )
+
+    def handle(self, *args, **options):
+        """Exécute la purge"""
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        queryset = TelegramMessage.objects.filter(created_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'[DRY RUN] {queryset.count()} messages antérieurs au {cutoff:%d/%m/%Y} seraient supprimés'
+                )
+            )
+            return
+
+        archive = None
+        if options['archive']:
+            opener = gzip.open if options['archive'].endswith('.gz') else open
+            archive = opener(options['archive'], 'at', encoding='utf-8')
+
+        last_pk = 0
+        total = 0
+        try:
+            while True:
+                # Lots ordonnés par clé primaire : chaque suppression ne verrouille
+                # qu'un petit nombre de lignes
+                batch = list(
+                    queryset.filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .values()[:options['batch_size']]
+                )
+                if not batch:
+                    break
+
+                if archive is not None:
+                    for row in batch:
+                        archive.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                    archive.flush()
+
+                last_pk = batch[-1]['id']
+                pks = [row['id'] for row in batch]
+                deleted, _ = TelegramMessage.objects.filter(pk__in=pks).delete()
+                total += deleted
+                self.stdout.write(f'{total} messages supprimés (dernier id: {last_pk})')
+
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        finally:
+            if archive is not None:
+                archive.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{total} messages antérieurs au {cutoff:%d/%m/%Y} supprimés'
+            )
+        )
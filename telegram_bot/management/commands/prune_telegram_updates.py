@@ -0,0 +1,87 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from telegram_bot.dispatcher import dedup_window
+from telegram_bot.models import TelegramUpdate, TelegramUpdateReceipt
+
+
+class Command(BaseCommand):
+    """Commande pour appliquer la politique de rétention des updates Telegram"""
+    help = (
+        'Supprime par lots les updates Telegram traités plus anciens que la durée de rétention. '
+        'Les updates en attente ou en échec sont conservés. '
+        'Supprime aussi les reçus sortis de la fenêtre de déduplication.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.TELEGRAM_UPDATE_RETENTION_DAYS,
+            help=f'Durée de rétention en jours (défaut: {settings.TELEGRAM_UPDATE_RETENTION_DAYS})'
+        )
+
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Nombre d\'updates supprimés par lot (défaut: 1000)'
+        )
+
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Pause en secondes entre deux lots (défaut: 0)'
+        )
+
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Mode simulation - affiche ce qui serait supprimé sans le faire'
+        )
+
+    def handle(self, *args, **options):
+        """Exécute la purge"""
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        queryset = TelegramUpdate.objects.filter(status='done', created_at__lt=cutoff)
+        receipts = TelegramUpdateReceipt.objects.filter(received_at__lt=timezone.now() - dedup_window())
+
+        if options['dry_run']:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'[DRY RUN] {queryset.count()} updates antérieurs au {cutoff:%d/%m/%Y} '
+                    f'et {receipts.count()} reçus expirés seraient supprimés'
+                )
+            )
+            return
+
+        last_pk = 0
+        total = 0
+        while True:
+            pks = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not pks:
+                break
+
+            last_pk = pks[-1]
+            deleted, _ = TelegramUpdate.objects.filter(pk__in=pks).delete()
+            total += deleted
+            self.stdout.write(f'{total} updates supprimés (dernier id: {last_pk})')
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        # Reçus expirés : un update_id réutilisé est de toute façon accepté
+        expired, _ = receipts.delete()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{total} updates antérieurs au {cutoff:%d/%m/%Y} et {expired} reçus expirés supprimés'
+            )
+        )
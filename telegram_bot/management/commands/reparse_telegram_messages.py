@@ -0,0 +1,129 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from telegram_bot.models import TelegramMessage
+from telegram_bot.services import PropertyParserService
+
+_parser = PropertyParserService()
+
+
+def _parse_contents(contents):
+    """Analyse un lot de textes (exécuté dans les processus du pool)"""
+    results = []
+    for content in contents:
+        result = _parser.parse_property_info(content)
+        result.pop('description', None)
+        results.append(result)
+    return results
+
+
+class Command(BaseCommand):
+    """Commande pour ré-analyser l'historique des messages Telegram"""
+    help = 'Ré-analyse les messages Telegram avec la version courante du parseur de propriétés'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Nombre de messages lus et écrits par lot (défaut: 2000)'
+        )
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Nombre de processus d\'analyse (défaut: nombre de CPU, 1 = sans pool)'
+        )
+
+        parser.add_argument(
+            '--include-processed',
+            action='store_true',
+            help='Ré-analyse aussi les messages déjà traités par le bot'
+        )
+
+        parser.add_argument(
+            '--start-after',
+            type=int,
+            default=0,
+            help='Reprend après cet identifiant de message'
+        )
+
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Nombre maximum de messages à analyser'
+        )
+
+    def handle(self, *args, **options):
+        """Exécute la ré-analyse"""
+        batch_size = options['batch_size']
+        workers = options['workers']
+        limit = options['limit']
+        version = PropertyParserService.VERSION
+
+        # Les messages déjà à la version courante sont ignorés : relancer la
+        # commande après une interruption reprend là où elle s'était arrêtée
+        queryset = TelegramMessage.objects.filter(
+            message_type='text',
+            parser_version__lt=version
+        )
+        if not options['include_processed']:
+            queryset = queryset.filter(processed=False)
+
+        executor = None
+        if workers > 1:
+            # Les processus forkés ne doivent pas hériter des connexions ouvertes
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers)
+
+        last_pk = options['start_after']
+        total = 0
+        started_at = time.monotonic()
+
+        try:
+            while limit is None or total < limit:
+                size = batch_size if limit is None else min(batch_size, limit - total)
+                batch = list(
+                    queryset.filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .values_list('pk', 'content')[:size]
+                )
+                if not batch:
+                    break
+
+                contents = [content for _, content in batch]
+                if executor is None:
+                    results = _parse_contents(contents)
+                else:
+                    chunk = max(1, len(contents) // (workers * 4))
+                    chunks = [contents[i:i + chunk] for i in range(0, len(contents), chunk)]
+                    results = [result for part in executor.map(_parse_contents, chunks) for result in part]
+
+                TelegramMessage.objects.bulk_update(
+                    [
+                        TelegramMessage(pk=pk, parsed_data=result, parser_version=version)
+                        for (pk, _), result in zip(batch, results)
+                    ],
+                    ['parsed_data', 'parser_version'],
+                    batch_size=500
+                )
+
+                total += len(batch)
+                last_pk = batch[-1][0]
+                rate = total / max(time.monotonic() - started_at, 1e-6)
+                self.stdout.write(
+                    f'{total} messages analysés (dernier id: {last_pk}, {rate:,.0f} messages/s)'
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{total} messages ré-analysés avec le parseur v{version}'
+            )
+        )
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from telegram.error import TelegramError
+from telegram_bot.models import TelegramUpdate
+from telegram_bot.client import get_bot_client
+from telegram_bot.dispatcher import (
+    UpdateDispatcher, SUPPORTED_UPDATE_TYPES, store_update, update_chat_id, is_direct_update, answer_directly
+)
+
+
+def _pending_updates():
+    return list(
+        TelegramUpdate.objects.filter(status='pending')
+        .order_by('pk')
+        .values_list('pk', 'chat_id')
+    )
+
+
+class Command(BaseCommand):
+    """Commande pour recevoir les updates Telegram par long polling"""
+    help = (
+        'Reçoit les updates Telegram avec getUpdates (alternative au webhook). '
+        'TELEGRAM_API_BASE_URL permet de viser un serveur local pour les tests de charge.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.TELEGRAM_UPDATE_WORKERS,
+            help=f'Nombre d\'updates traités simultanément (défaut: {settings.TELEGRAM_UPDATE_WORKERS})'
+        )
+
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            default=30,
+            help='Durée du long polling en secondes (défaut: 30)'
+        )
+
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Nombre maximum d\'updates par appel à getUpdates (défaut: 100)'
+        )
+
+        parser.add_argument(
+            '--max-updates',
+            type=int,
+            default=None,
+            help='S\'arrête après ce nombre d\'updates reçus (mesures de débit)'
+        )
+
+        parser.add_argument(
+            '--delete-webhook',
+            action='store_true',
+            help='Supprime le webhook configuré (getUpdates est refusé tant qu\'il existe)'
+        )
+
+    def handle(self, *args, **options):
+        """Exécute la boucle de réception"""
+        client = get_bot_client()
+        future = asyncio.run_coroutine_threadsafe(self._poll(client, options), client.loop)
+        try:
+            received, processed, elapsed = future.result()
+        except KeyboardInterrupt:
+            future.cancel()
+            self.stdout.write(self.style.WARNING('Arrêt demandé'))
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{processed}/{received} updates traités en {elapsed:.1f}s '
+                f'({received / max(elapsed, 1e-6):,.0f} updates/s)'
+            )
+        )
+
+    async def _poll(self, client, options):
+        bot = client.bot
+        # Dispatcher dédié : ordre préservé par chat, chats différents en parallèle
+        dispatcher = UpdateDispatcher(
+            client=client,
+            workers=options['concurrency'],
+            queue_size=max(options['concurrency'], 1) * 2
+        )
+        max_updates = options['max_updates']
+
+        async def schedule(update_pk, chat_id):
+            # Pas de nouvel appel à getUpdates tant que la file est pleine
+            while dispatcher.is_full():
+                await asyncio.sleep(0.01)
+            dispatcher.submit(update_pk, chat_id)
+
+        if options['delete_webhook']:
+            await bot.delete_webhook()
+
+        # Updates persistés mais non traités lors de l'exécution précédente
+        for update_pk, chat_id in await sync_to_async(_pending_updates)():
+            await schedule(update_pk, chat_id)
+
+        # Sans offset, Telegram reprend après le dernier update confirmé par
+        # l'exécution précédente. L'offset n'est pas déduit des updates
+        # persistés : la numérotation repart d'une valeur aléatoire après une
+        # semaine sans update
+        offset = None
+        self.stdout.write('Réception des updates à partir du dernier offset confirmé')
+
+        received = 0
+        started_at = time.monotonic()
+        last_report = started_at
+        try:
+            while max_updates is None or received < max_updates:
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset,
+                        timeout=options['timeout'],
+                        limit=options['batch_size'],
+                        allowed_updates=list(SUPPORTED_UPDATE_TYPES)
+                    )
+                except TelegramError as e:
+                    self.stderr.write(f'Erreur getUpdates: {str(e)}')
+                    await asyncio.sleep(1)
+                    continue
+
+                for update in updates:
+                    data = update.to_dict()
+                    if is_direct_update(data):
+                        # Requête inline : répondue sans persistance ni file
+                        answer_directly(data)
+                        offset = update.update_id + 1
+                        received += 1
+                        continue
+                    # L'offset n'avance qu'une fois l'update persisté : un arrêt
+                    # brutal ne perd rien, Telegram renverra les updates non confirmés
+                    update_pk = await sync_to_async(store_update)(data)
+                    offset = update.update_id + 1
+                    received += 1
+                    if update_pk is not None:
+                        await schedule(update_pk, update_chat_id(data))
+
+                now = time.monotonic()
+                if now - last_report >= 10:
+                    last_report = now
+                    self.stdout.write(
+                        f'{received} updates reçus, {dispatcher.stats()["processed"]} traités '
+                        f'({received / (now - started_at):,.0f} updates/s)'
+                    )
+        finally:
+            await dispatcher.join()
+            dispatcher.shutdown()
+
+        return received, dispatcher.stats()['processed'], time.monotonic() - started_at
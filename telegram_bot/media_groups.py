@@ -0,0 +1,84 @@
+"""
+Regroupement des albums (même media_group_id) à partir des updates persistés.
+
+Telegram envoie un update par photo de l'album. Les parties restent
+'pending' en base jusqu'au traitement de l'album complet : un redémarrage
+ne perd aucune photo, et les parties reçues par des processus différents
+sont regroupées. Un album est complet quand aucune partie n'est arrivée
+depuis TELEGRAM_MEDIA_GROUP_WINDOW secondes (au plus
+TELEGRAM_MEDIA_GROUP_MAX_WAIT secondes après la première), ou dès qu'un
+update suivant du même chat a été reçu.
+"""
+
+from datetime import timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Min
+from django.utils import timezone
+
+from .models import TelegramUpdate
+
+
+def album_delay(chat_id: int, media_group_id: str) -> Optional[float]:
+    """Délai en secondes avant que l'album soit complet, ou None s'il l'est"""
+    parts = TelegramUpdate.objects.filter(chat_id=chat_id, media_group_id=media_group_id).aggregate(
+        first=Min('created_at'),
+        last=Max('created_at'),
+        last_pk=Max('pk')
+    )
+    if parts['last_pk'] is None:
+        return None
+    if TelegramUpdate.objects.filter(chat_id=chat_id, pk__gt=parts['last_pk']).exclude(
+        media_group_id=media_group_id
+    ).exists():
+        return None
+
+    complete_at = min(
+        parts['last'] + timedelta(seconds=settings.TELEGRAM_MEDIA_GROUP_WINDOW),
+        parts['first'] + timedelta(seconds=settings.TELEGRAM_MEDIA_GROUP_MAX_WAIT)
+    )
+    remaining = (complete_at - timezone.now()).total_seconds()
+    return remaining if remaining > 0 else None
+
+
+def earlier_albums(chat_id: int, before_pk: int, media_group_id: Optional[str] = None) -> List[str]:
+    """
+    Autres albums du chat encore en attente reçus avant cet update (qui fait
+    lui-même partie de l'album `media_group_id`), dans leur ordre d'arrivée
+    """
+    albums = TelegramUpdate.objects.filter(
+        chat_id=chat_id,
+        pk__lt=before_pk,
+        status='pending',
+        media_group_id__isnull=False
+    )
+    if media_group_id is not None:
+        albums = albums.exclude(media_group_id=media_group_id)
+    return list(
+        albums
+        .values('media_group_id')
+        .annotate(first_pk=Min('pk'))
+        .order_by('first_pk')
+        .values_list('media_group_id', flat=True)
+    )
+
+
+def claim_album(chat_id: int, media_group_id: str) -> List[TelegramUpdate]:
+    """
+    Passe toutes les parties en attente de l'album à l'état 'processing'.
+    Les lignes sont verrouillées : deux workers ne se partagent pas un album.
+    """
+    with transaction.atomic():
+        parts = list(
+            TelegramUpdate.objects.select_for_update()
+            .filter(chat_id=chat_id, media_group_id=media_group_id, status='pending')
+            .order_by('pk')
+        )
+        if parts:
+            TelegramUpdate.objects.filter(pk__in=[part.pk for part in parts]).update(
+                status='processing',
+                attempts=F('attempts') + 1
+            )
+    return parts
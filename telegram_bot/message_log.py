@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, List, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction, DataError, IntegrityError
+
+from .models import TelegramMessage
+from .client import BotClient, get_bot_client
+
+logger = logging.getLogger(__name__)
+
+
+class MessageLogBuffer:
+    """
+    Journal des messages reçus, écrit en base par lots (bulk_create).
+
+    Les lignes sont accumulées sur la boucle du bot et écrites dès que
+    `batch_size` lignes sont en attente, ou au plus tard après
+    `flush_interval` secondes. Les lignes en attente sont écrites à l'arrêt du
+    client. Si un lot échoue, ses lignes sont écrites une à une : une ligne
+    invalide (utilisateur supprimé entre-temps...) est abandonnée, les autres
+    sont écrites. Si la base est indisponible, les lignes sont conservées pour
+    le lot suivant, dans la limite de `max_pending`.
+    """
+
+    def __init__(self, client: BotClient, batch_size: int, flush_interval: float, max_pending: int = 10000):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._rows: List[TelegramMessage] = []
+        self._flusher = None
+        self._flushing = None
+        self._written = 0
+        self._dropped = 0
+        client.add_shutdown_hook(self.flush)
+
+    def add(self, row: TelegramMessage):
+        """Ajoute une ligne au journal (depuis la boucle du bot)"""
+        self._rows.append(row)
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        if len(self._rows) >= self.batch_size:
+            self._schedule_flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'buffered': len(self._rows),
+            'written': self._written,
+            'dropped': self._dropped,
+        }
+
+    async def flush(self):
+        """Écrit les lignes en attente"""
+        while self._rows:
+            rows, self._rows = self._rows, []
+            try:
+                await sync_to_async(TelegramMessage.objects.bulk_create)(rows, batch_size=500)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'écriture du journal des messages: {str(e)}")
+                written, dropped, remaining = await sync_to_async(self._write_each)(rows)
+                self._written += written
+                self._dropped += dropped
+                if remaining:
+                    self._requeue(remaining)
+                    return
+                continue
+            self._written += len(rows)
+
+    @staticmethod
+    def _write_each(rows: List[TelegramMessage]) -> Tuple[int, int, List[TelegramMessage]]:
+        """
+        Écrit les lignes une à une. Retourne le nombre de lignes écrites, le
+        nombre de lignes invalides abandonnées et les lignes non écrites
+        (base indisponible).
+        """
+        written = dropped = 0
+        for index, row in enumerate(rows):
+            try:
+                with transaction.atomic():
+                    TelegramMessage.objects.bulk_create([row])
+            except (IntegrityError, DataError) as e:
+                dropped += 1
+                logger.warning(f"Message {row.telegram_message_id} retiré du journal: {str(e)}")
+            except Exception:
+                return written, dropped, rows[index:]
+            else:
+                written += 1
+        return written, dropped, []
+
+    def _schedule_flush(self) -> asyncio.Task:
+        """Lance une écriture, sauf si une écriture est déjà en cours"""
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+        return self._flushing
+
+    def _requeue(self, rows: List[TelegramMessage]):
+        self._rows = rows + self._rows
+        overflow = len(self._rows) - self.max_pending
+        if overflow > 0:
+            # Base indisponible trop longtemps : les lignes les plus anciennes sont abandonnées
+            del self._rows[:overflow]
+            self._dropped += overflow
+            logger.warning(f"{overflow} messages retirés du journal (base indisponible)")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._rows:
+                await self._schedule_flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_message_log() -> MessageLogBuffer:
+    """Retourne le journal des messages du client du processus courant"""
+    global _buffer
+    client = get_bot_client()
+    if _buffer is None or _buffer.client is not client:
+        with _buffer_lock:
+            if _buffer is None or _buffer.client is not client:
+                _buffer = MessageLogBuffer(
+                    client=client,
+                    batch_size=settings.TELEGRAM_MESSAGE_LOG_BATCH_SIZE,
+                    flush_interval=settings.TELEGRAM_MESSAGE_LOG_FLUSH_INTERVAL
+                )
+    return _buffer
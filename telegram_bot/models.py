@@ -134,6 +134,15 @@ class TelegramMessage(models.Model):
         default=False,
         verbose_name="Traité"
     )
+    parsed_data = models.JSONField(
+        null=True,
+        blank=True,
+        verbose_name="Informations extraites"
+    )
+    parser_version = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Version du parseur"
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name="Date de réception"
@@ -189,4 +198,131 @@ class TelegramConversation(models.Model):
         db_table = 'telegram_conversations'
     
     def __str__(self):
-        return f"Conversation {self.telegram_user} - {self.state}"
\ No newline at end of file
+        return f"Conversation {self.telegram_user} - {self.state}"
+
+
+class TelegramUpdate(models.Model):
+    """
+    Updates Telegram bruts persistés par le webhook avant leur traitement
+    en arrière-plan
+    """
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('processing', 'En cours de traitement'),
+        ('done', 'Traité'),
+        ('failed', 'Échec'),
+    ]
+    
+    # Pas d'unicité : Telegram peut réutiliser un update_id après une semaine
+    # sans update, la déduplication porte sur TelegramUpdateReceipt
+    update_id = models.BigIntegerField(
+        verbose_name="ID Update Telegram"
+    )
+    payload = models.JSONField(
+        verbose_name="Contenu brut"
+    )
+    chat_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="ID Chat"
+    )
+    # Partie d'un album : traitée avec les autres parties (voir media_groups)
+    media_group_id = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        verbose_name="ID Album"
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name="Statut"
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Tentatives"
+    )
+    error = models.TextField(
+        blank=True,
+        verbose_name="Dernière erreur"
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Date de réception"
+    )
+    processed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Date de traitement"
+    )
+    
+    class Meta:
+        verbose_name = "Update Telegram"
+        verbose_name_plural = "Updates Telegram"
+        db_table = 'telegram_updates'
+        ordering = ['pk']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['update_id']),
+            models.Index(fields=['chat_id', 'media_group_id']),
+        ]
+    
+    def __str__(self):
+        return f"Update {self.update_id} - {self.status}"
+
+
+class TelegramUpdateReceipt(models.Model):
+    """
+    update_id reçus pendant la fenêtre de déduplication. La clé primaire
+    garantit en base qu'une re-livraison reçue par plusieurs processus n'est
+    enregistrée qu'une fois ; un reçu expiré est réutilisable (update_id
+    réutilisé par Telegram) et purgé par prune_telegram_updates.
+    """
+    update_id = models.BigIntegerField(
+        primary_key=True,
+        verbose_name="ID Update Telegram"
+    )
+    received_at = models.DateTimeField(
+        db_index=True,
+        verbose_name="Date de réception"
+    )
+    
+    class Meta:
+        verbose_name = "Réception d'update Telegram"
+        verbose_name_plural = "Réceptions d'updates Telegram"
+        db_table = 'telegram_update_receipts'
+    
+    def __str__(self):
+        return f"Update {self.update_id} reçu le {self.received_at:%d/%m/%Y %H:%M}"
+
+
+class TelegramDigestEvent(models.Model):
+    """
+    Notification en attente d'un digest propriétaire. Enregistrée avec la
+    modification qui la déclenche et supprimée à l'envoi du digest : un arrêt
+    brutal pendant la fenêtre de regroupement ne la perd pas.
+    """
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Propriétaire"
+    )
+    text = models.TextField(
+        verbose_name="Événement"
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name="Date de l'événement"
+    )
+    
+    class Meta:
+        verbose_name = "Événement de digest Telegram"
+        verbose_name_plural = "Événements de digest Telegram"
+        db_table = 'telegram_digest_events'
+        ordering = ['pk']
+    
+    def __str__(self):
+        return f"Digest de {self.owner_id}: {self.text[:50]}"
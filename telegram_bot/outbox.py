@@ -0,0 +1,302 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List
+
+from django.conf import settings
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter, NetworkError, TimedOut, TelegramError
+
+from .client import BotClient, get_bot_client
+from .caches import BoundedLRU
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Limiteur à seau de jetons. reserve() consomme un jeton et retourne le
+    délai à attendre avant de pouvoir l'utiliser (le solde peut devenir négatif).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """Délai avant qu'un jeton soit disponible, sans le consommer"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now: Optional[float] = None) -> float:
+        """Consomme un jeton et retourne le délai d'attente associé"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class OutboundMessage:
+    """Message en attente d'envoi"""
+
+    def __init__(self, chat_id: int, text: str, options: Dict[str, Any], future: asyncio.Future):
+        self.chat_id = chat_id
+        self.text = text
+        self.options = options
+        self.futures = [future]
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def can_merge(self, other: 'OutboundMessage') -> bool:
+        """Deux messages texte sans clavier ni options différentes peuvent être regroupés"""
+        return (
+            not self.options.get('reply_markup')
+            and not other.options.get('reply_markup')
+            and self.options == other.options
+            and len(self.text) + len(other.text) + 2 <= MessageLimit.MAX_TEXT_LENGTH
+        )
+
+    def merge(self, other: 'OutboundMessage'):
+        self.text = f"{self.text}\n\n{other.text}"
+        self.futures.extend(other.futures)
+
+
+class Outbox:
+    """
+    File d'envoi des messages sortants, sur la boucle du bot.
+
+    Les messages sont envoyés dans l'ordre par chat, en respectant une limite
+    globale et une limite par chat (seaux de jetons). Les erreurs 429 sont
+    réessayées après le délai retry_after imposé par Telegram, les erreurs
+    réseau avec un backoff exponentiel. Les messages texte en attente pour un
+    même chat sont regroupés en un seul envoi.
+    """
+
+    def __init__(self, client: BotClient, workers: int, global_rate: float, chat_rate: float,
+                 chat_burst: float, max_retries: int, backoff_base: float = 1.0):
+        self.client = client
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = BoundedLRU(10000)
+        self._pending: Dict[int, deque] = {}
+        self._busy = set()
+        self._ready = None
+        self._tasks: List[asyncio.Task] = []
+        self._stats_lock = threading.Lock()
+        self._depth = 0
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._coalesced = 0
+        self._latencies = deque(maxlen=500)
+        client.add_shutdown_hook(self.drain)
+
+    def send(self, chat_id: int, text: str, **options) -> asyncio.Future:
+        """
+        Met un message en file (depuis la boucle du bot) et retourne un futur
+        résolu avec le Message envoyé. Depuis un autre thread, utiliser
+        send_threadsafe().
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not self.client.loop:
+            raise RuntimeError(
+                "Outbox.send() doit être appelé depuis la boucle du bot, utilisez send_threadsafe()"
+            )
+        self._ensure_started()
+        future = loop.create_future()
+        self._pending.setdefault(chat_id, deque()).append(
+            OutboundMessage(chat_id, text, options, future)
+        )
+        with self._stats_lock:
+            self._depth += 1
+        self._mark_ready(chat_id)
+        return future
+
+    def send_threadsafe(self, chat_id: int, text: str, **options) -> concurrent.futures.Future:
+        """Met un message en file depuis n'importe quel thread (futur concurrent.futures)"""
+        async def enqueue():
+            return await self.send(chat_id, text, **options)
+        return asyncio.run_coroutine_threadsafe(enqueue(), self.client.loop)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métriques de la file d'envoi"""
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            return {
+                'queue_depth': self._depth,
+                'sent': self._sent,
+                'failed': self._failed,
+                'retries': self._retries,
+                'coalesced': self._coalesced,
+                'latency_avg_ms': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+                'latency_p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+            }
+
+    async def drain(self, timeout: float = 10):
+        """Attend que les messages en attente soient envoyés (arrêt propre)"""
+        deadline = time.monotonic() + timeout
+        while self._depth and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    def _ensure_started(self):
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker()) for _ in range(max(self.workers, 1))]
+
+    def _mark_ready(self, chat_id: int, delay: float = 0):
+        """Place le chat dans la file des chats prêts (une seule fois à la fois)"""
+        if chat_id in self._busy:
+            return
+        self._busy.add(chat_id)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    def _release(self, chat_id: int, delay: float = 0):
+        """Libère le chat et le reprogramme s'il reste des messages"""
+        self._busy.discard(chat_id)
+        if self._pending.get(chat_id):
+            self._mark_ready(chat_id, delay)
+        else:
+            self._pending.pop(chat_id, None)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    def _next_message(self, chat_id: int) -> OutboundMessage:
+        """Retire le prochain message du chat en regroupant les suivants compatibles"""
+        queue = self._pending[chat_id]
+        message = queue.popleft()
+        while queue and message.can_merge(queue[0]):
+            message.merge(queue.popleft())
+            with self._stats_lock:
+                self._coalesced += 1
+        return message
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            try:
+                await self._process_chat(chat_id)
+            except Exception as e:
+                logger.error(f"Erreur inattendue dans la file d'envoi: {str(e)}")
+                self._release(chat_id)
+
+    async def _process_chat(self, chat_id: int):
+        bucket = self._chat_bucket(chat_id)
+        wait = bucket.delay()
+        if wait > 0:
+            # Limite par chat atteinte : le chat est reprogrammé sans bloquer le worker
+            self._busy.discard(chat_id)
+            self._mark_ready(chat_id, wait)
+            return
+
+        bucket.reserve()
+        await asyncio.sleep(self._global_bucket.reserve())
+
+        message = self._next_message(chat_id)
+        try:
+            retry_delay = await self._deliver(message)
+        except Exception as e:
+            # Erreur hors Telegram : le message et les envois regroupés sont résolus en échec
+            self._finish(message, error=e)
+            retry_delay = None
+        if retry_delay is not None:
+            # Réessai : le message reprend sa place en tête de file
+            self._pending.setdefault(chat_id, deque()).appendleft(message)
+        self._release(chat_id, retry_delay or 0)
+
+    async def _deliver(self, message: OutboundMessage) -> Optional[float]:
+        """Envoie un message ; retourne un délai de réessai, ou None si terminé"""
+        message.attempts += 1
+        try:
+            result = await self.client.bot.send_message(
+                chat_id=message.chat_id,
+                text=message.text,
+                **message.options
+            )
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            return self._retry_or_fail(message, e, float(retry_after))
+        except (TimedOut, NetworkError) as e:
+            return self._retry_or_fail(message, e, self.backoff_base * 2 ** (message.attempts - 1))
+        except TelegramError as e:
+            self._finish(message, error=e)
+            return None
+
+        self._finish(message, result=result)
+        return None
+
+    def _retry_or_fail(self, message: OutboundMessage, error: Exception, delay: float) -> Optional[float]:
+        if message.attempts >= self.max_retries:
+            self._finish(message, error=error)
+            return None
+        with self._stats_lock:
+            self._retries += 1
+        logger.warning(f"Envoi au chat {message.chat_id} réessayé dans {delay:.1f}s: {str(error)}")
+        return delay
+
+    def _finish(self, message: OutboundMessage, result: Any = None, error: Optional[Exception] = None):
+        with self._stats_lock:
+            self._depth -= len(message.futures)
+            if error is None:
+                self._sent += 1
+                self._latencies.append(time.monotonic() - message.enqueued_at)
+            else:
+                self._failed += 1
+        if error is not None:
+            logger.error(f"Échec de l'envoi au chat {message.chat_id}: {str(error)}")
+        for future in message.futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+                # Évite l'avertissement 'exception never retrieved' pour les envois non attendus
+                future.exception()
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    """Retourne la file d'envoi du client du processus courant"""
+    global _outbox
+    client = get_bot_client()
+    if _outbox is None or _outbox.client is not client:
+        with _outbox_lock:
+            if _outbox is None or _outbox.client is not client:
+                _outbox = Outbox(
+                    client=client,
+                    workers=settings.TELEGRAM_SEND_WORKERS,
+                    global_rate=settings.TELEGRAM_SEND_GLOBAL_RATE,
+                    chat_rate=settings.TELEGRAM_SEND_CHAT_RATE,
+                    chat_burst=settings.TELEGRAM_SEND_CHAT_BURST,
+                    max_retries=settings.TELEGRAM_SEND_MAX_RETRIES
+                )
+    return _outbox
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import tempfile
+import threading
+import time
+from typing import Optional, Sequence, Dict, Set
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files import File
+from telegram import PhotoSize
+
+from .client import BotClient, get_bot_client
+from properties.models import PropertyImage
+
+logger = logging.getLogger(__name__)
+
+# Taille au-delà de laquelle le fichier temporaire passe de la mémoire au disque
+SPOOL_MAX_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+def select_photo_size(photo_sizes: Sequence[PhotoSize], max_file_size: int) -> Optional[PhotoSize]:
+    """
+    Choisit la plus grande version d'une photo téléchargeable, à partir des
+    métadonnées de l'update (aucune autre version n'est téléchargée).
+    """
+    candidates = [
+        size for size in photo_sizes
+        if size.file_size is None or size.file_size <= max_file_size
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda size: (size.width * size.height, size.file_size or 0))
+
+
+class PhotoDownloader:
+    """
+    Téléchargement des photos Telegram vers le stockage des images de propriété.
+
+    Au plus `workers` téléchargements simultanés par processus. Le contenu est
+    lu en flux vers un fichier temporaire (en mémoire jusqu'à 1 Mo, sur disque
+    au-delà) puis copié dans le stockage, sans jamais charger un fichier entier
+    en mémoire.
+    """
+
+    def __init__(self, client: BotClient, workers: int, max_file_size: int,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.client = client
+        self.workers = workers
+        self.max_file_size = max_file_size
+        self.transport = transport
+        self._semaphore = None
+        self._http = None
+        self._tasks: Dict[int, Set[asyncio.Task]] = {}
+        client.add_shutdown_hook(self.close)
+
+    def attach(self, photo_sizes: Sequence[PhotoSize], property_id: int, is_main: bool = False) -> asyncio.Task:
+        """
+        Lance le téléchargement d'une photo et son ajout à la propriété
+        (depuis la boucle du bot). Le résultat de la tâche est le PropertyImage.
+        """
+        return self._track(property_id, self._attach(photo_sizes, property_id, is_main))
+
+    def attach_many(self, photos: Sequence[Sequence[PhotoSize]], property_id: int,
+                    is_main: bool = False) -> asyncio.Task:
+        """
+        Télécharge plusieurs photos en parallèle puis les ajoute à la propriété
+        en une seule insertion. Le résultat de la tâche est le couple
+        (images créées, nombre de photos en échec).
+        """
+        return self._track(property_id, self._attach_many(photos, property_id, is_main))
+
+    async def wait(self, property_id: int):
+        """Attend la fin des téléchargements en cours pour une propriété"""
+        tasks = list(self._tasks.get(property_id, ()))
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def store(self, photo_sizes: Sequence[PhotoSize]) -> str:
+        """Télécharge la photo et retourne son nom dans le stockage des images"""
+        size = select_photo_size(photo_sizes, self.max_file_size)
+        if size is None:
+            raise ValueError("Photo trop volumineuse pour être téléchargée")
+
+        self._ensure_started()
+        async with self._semaphore:
+            started_at = time.monotonic()
+            telegram_file = await self.client.bot.get_file(size.file_id)
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as buffer:
+                async with self._http.stream('GET', telegram_file.file_path) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        buffer.write(chunk)
+                buffer.seek(0)
+                name = await sync_to_async(self._save, thread_sensitive=False)(
+                    f"telegram_{size.file_unique_id}.jpg", buffer
+                )
+            logger.info(f"Photo {size.file_unique_id} téléchargée en {time.monotonic() - started_at:.2f}s")
+        return name
+
+    async def close(self):
+        """Attend les téléchargements en cours puis ferme le client HTTP"""
+        pending = [task for tasks in self._tasks.values() for task in tasks]
+        if pending:
+            await asyncio.wait(pending, timeout=10)
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _attach(self, photo_sizes: Sequence[PhotoSize], property_id: int, is_main: bool) -> PropertyImage:
+        name = await self.store(photo_sizes)
+        return await PropertyImage.objects.acreate(property_id=property_id, image=name, is_main=is_main)
+
+    async def _attach_many(self, photos: Sequence[Sequence[PhotoSize]], property_id: int, is_main: bool):
+        results = await asyncio.gather(*(self.store(sizes) for sizes in photos), return_exceptions=True)
+        names = [result for result in results if isinstance(result, str)]
+        for error in results:
+            if isinstance(error, BaseException):
+                logger.error(f"Erreur lors du téléchargement d'une photo de l'album: {str(error)}")
+
+        images = [
+            PropertyImage(property_id=property_id, image=name, is_main=is_main and index == 0)
+            for index, name in enumerate(names)
+        ]
+        if images:
+            images = await PropertyImage.objects.abulk_create(images)
+        return images, len(results) - len(names)
+
+    def _track(self, property_id: int, coro) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.setdefault(property_id, set()).add(task)
+        task.add_done_callback(lambda done: self._forget(property_id, done))
+        return task
+
+    def _ensure_started(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(self.workers, 1))
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                transport=self.transport,
+                timeout=httpx.Timeout(
+                    settings.TELEGRAM_HTTP_READ_TIMEOUT,
+                    connect=settings.TELEGRAM_HTTP_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(max_connections=max(self.workers, 1))
+            )
+
+    def _forget(self, property_id: int, task: asyncio.Task):
+        tasks = self._tasks.get(property_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._tasks[property_id]
+
+    @staticmethod
+    def _save(filename: str, content) -> str:
+        field = PropertyImage._meta.get_field('image')
+        return field.storage.save(field.generate_filename(None, filename), File(content, filename))
+
+
+_downloader = None
+_downloader_lock = threading.Lock()
+
+
+def get_photo_downloader() -> PhotoDownloader:
+    """Retourne le téléchargeur de photos du client du processus courant"""
+    global _downloader
+    client = get_bot_client()
+    if _downloader is None or _downloader.client is not client:
+        with _downloader_lock:
+            if _downloader is None or _downloader.client is not client:
+                _downloader = PhotoDownloader(
+                    client=client,
+                    workers=settings.TELEGRAM_PHOTO_DOWNLOAD_WORKERS,
+                    max_file_size=settings.TELEGRAM_PHOTO_MAX_FILE_SIZE
+                )
+    return _downloader
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from typing import Dict, List, Optional, Set, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from properties.models import Property
+
+# Document indexé : (titre, localisation, prix, type)
+SearchDocument = Tuple[str, str, float, str]
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text: str) -> List[str]:
+    """Mots en minuscules et sans accents ('Yaoundé' -> 'yaounde')"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _WORD.findall(text.lower())
+
+
+class PropertySearchIndex:
+    """
+    Index en mémoire des propriétés disponibles pour les requêtes inline.
+
+    Chaque mot des titres et localisations pointe vers les propriétés qui le
+    contiennent ; la liste triée des mots permet de retrouver par dichotomie
+    ceux qui commencent par un préfixe. Tous les termes d'une requête doivent
+    correspondre, le dernier pouvant être incomplet (saisie en cours).
+
+    L'index est chargé au premier appel puis maintenu par les signaux de
+    `Property` ; `refresh` rattrape les modifications faites par les autres
+    processus d'après `updated_at`, et une reconstruction complète périodique
+    prend en compte leurs suppressions.
+    """
+
+    def __init__(self, refresh_interval: float, rebuild_interval: float):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._documents: Dict[int, SearchDocument] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._words: List[str] = []
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._synced_at = None
+        self._refreshed_at = 0.0
+        self._rebuilt_at = 0.0
+        self._refreshing = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def _add(self, pk: int, document: SearchDocument):
+        self._documents[pk] = document
+        for word in set(normalize(document[0]) + normalize(document[1])):
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = set()
+                self._words.insert(bisect_left(self._words, word), word)
+            postings.add(pk)
+
+    def _remove(self, pk: int):
+        document = self._documents.pop(pk, None)
+        if document is None:
+            return
+        for word in set(normalize(document[0]) + normalize(document[1])):
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.discard(pk)
+            if not postings:
+                del self._postings[word]
+                del self._words[bisect_left(self._words, word)]
+
+    def update(self, pk: int, document: Optional[SearchDocument]):
+        """Indexe (ou retire, si `document` est None) une propriété"""
+        with self._lock:
+            self._remove(pk)
+            if document is not None:
+                self._add(pk, document)
+
+    def _matching(self, term: str, prefix: bool) -> Set[int]:
+        if not prefix:
+            return self._postings.get(term, set())
+        matches = set()
+        index = bisect_left(self._words, term)
+        while index < len(self._words) and self._words[index].startswith(term):
+            matches |= self._postings[self._words[index]]
+            index += 1
+        return matches
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> Tuple[List[Tuple[int, SearchDocument]], Optional[int]]:
+        """
+        Propriétés correspondant à la requête, les plus récentes d'abord.
+        Retourne la page demandée et l'offset de la suivante (ou None).
+        """
+        terms = normalize(query)
+        with self._lock:
+            if not terms:
+                pks = self._documents.keys()
+            else:
+                # Les termes complets d'abord : leurs listes sont les plus courtes
+                candidates = [self._matching(term, prefix=False) for term in terms[:-1]]
+                candidates.append(self._matching(terms[-1], prefix=True))
+                candidates.sort(key=len)
+                pks = set(candidates[0]).intersection(*candidates[1:])
+            page = sorted(pks, reverse=True)[offset:offset + limit + 1]
+            results = [(pk, self._documents[pk]) for pk in page[:limit]]
+        next_offset = offset + limit if len(page) > limit else None
+        return results, next_offset
+
+    @staticmethod
+    def document(title: str, location: str, price, property_type: str) -> SearchDocument:
+        return (title, location, float(price), property_type)
+
+    def _rows(self, **filters):
+        return Property.objects.filter(**filters).values_list(
+            'pk', 'title', 'location', 'price', 'property_type', 'is_available', 'updated_at'
+        )
+
+    def rebuild(self):
+        """Recharge l'index complet depuis la base (appel synchrone)"""
+        documents = {}
+        synced_at = None
+        for pk, title, location, price, property_type, _, updated_at in self._rows(is_available=True):
+            documents[pk] = self.document(title, location, price, property_type)
+            synced_at = updated_at if synced_at is None else max(synced_at, updated_at)
+
+        with self._lock:
+            self._documents, self._postings, self._words = {}, {}, []
+            for pk, document in documents.items():
+                self._add(pk, document)
+            self._synced_at = synced_at
+            self._loaded = True
+            self._refreshed_at = self._rebuilt_at = time.monotonic()
+
+    def refresh(self):
+        """
+        Applique les modifications faites depuis la dernière synchronisation
+        (appel synchrone). Une reconstruction complète est faite au premier
+        appel et toutes les `rebuild_interval` secondes.
+        """
+        now = time.monotonic()
+        if not self._loaded or now - self._rebuilt_at >= self.rebuild_interval:
+            self.rebuild()
+            return
+
+        filters = {} if self._synced_at is None else {'updated_at__gte': self._synced_at}
+        synced_at = self._synced_at
+        for pk, title, location, price, property_type, is_available, updated_at in self._rows(**filters):
+            self.update(pk, self.document(title, location, price, property_type) if is_available else None)
+            synced_at = updated_at if synced_at is None else max(synced_at, updated_at)
+        with self._lock:
+            self._synced_at = synced_at
+            self._refreshed_at = now
+
+    def is_stale(self) -> bool:
+        return not self._loaded or time.monotonic() - self._refreshed_at >= self.refresh_interval
+
+    async def ensure_fresh(self):
+        """
+        Charge l'index au premier appel ; ensuite la synchronisation se fait
+        en tâche de fond pour ne pas retarder les réponses
+        """
+        if self._refreshing is None and self.is_stale():
+            self._refreshing = asyncio.get_running_loop().create_task(self._run_refresh())
+        if not self._loaded and self._refreshing is not None:
+            await asyncio.shield(self._refreshing)
+
+    async def _run_refresh(self):
+        try:
+            await sync_to_async(self.refresh)()
+        except Exception as e:
+            logger.error(f"Erreur lors de la mise à jour de l'index de recherche: {str(e)}")
+        finally:
+            self._refreshing = None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index() -> PropertySearchIndex:
+    """Retourne l'index de recherche du processus courant"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PropertySearchIndex(
+                    refresh_interval=settings.TELEGRAM_INLINE_REFRESH_INTERVAL,
+                    rebuild_interval=settings.TELEGRAM_INLINE_REBUILD_INTERVAL
+                )
+    return _index
+
+
+def index_property(instance: Property, deleted: bool = False):
+    """
+    Met à jour l'index après une modification de propriété (signaux), une
+    fois la transaction validée. Sans effet tant que l'index n'a pas été
+    chargé par une requête inline.
+    """
+    index = get_search_index()
+    if not index.loaded:
+        return
+    # La clé primaire est relevée tout de suite : elle est effacée après une suppression
+    pk = instance.pk
+    document = None
+    if not deleted and instance.is_available:
+        document = index.document(instance.title, instance.location, instance.price, instance.property_type)
+    transaction.on_commit(lambda: index.update(pk, document))
@@ -1,13 +1,27 @@
+import asyncio
 import re
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.utils import timezone
-from telegram import Bot, Update, Message
+from telegram import (
+    Update, Message, CallbackQuery, InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+)
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 
 from .models import TelegramUser, TelegramLinkCode, TelegramMessage, TelegramConversation
+from .client import BotClient, get_bot_client
+from .outbox import get_outbox
+from .conversations import ConversationState, get_conversation_store
+from .message_log import get_message_log
+from .photos import get_photo_downloader
+from .listings import LIST_CALLBACK_PREFIX, get_owner_listing, render_listing_page, format_price
+from .search import SearchDocument, get_search_index
+from .identity import aresolve_telegram_user
+from .extraction import PrioritizedPatterns, KeywordMatcher
 from properties.models import Property
 from users.models import User
 
@@ -19,36 +33,38 @@ class PropertyParserService:
     Service pour extraire les informations de propriété depuis du texte
     """
     
-    def __init__(self):
-        # Patterns regex pour extraire les informations
-        self.price_patterns = [
-            r'prix[:\s]*(\d+(?:\.\d+)?)\s*(?:€|euros?|fcfa)',
-            r'(\d+(?:\.\d+)?)\s*(?:€|euros?|fcfa)',
-            r'coût[:\s]*(\d+(?:\.\d+)?)',
-        ]
-        
-        self.size_patterns = [
-            r'taille[:\s]*(\d+(?:\.\d+)?)\s*(?:m²|m2|mètres?[\s]*carrés?)',
-            r'superficie[:\s]*(\d+(?:\.\d+)?)\s*(?:m²|m2)',
-            r'(\d+(?:\.\d+)?)\s*(?:m²|m2)',
-        ]
-        
-        self.location_patterns = [
-            r'localisation[:\s]*([^\n,]+)',
-            r'adresse[:\s]*([^\n,]+)',
-            r'situé[\u00e9e]?\s+à[:\s]*([^\n,]+)',
-            r'lieu[:\s]*([^\n,]+)',
-        ]
-        
-        self.property_types = {
-            'terrain': 'land',
-            'maison': 'house',
-            'appartement': 'apartment',
-            'local commercial': 'commercial',
-            'bureau': 'commercial',
-            'studio': 'apartment',
-            'villa': 'house',
-        }
+    # À incrémenter à chaque évolution des règles d'extraction (voir reparse_telegram_messages)
+    VERSION = 1
+    
+    # Patterns regex pour extraire les informations (par ordre de priorité)
+    price_patterns = [
+        r'prix[:\s]*(\d+(?:\.\d+)?)\s*(?:€|euros?|fcfa)',
+        r'(\d+(?:\.\d+)?)\s*(?:€|euros?|fcfa)',
+        r'coût[:\s]*(\d+(?:\.\d+)?)',
+    ]
+    
+    size_patterns = [
+        r'taille[:\s]*(\d+(?:\.\d+)?)\s*(?:m²|m2|mètres?[\s]*carrés?)',
+        r'superficie[:\s]*(\d+(?:\.\d+)?)\s*(?:m²|m2)',
+        r'(\d+(?:\.\d+)?)\s*(?:m²|m2)',
+    ]
+    
+    location_patterns = [
+        r'localisation[:\s]*([^\n,]+)',
+        r'adresse[:\s]*([^\n,]+)',
+        r'situé[\u00e9e]?\s+à[:\s]*([^\n,]+)',
+        r'lieu[:\s]*([^\n,]+)',
+    ]
+    
+    property_types = {
+        'terrain': 'land',
+        'maison': 'house',
+        'appartement': 'apartment',
+        'local commercial': 'commercial',
+        'bureau': 'commercial',
+        'studio': 'apartment',
+        'villa': 'house',
+    }
     
     def parse_property_info(self, text: str) -> Dict[str, Any]:
         """
@@ -103,42 +119,23 @@ class PropertyParserService:
     
     def _extract_price(self, text: str) -> Optional[float]:
         """Extrait le prix depuis le texte"""
-        for pattern in self.price_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                try:
-                    return float(match.group(1))
-                except (ValueError, IndexError):
-                    continue
-        return None
+        price = _PRICE_PATTERNS.first(text, accept=_is_number)
+        return float(price) if price is not None else None
     
     def _extract_size(self, text: str) -> Optional[float]:
         """Extrait la taille depuis le texte"""
-        for pattern in self.size_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                try:
-                    return float(match.group(1))
-                except (ValueError, IndexError):
-                    continue
-        return None
+        size = _SIZE_PATTERNS.first(text, accept=_is_number)
+        return float(size) if size is not None else None
     
     def _extract_location(self, text: str) -> Optional[str]:
         """Extrait la localisation depuis le texte"""
-        for pattern in self.location_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                location = match.group(1).strip()
-                if len(location) > 3:  # Éviter les extractions trop courtes
-                    return location
-        return None
+        # Éviter les extractions trop courtes
+        location = _LOCATION_PATTERNS.first(text, accept=lambda value: len(value.strip()) > 3)
+        return location.strip() if location is not None else None
     
     def _detect_property_type(self, text: str) -> str:
         """Détecte le type de propriété"""
-        for type_fr, type_en in self.property_types.items():
-            if type_fr in text:
-                return type_en
-        return 'land'  # par défaut
+        return _PROPERTY_TYPES.first(text) or 'land'  # par défaut
     
     def _get_type_french(self, property_type: str) -> str:
         """Retourne le nom français du type de propriété"""
@@ -151,62 +148,151 @@ class PropertyParserService:
         return type_map.get(property_type, 'Propriété')
 
 
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+# Moteur d'extraction compilé une seule fois et partagé par toutes les instances
+_PRICE_PATTERNS = PrioritizedPatterns(PropertyParserService.price_patterns, re.IGNORECASE)
+_SIZE_PATTERNS = PrioritizedPatterns(PropertyParserService.size_patterns, re.IGNORECASE)
+_LOCATION_PATTERNS = PrioritizedPatterns(PropertyParserService.location_patterns, re.IGNORECASE)
+_PROPERTY_TYPES = KeywordMatcher(PropertyParserService.property_types)
+
+
 class TelegramBotService:
     """
     Service principal pour gérer les interactions avec le bot Telegram
     """
     
-    def __init__(self):
-        self.bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+    def __init__(self, client: Optional[BotClient] = None):
+        # Le bot et son pool de connexions HTTP sont partagés par le processus
+        self.client = client or get_bot_client()
+        self.bot = self.client.bot
         self.parser = PropertyParserService()
     
-    def handle_update(self, update: Update):
+    async def handle_update(self, update: Update):
         """
         Traite une mise à jour reçue de Telegram
         """
         try:
             if update.message:
-                self._handle_message(update.message)
+                await self._handle_message(update.message)
             elif update.edited_message:
-                self._handle_message(update.edited_message)
+                await self._handle_message(update.edited_message)
+            elif update.callback_query:
+                await self._handle_callback_query(update.callback_query)
+            elif update.inline_query:
+                await self._handle_inline_query(update.inline_query)
                 
         except Exception as e:
             logger.error(f"Erreur lors du traitement de l'update: {str(e)}")
     
-    def _handle_message(self, message: Message):
+    async def _handle_message(self, message: Message):
         """
         Traite un message reçu
         """
         try:
             telegram_id = message.from_user.id
             
-            # Log du message
-            self._log_message(message)
-            
-            # Vérifier d'abord l'état de conversation
-            conversation = self._get_or_create_conversation(telegram_id)
-            
-            # Traitement des commandes
-            if message.text and message.text.startswith('/'):
-                self._handle_command(message)
-            elif conversation.state == 'awaiting_property_confirmation':
-                self._handle_property_confirmation(message, conversation)
-            elif conversation.state == 'awaiting_images':
-                self._handle_images_upload(message, conversation)
-            elif conversation.state == 'awaiting_image_selection':
-                self._handle_image_selection(message, conversation)
-            elif message.photo:
-                # Traitement des photos envoyées hors contexte
-                self._handle_standalone_photo(message)
-            else:
-                # Traitement des messages normaux (potentielles propriétés)
-                self._handle_property_message(message)
+            # Les messages d'un même chat sont traités l'un après l'autre
+            async with get_conversation_store().lock(telegram_id):
+                # Vérifier d'abord l'état de conversation
+                conversation = await self._get_or_create_conversation(telegram_id)
+                
+                # Log du message
+                self._log_message(message, conversation)
+                
+                await self._route_message(message, conversation)
                 
         except Exception as e:
             logger.error(f"Erreur lors du traitement du message: {str(e)}")
-            self._send_error_message(message.chat_id)
+            await self._send_error_message(message.chat_id)
     
-    def _handle_command(self, message: Message):
+    async def _route_message(self, message: Message, conversation: ConversationState):
+        """
+        Oriente le message selon son contenu et l'état de conversation
+        """
+        # Traitement des commandes
+        if message.text and message.text.startswith('/'):
+            await self._handle_command(message)
+        elif conversation.state == 'awaiting_property_confirmation':
+            await self._handle_property_confirmation(message, conversation)
+        elif conversation.state == 'awaiting_images':
+            await self._handle_images_upload(message, conversation)
+        elif conversation.state == 'awaiting_image_selection':
+            await self._handle_image_selection(message, conversation)
+        elif message.photo:
+            # Traitement des photos envoyées hors contexte
+            await self._handle_standalone_photo(message)
+        else:
+            # Traitement des messages normaux (potentielles propriétés)
+            await self._handle_property_message(message)
+    
+    async def handle_media_group(self, messages: List[Message]):
+        """
+        Traite un album complet, regroupé par le dispatcher : une seule lecture
+        de l'état de conversation, une seule transition et une seule réponse
+        pour toutes les photos
+        """
+        first = messages[0]
+        try:
+            async with get_conversation_store().lock(first.from_user.id):
+                conversation = await self._get_or_create_conversation(first.from_user.id)
+                
+                for message in messages:
+                    self._log_message(message, conversation)
+                
+                if conversation.state == 'awaiting_images':
+                    await self._handle_album_upload(messages, conversation)
+                else:
+                    # Hors ajout de photos, l'album est traité comme son message légendé
+                    captioned = next((message for message in messages if message.caption), first)
+                    await self._route_message(captioned, conversation)
+                
+        except Exception as e:
+            logger.error(f"Erreur lors du traitement de l'album: {str(e)}")
+            await self._send_error_message(first.chat_id)
+    
+    async def _handle_album_upload(self, messages: List[Message], conversation: ConversationState):
+        """Ajoute toutes les photos d'un album à la propriété en cours de création"""
+        property_id = conversation.context_data.get('property_id')
+        if property_id is None:
+            conversation.reset()
+            await self._save_conversation(conversation)
+            await self._send_error_message(messages[0].chat_id)
+            return
+        
+        photos = [message.photo for message in messages if message.photo]
+        if not photos:
+            return
+        
+        count = conversation.context_data.get('image_count', 0)
+        conversation.context_data['image_count'] = count + len(photos)
+        await self._save_conversation(conversation)
+        
+        task = get_photo_downloader().attach_many(photos, property_id, is_main=count == 0)
+        task.add_done_callback(lambda done: self._confirm_album(messages[0].chat_id, done))
+    
+    def _confirm_album(self, chat_id: int, task: asyncio.Task):
+        """Confirme l'ajout des photos d'un album en un seul message"""
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.error(f"Erreur lors de l'ajout de l'album: {str(task.exception())}")
+            self._send_message(chat_id, "❌ Les photos de l'album n'ont pas pu être récupérées. Merci de les renvoyer.")
+            return
+        
+        images, failed = task.result()
+        text = f"✅ {len(images)} photo(s) ajoutée(s)."
+        if failed:
+            text += f"\n❌ {failed} photo(s) n'ont pas pu être récupérées. Merci de les renvoyer."
+        self._send_message(chat_id, text)
+    
+    async def _handle_command(self, message: Message):
         """
         Traite les commandes du bot
         """
@@ -214,38 +300,200 @@ class TelegramBotService:
         telegram_id = message.from_user.id
         
         if command_text.startswith('/start'):
-            self._handle_start_command(message)
+            await self._handle_start_command(message)
         elif command_text.startswith('/help'):
-            self._handle_help_command(message)
+            await self._handle_help_command(message)
         elif command_text.startswith('/link'):
-            self._handle_link_command(message)
+            await self._handle_link_command(message)
         elif command_text.startswith('/add'):
-            self._handle_add_command(message)
+            await self._handle_add_command(message)
         elif command_text.startswith('/list'):
-            self._handle_list_command(message)
+            await self._handle_list_command(message)
         elif command_text.startswith('/done'):
-            self._handle_done_command(message)
+            await self._handle_done_command(message)
         elif command_text.startswith('/cancel'):
-            self._handle_cancel_command(message)
+            await self._handle_cancel_command(message)
         elif command_text.startswith('/status'):
-            self._handle_status_command(message)
+            await self._handle_status_command(message)
         elif command_text.startswith('/addimage'):
-            self._handle_addimage_command(message)
+            await self._handle_addimage_command(message)
         else:
-            self._send_unknown_command_message(message.chat_id)
+            await self._send_unknown_command_message(message.chat_id)
     
     # [Méthodes de gestion des commandes - implémentation complète disponible dans le fichier original]
     
-    def _get_telegram_user(self, telegram_id: int) -> Optional[TelegramUser]:
-        """Récupère l'utilisateur Telegram lié"""
+    async def _get_telegram_user(self, telegram_id: int) -> Optional[TelegramUser]:
+        """Récupère l'utilisateur Telegram lié (avec son utilisateur TaskMarket), depuis le cache"""
+        return await aresolve_telegram_user(telegram_id)
+    
+    async def _handle_list_command(self, message: Message):
+        """
+        Affiche la première page des propriétés du propriétaire lié
+        """
+        telegram_user = await self._get_telegram_user(message.from_user.id)
+        if not telegram_user:
+            await self._send_not_linked_message(message.chat_id)
+            return
+        
+        listing = await sync_to_async(get_owner_listing)(telegram_user.user_id)
+        text, keyboard = render_listing_page(listing, 0)
+        self._send_message(message.chat_id, text, reply_markup=keyboard)
+    
+    async def _handle_callback_query(self, query: CallbackQuery):
+        """
+        Traite les boutons des claviers inline (navigation de /list)
+        """
+        if not query.data or not query.data.startswith(LIST_CALLBACK_PREFIX):
+            await query.answer()
+            return
+        
+        telegram_user = await self._get_telegram_user(query.from_user.id)
+        if not telegram_user:
+            await query.answer("❌ Compte non lié.", show_alert=True)
+            return
+        
+        try:
+            page = int(query.data[len(LIST_CALLBACK_PREFIX):])
+        except ValueError:
+            await query.answer()
+            return
+        
+        listing = await sync_to_async(get_owner_listing)(telegram_user.user_id)
+        text, keyboard = render_listing_page(listing, page)
+        await query.answer()
+        if query.message is not None:
+            try:
+                await query.edit_message_text(text, reply_markup=keyboard)
+            except BadRequest as e:
+                # Page inchangée (double clic) : Telegram refuse une modification identique
+                logger.debug(f"Page /list non modifiée: {str(e)}")
+    
+    async def _handle_inline_query(self, inline_query: InlineQuery):
+        """
+        Recherche de propriétés disponibles depuis n'importe quel chat
+        (@bot villa Douala), servie par l'index en mémoire
+        """
+        index = get_search_index()
+        await index.ensure_fresh()
+        
         try:
-            return TelegramUser.objects.get(telegram_id=telegram_id, is_active=True)
-        except TelegramUser.DoesNotExist:
-            return None
+            offset = max(int(inline_query.offset or 0), 0)
+        except ValueError:
+            offset = 0
+        
+        results, next_offset = index.search(inline_query.query, offset, settings.TELEGRAM_INLINE_PAGE_SIZE)
+        await inline_query.answer(
+            [self._inline_result(pk, document) for pk, document in results],
+            cache_time=settings.TELEGRAM_INLINE_CACHE_TIME,
+            next_offset='' if next_offset is None else str(next_offset)
+        )
+    
+    @staticmethod
+    def _inline_result(pk: int, document: SearchDocument) -> InlineQueryResultArticle:
+        title, location, price, property_type = document
+        type_label = dict(Property.PROPERTY_TYPES).get(property_type, property_type)
+        return InlineQueryResultArticle(
+            id=str(pk),
+            title=title,
+            description=f"📍 {location} · 💰 {format_price(price)} FCFA",
+            input_message_content=InputTextMessageContent(
+                f"🏠 {title}\n"
+                f"🏷️ {type_label}\n"
+                f"📍 {location}\n"
+                f"💰 {format_price(price)} FCFA"
+            )
+        )
+    
+    def _log_message(self, message: Message, conversation: ConversationState):
+        """
+        Ajoute le message au journal (écrit en base par lots).
+        Seuls les messages des comptes liés sont journalisés.
+        """
+        if conversation.telegram_user_id is None:
+            return
+        
+        if message.text and message.text.startswith('/'):
+            message_type = 'command'
+        elif message.photo:
+            message_type = 'photo'
+        elif message.text:
+            message_type = 'text'
+        else:
+            message_type = 'other'
+        
+        get_message_log().add(TelegramMessage(
+            telegram_user_id=conversation.telegram_user_id,
+            message_type=message_type,
+            content=message.text or message.caption or '',
+            telegram_message_id=message.message_id
+        ))
+    
+    async def _handle_images_upload(self, message: Message, conversation: ConversationState):
+        """
+        Ajoute les photos reçues à la propriété en cours de création.
+        Le téléchargement se fait en arrière-plan : les photos suivantes du
+        chat sont prises en charge sans attendre la fin des précédentes.
+        """
+        if not message.photo:
+            self._send_message(
+                message.chat_id,
+                "📸 Envoyez les photos de la propriété, puis /done pour terminer."
+            )
+            return
+        
+        property_id = conversation.context_data.get('property_id')
+        if property_id is None:
+            conversation.reset()
+            await self._save_conversation(conversation)
+            await self._send_error_message(message.chat_id)
+            return
+        
+        # Numérotation sous le verrou du chat : la première photo devient l'image principale
+        position = conversation.context_data.get('image_count', 0) + 1
+        conversation.context_data['image_count'] = position
+        await self._save_conversation(conversation)
+        
+        task = get_photo_downloader().attach(message.photo, property_id, is_main=position == 1)
+        task.add_done_callback(lambda done: self._confirm_image(message.chat_id, position, done))
+    
+    def _confirm_image(self, chat_id: int, position: int, task: asyncio.Task):
+        """Confirme l'ajout d'une photo une fois son téléchargement terminé"""
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.error(f"Erreur lors du téléchargement de la photo {position}: {str(task.exception())}")
+            self._send_message(chat_id, f"❌ La photo {position} n'a pas pu être récupérée. Merci de la renvoyer.")
+        else:
+            self._send_message(chat_id, f"✅ Photo {position} ajoutée.")
+    
+    async def _get_or_create_conversation(self, telegram_id: int) -> ConversationState:
+        """
+        Récupère l'état de conversation depuis le cache partagé
+        (créé en base au premier message d'un compte lié)
+        """
+        return await get_conversation_store().get(telegram_id)
+    
+    async def _save_conversation(self, conversation: ConversationState):
+        """Enregistre l'état de conversation (cache immédiat, base en différé)"""
+        await get_conversation_store().save(conversation)
+    
+    def _send_message(self, chat_id: int, text: str, **options) -> asyncio.Future:
+        """
+        Met un message en file d'envoi (limites de débit, réessais, regroupement).
+        Le futur retourné peut être attendu pour obtenir le Message envoyé.
+        """
+        return get_outbox().send(chat_id, text, **options)
+    
+    async def _send_error_message(self, chat_id: int):
+        """Envoie un message d'erreur générique"""
+        self._send_message(
+            chat_id,
+            "❌ Une erreur est survenue lors du traitement de votre message. Veuillez réessayer."
+        )
     
-    def _send_not_linked_message(self, chat_id: int):
+    async def _send_not_linked_message(self, chat_id: int):
         """Envoie un message pour compte non lié"""
-        self.bot.send_message(
-            chat_id=chat_id,
-            text="❌ Compte non lié.\n\nConnectez-vous sur TaskMarket web et utilisez /link avec votre code de liaison."
+        self._send_message(
+            chat_id,
+            "❌ Compte non lié.\n\nConnectez-vous sur TaskMarket web et utilisez /link avec votre code de liaison."
         )
\ No newline at end of file
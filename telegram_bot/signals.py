@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from properties.models import Property, PropertyReport, VisitRequest
+from transactions.models import Transaction
+from transactions.signals import status_changed
+from users.models import User
+from .models import TelegramUser
+from .listings import invalidate_owner_listing, format_price
+from .search import index_property
+from .identity import invalidate_telegram_user
+from .conversations import invalidate_conversations
+from .digests import get_digests, record_digest_event
+
+
+@receiver([post_save, post_delete], sender=Property)
+def property_changed(sender, instance, signal, **kwargs):
+    """
+    Invalide la projection /list du propriétaire et met à jour l'index des
+    requêtes inline après validation de la transaction
+    """
+    owner_id = instance.owner_id
+    transaction.on_commit(lambda: invalidate_owner_listing(owner_id))
+    index_property(instance, deleted=signal is post_delete)
+
+
+def _invalidate_identities(telegram_ids):
+    for telegram_id in telegram_ids:
+        invalidate_telegram_user(telegram_id)
+
+
+def _invalidate_now_and_on_commit(telegram_ids):
+    # Immédiatement, puis après validation : une lecture faite entre-temps
+    # depuis une autre connexion aurait remis en cache l'ancienne valeur
+    _invalidate_identities(telegram_ids)
+    transaction.on_commit(lambda: _invalidate_identities(telegram_ids))
+
+
+@receiver([post_save, post_delete], sender=TelegramUser)
+def telegram_user_changed(sender, instance, **kwargs):
+    """
+    Liaison, déliaison ou (dés)activation : l'identité et l'état de
+    conversation (qui référence le compte) mis en cache sont invalidés
+    """
+    _invalidate_now_and_on_commit([instance.telegram_id])
+    invalidate_conversations([instance.telegram_id])
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    """L'utilisateur est mis en cache avec son compte Telegram (contrôles de droits)"""
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    telegram_ids = list(TelegramUser.objects.filter(user=instance).values_list('telegram_id', flat=True))
+    if telegram_ids:
+        _invalidate_now_and_on_commit(telegram_ids)
+
+
+def _notify_owner(owner_id: int, text: str, immediate: bool = False):
+    """
+    Enregistre l'événement avec la modification qui le déclenche, puis
+    programme le digest du propriétaire une fois la transaction validée
+    """
+    record_digest_event(owner_id, text)
+    # robust : un échec de programmation ne doit pas faire échouer la requête
+    # (l'événement enregistré est repris par le balayage des digests)
+    transaction.on_commit(lambda: get_digests().notify(owner_id, immediate), robust=True)
+
+
+@receiver(post_save, sender=VisitRequest)
+def visit_request_created(sender, instance, created, **kwargs):
+    if created and settings.TELEGRAM_BOT_TOKEN:
+        requested_date = timezone.localtime(instance.requested_date)
+        _notify_owner(
+            instance.property.owner_id,
+            f"📅 Demande de visite pour « {instance.property.title} » le {requested_date:%d/%m/%Y à %H:%M}"
+        )
+
+
+@receiver(post_save, sender=PropertyReport)
+def property_report_created(sender, instance, created, **kwargs):
+    if created and settings.TELEGRAM_BOT_TOKEN:
+        _notify_owner(
+            instance.property.owner_id,
+            f"⚠️ Signalement sur « {instance.property.title} » : {instance.title}"
+        )
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_created(sender, instance, created, **kwargs):
+    if created and settings.TELEGRAM_BOT_TOKEN:
+        _notify_owner(
+            instance.property.owner_id,
+            f"💰 Nouvelle offre de {format_price(instance.agreed_price)} FCFA pour « {instance.property.title} »"
+        )
+
+
+@receiver(status_changed, sender=Transaction)
+def transaction_status_changed(sender, transaction, **kwargs):
+    if transaction.status == 'accepted' and settings.TELEGRAM_BOT_TOKEN:
+        _notify_owner(
+            transaction.property.owner_id,
+            f"✅ Transaction acceptée pour « {transaction.property.title} » "
+            f"({format_price(transaction.agreed_price)} FCFA)",
+            immediate=True
+        )
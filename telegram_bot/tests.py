@@ -1,15 +1,47 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch, AsyncMock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from .models import TelegramUser, TelegramLinkCode, TelegramMessage, TelegramConversation
+from django.core.management import call_command
+from io import StringIO
+from .models import TelegramUser, TelegramLinkCode, TelegramMessage, TelegramConversation, TelegramUpdate, TelegramUpdateReceipt, TelegramDigestEvent
 from .services import PropertyParserService
+from .dispatcher import UpdateDispatcher, process_update, get_seen_updates, store_update
+from .client import get_bot_client, get_bot_service, shutdown_bot_client
+from .outbox import Outbox, TokenBucket
+from .conversations import ConversationStore, invalidate_conversations, get_conversation_store
+from .message_log import MessageLogBuffer, get_message_log
+from .photos import PhotoDownloader, select_photo_size, get_photo_downloader
+from .listings import get_owner_listing, render_listing_page
+from .search import PropertySearchIndex
+from .digests import DigestBuffer, record_digest_event
+from .identity import resolve_telegram_user, aresolve_telegram_user, identity_stats, get_local_identities
+from .caches import BoundedLRU
+from properties.models import Property, PropertyImage, PropertyReport, VisitRequest
+from transactions.models import Transaction
+from transactions.services import transition
+import httpx
+from django.core.cache import cache
+from telegram import Bot, Update, PhotoSize, File, CallbackQuery, InlineQuery
+from telegram.error import RetryAfter
 
 User = get_user_model()
 
+CORPUS_PATH = Path(__file__).resolve().parent / 'corpus' / 'property_listings.json'
+
 
 class TelegramModelTests(TestCase):
     """Tests pour les modèles Telegram"""
@@ -106,6 +138,25 @@ class PropertyParserTests(TestCase):
         self.assertIsNone(result['size'])
         self.assertIsNone(result['location'])
         self.assertLess(result['confidence'], 0.3)
+    
+    def test_parse_listings_corpus(self):
+        """Les résultats sur le corpus d'annonces réelles restent inchangés"""
+        with open(CORPUS_PATH, encoding='utf-8') as corpus_file:
+            corpus = json.load(corpus_file)
+        
+        for entry in corpus:
+            with self.subTest(text=entry['text']):
+                result = self.parser.parse_property_info(entry['text'])
+                self.assertEqual(
+                    {key: result[key] for key in entry['expected']},
+                    entry['expected']
+                )
+    
+    def test_location_fallback_on_short_match(self):
+        """Une localisation trop courte fait passer au pattern suivant"""
+        result = self.parser.parse_property_info("Studio lieu: ab, situé à Bonapriso")
+        
+        self.assertEqual(result['location'], 'Bonapriso')
 
 
 class TelegramAPITests(APITestCase):
@@ -175,4 +226,1556 @@ class TelegramAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(response.data['linked'])
         self.assertEqual(response.data['telegram_username'], 'testuser_tg')
-        self.assertEqual(response.data['telegram_id'], 123456789)
\ No newline at end of file
+        self.assertEqual(response.data['telegram_id'], 123456789)
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+class TelegramWebhookTests(TestCase):
+    """Tests pour le webhook et le traitement en arrière-plan"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        self.url = reverse('telegram_webhook')
+        self.payload = {
+            'update_id': 1001,
+            'message': {
+                'message_id': 1,
+                'date': 1700000000,
+                'chat': {'id': 42, 'type': 'private'},
+                'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+                'text': '/help'
+            }
+        }
+    
+    @patch('telegram_bot.views.get_dispatcher')
+    def test_webhook_persists_and_acknowledges(self, mock_get_dispatcher):
+        """Le webhook persiste l'update et répond sans le traiter"""
+        get_seen_updates().clear()
+        response = self.client.post(self.url, self.payload, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        stored = TelegramUpdate.objects.get(update_id=1001)
+        self.assertEqual(stored.status, 'pending')
+        self.assertEqual(stored.payload, self.payload)
+        mock_get_dispatcher.return_value.submit.assert_called_once_with(stored.pk, 42)
+    
+    @patch('telegram_bot.views.get_dispatcher')
+    def test_webhook_ignores_redelivered_update(self, mock_get_dispatcher):
+        """Une re-livraison du même update_id n'est ni stockée ni retraitée"""
+        get_seen_updates().clear()
+        
+        for _ in range(2):
+            response = self.client.post(self.url, self.payload, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        
+        # Re-livraison reçue par un autre processus (cache local vide) : la clé
+        # unique du reçu en base la refuse
+        get_seen_updates().clear()
+        cache.clear()
+        response = self.client.post(self.url, self.payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        
+        self.assertEqual(TelegramUpdate.objects.filter(update_id=1001).count(), 1)
+        mock_get_dispatcher.return_value.submit.assert_called_once()
+    
+    @patch('telegram_bot.views.get_dispatcher')
+    def test_webhook_accepts_reused_update_id_after_window(self, mock_get_dispatcher):
+        """Un update_id réutilisé par Telegram après la fenêtre de déduplication est stocké"""
+        get_seen_updates().clear()
+        TelegramUpdate.objects.create(update_id=1001, payload={'update_id': 1001}, status='done')
+        TelegramUpdate.objects.update(created_at=timezone.now() - timedelta(days=8))
+        TelegramUpdateReceipt.objects.create(update_id=1001, received_at=timezone.now() - timedelta(days=8))
+        
+        response = self.client.post(self.url, self.payload, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TelegramUpdate.objects.filter(update_id=1001).count(), 2)
+        self.assertGreater(
+            TelegramUpdateReceipt.objects.get(update_id=1001).received_at,
+            timezone.now() - timedelta(minutes=1)
+        )
+        mock_get_dispatcher.return_value.submit.assert_called_once()
+    
+    def test_prune_keeps_unprocessed_updates(self):
+        """La purge ne supprime que les updates traités et expirés"""
+        for update_id, update_status in [(1, 'done'), (2, 'done'), (3, 'failed'), (4, 'pending')]:
+            TelegramUpdate.objects.create(update_id=update_id, payload={}, status=update_status)
+            TelegramUpdateReceipt.objects.create(update_id=update_id, received_at=timezone.now())
+        TelegramUpdate.objects.exclude(update_id=2).update(created_at=timezone.now() - timedelta(days=10))
+        TelegramUpdateReceipt.objects.exclude(update_id=2).update(received_at=timezone.now() - timedelta(days=10))
+        
+        call_command('prune_telegram_updates', days=3, batch_size=1, stdout=StringIO())
+        
+        self.assertEqual(
+            list(TelegramUpdate.objects.values_list('update_id', flat=True)),
+            [2, 3, 4]
+        )
+        self.assertEqual(list(TelegramUpdateReceipt.objects.values_list('update_id', flat=True)), [2])
+    
+    def test_webhook_rejects_invalid_update(self):
+        """Un payload sans update_id est refusé"""
+        response = self.client.post(self.url, {'message': {}}, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TelegramUpdate.objects.exists())
+    
+    @patch('telegram_bot.views.get_dispatcher')
+    def test_webhook_drops_unsupported_update(self, mock_get_dispatcher):
+        """Un type d'update non géré est acquitté sans être stocké ni traité"""
+        payload = {
+            'update_id': 1002,
+            'channel_post': {
+                'message_id': 1,
+                'date': 1700000000,
+                'chat': {'id': -100, 'type': 'channel'},
+                'text': 'Annonce'
+            }
+        }
+        response = self.client.post(self.url, payload, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(TelegramUpdate.objects.exists())
+        mock_get_dispatcher.return_value.submit.assert_not_called()
+    
+    def test_webhook_rejects_undecodable_body(self):
+        """Un corps qui n'est pas du JSON UTF-8 est refusé"""
+        response = self.client.post(self.url, b'\xff\xfe{', content_type='application/json')
+        
+        self.assertEqual(response.status_code, 400)
+    
+    @patch('telegram_bot.dispatcher.asyncio.run_coroutine_threadsafe')
+    def test_dispatcher_backpressure(self, mock_schedule):
+        """La file bornée refuse les updates au-delà de sa capacité"""
+        mock_schedule.side_effect = lambda coro, loop: coro.close()
+        dispatcher = UpdateDispatcher(client=get_bot_client(), workers=1, queue_size=1)
+        
+        self.assertTrue(dispatcher.submit(1))
+        self.assertFalse(dispatcher.submit(2))
+        
+        stats = dispatcher.stats()
+        self.assertEqual(stats['queue_size'], 1)
+        self.assertEqual(stats['rejected'], 1)
+    
+    def test_dispatcher_keeps_chat_order(self):
+        """Les updates d'un chat sont traités dans l'ordre, les chats en parallèle"""
+        client = get_bot_client()
+        dispatcher = UpdateDispatcher(client=client, workers=2, queue_size=100, sweep_delay=60)
+        handled = []
+        
+        async def fake_process(update_pk, retry_later=None):
+            # Les premiers updates sont les plus lents : sans file par chat l'ordre serait inversé
+            await asyncio.sleep(0.03 if update_pk <= 2 else 0)
+            handled.append(update_pk)
+            return True
+        
+        async def run():
+            for update_pk, chat_id in [(1, 10), (2, 11), (3, 10), (4, 11), (5, 10), (6, 11)]:
+                dispatcher.submit(update_pk, chat_id)
+            await dispatcher.join()
+        
+        with patch('telegram_bot.dispatcher.process_update', side_effect=fake_process):
+            client.run(run(), timeout=5)
+        
+        self.assertEqual([pk for pk in handled if pk % 2], [1, 3, 5])
+        self.assertEqual([pk for pk in handled if not pk % 2], [2, 4, 6])
+        # Les deux chats ont été traités en parallèle
+        self.assertEqual(set(handled[:2]), {1, 2})
+        stats = dispatcher.stats()
+        self.assertEqual([shard['processed'] for shard in stats['shards']], [3, 3])
+        self.assertEqual(stats['queue_size'], 0)
+        self.assertIsNotNone(stats['shards'][0]['latency_p95_ms'])
+    
+    def test_dispatcher_rejected_chat_keeps_order(self):
+        """Après un refus, les updates suivants du chat attendent le balayage"""
+        client = get_bot_client()
+        dispatcher = UpdateDispatcher(client=client, workers=1, queue_size=1, sweep_delay=60)
+        updates = [
+            TelegramUpdate.objects.create(update_id=index, payload={}, chat_id=chat_id).pk
+            for index, chat_id in enumerate([10, 10, 10, 10, 11])
+        ]
+        handled = []
+        started = threading.Event()
+        release = threading.Event()
+        
+        async def fake_process(update_pk, retry_later=None):
+            handled.append(update_pk)
+            if update_pk == updates[0]:
+                started.set()
+                await asyncio.get_running_loop().run_in_executor(None, release.wait)
+            return True
+        
+        def sweep_and_join():
+            async_to_sync(dispatcher._sweep)()
+            client.run(dispatcher.join(), timeout=5)
+            TelegramUpdate.objects.filter(pk__in=handled).update(status='done')
+        
+        with patch('telegram_bot.dispatcher.process_update', side_effect=fake_process):
+            self.assertTrue(dispatcher.submit(updates[0], 10))
+            self.assertTrue(started.wait(5))
+            self.assertTrue(dispatcher.submit(updates[1], 10))
+            # File pleine : refusé, et le chat est différé
+            self.assertFalse(dispatcher.submit(updates[2], 10))
+            release.set()
+            client.run(dispatcher.join(), timeout=5)
+            TelegramUpdate.objects.filter(pk__in=handled).update(status='done')
+            
+            # De la place, mais un update précédent du chat attend encore
+            self.assertFalse(dispatcher.submit(updates[3], 10))
+            self.assertTrue(dispatcher.submit(updates[4], 11))
+            client.run(dispatcher.join(), timeout=5)
+            TelegramUpdate.objects.filter(pk__in=handled).update(status='done')
+            self.assertEqual(dispatcher.stats()['deferred_chats'], 1)
+            
+            # Le balayage remet les updates du chat en file, un par place libre,
+            # puis libère le chat une fois tous ses updates traités
+            for _ in range(3):
+                sweep_and_join()
+        dispatcher.shutdown()
+        
+        self.assertEqual(handled, [updates[0], updates[1], updates[4], updates[2], updates[3]])
+        stats = dispatcher.stats()
+        self.assertEqual(stats['deferred_chats'], 0)
+        self.assertEqual(stats['rejected'], 2)
+    
+    @patch('telegram_bot.dispatcher.asyncio.run_coroutine_threadsafe')
+    def test_dispatcher_sweep_skips_queued_updates(self, mock_schedule):
+        """Le balayage ne remet pas en file un update qui y est déjà"""
+        mock_schedule.side_effect = lambda coro, loop: coro.close()
+        dispatcher = UpdateDispatcher(client=get_bot_client(), workers=1, queue_size=10)
+        first, second = [
+            TelegramUpdate.objects.create(update_id=index, payload={}, chat_id=10).pk
+            for index in range(2)
+        ]
+        TelegramUpdate.objects.update(created_at=timezone.now() - timedelta(minutes=1))
+        
+        self.assertTrue(dispatcher.submit(first, 10))
+        async_to_sync(dispatcher._sweep)()
+        
+        self.assertEqual(mock_schedule.call_count, 2)
+        self.assertEqual(dispatcher.stats()['queue_size'], 2)
+    
+    def test_dispatcher_counts_claim_miss_as_skipped(self):
+        """Un update déjà pris par un autre worker n'est pas compté en échec"""
+        client = get_bot_client()
+        dispatcher = UpdateDispatcher(client=client, workers=1, queue_size=10, sweep_delay=60)
+        
+        with patch('telegram_bot.dispatcher.process_update', return_value=None):
+            dispatcher.submit(1, 10)
+            client.run(dispatcher.join(), timeout=5)
+        dispatcher.shutdown()
+        
+        stats = dispatcher.stats()
+        self.assertEqual((stats['processed'], stats['failed'], stats['skipped']), (0, 0, 1))
+    
+    def tearDown(self):
+        shutdown_bot_client()
+    
+    @patch('telegram_bot.services.TelegramBotService.handle_update')
+    def test_process_update_runs_once(self, mock_handle_update):
+        """Un update n'est traité qu'une seule fois"""
+        stored = TelegramUpdate.objects.create(update_id=1001, payload=self.payload)
+        
+        self.assertTrue(async_to_sync(process_update)(stored.pk))
+        self.assertFalse(async_to_sync(process_update)(stored.pk))
+        
+        stored.refresh_from_db()
+        self.assertEqual(stored.status, 'done')
+        self.assertEqual(stored.attempts, 1)
+        mock_handle_update.assert_called_once()
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN', TELEGRAM_UPDATE_ORDER_DELAY=0.02)
+class DispatcherOrderingTests(TransactionTestCase):
+    """Tests de l'ordre par chat entre dispatchers de processus différents (base partagée)"""
+    
+    def tearDown(self):
+        shutdown_bot_client()
+    
+    def _store(self, update_id):
+        return TelegramUpdate.objects.create(
+            update_id=update_id,
+            payload={
+                'update_id': update_id,
+                'message': {
+                    'message_id': update_id,
+                    'date': 1700000000,
+                    'chat': {'id': 42, 'type': 'private'},
+                    'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+                    'text': '/help'
+                }
+            },
+            chat_id=42
+        ).pk
+    
+    def test_chat_order_kept_across_dispatchers(self):
+        """Un update n'est pas traité tant que le précédent de son chat l'est ailleurs"""
+        client = get_bot_client()
+        first_worker = UpdateDispatcher(client=client, workers=1, queue_size=10, sweep_delay=60)
+        second_worker = UpdateDispatcher(client=client, workers=1, queue_size=10, sweep_delay=60)
+        first, second = self._store(1), self._store(2)
+        handled = []
+        
+        async def handle_update(update):
+            # Le premier update est le plus lent : sans vérification entre processus l'ordre serait inversé
+            if update.update_id == 1:
+                await asyncio.sleep(0.2)
+            handled.append(update.update_id)
+        
+        async def run():
+            first_worker.submit(first, 42)
+            second_worker.submit(second, 42)
+            await asyncio.gather(first_worker.join(), second_worker.join())
+        
+        with patch('telegram_bot.services.TelegramBotService.handle_update', side_effect=handle_update):
+            client.run(run(), timeout=10)
+        first_worker.shutdown()
+        second_worker.shutdown()
+        
+        self.assertEqual(handled, [1, 2])
+        self.assertEqual(set(TelegramUpdate.objects.values_list('status', flat=True)), {'done'})
+        self.assertEqual(second_worker.stats()['processed'], 1)
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+class BotClientTests(TestCase):
+    """Tests pour le client Telegram partagé par le processus"""
+    
+    def tearDown(self):
+        shutdown_bot_client()
+    
+    def test_client_is_shared(self):
+        """Le bot et le service sont créés une seule fois par processus"""
+        client = get_bot_client()
+        
+        self.assertIs(get_bot_client(), client)
+        self.assertIs(get_bot_service(), get_bot_service())
+        self.assertIs(get_bot_service().bot, client.bot)
+    
+    def test_client_recreated_after_fork(self):
+        """Un worker forké ne réutilise pas le client du processus parent"""
+        client = get_bot_client()
+        service = get_bot_service()
+        
+        with patch('telegram_bot.client.os.getpid', return_value=client.pid + 1):
+            forked_client = get_bot_client()
+            self.assertIsNot(forked_client, client)
+            self.assertIsNot(get_bot_service(), service)
+        
+        forked_client.shutdown()
+    
+    def test_run_executes_on_bot_loop(self):
+        """Les coroutines soumises s'exécutent sur la boucle dédiée"""
+        client = get_bot_client()
+        
+        async def current_loop():
+            return asyncio.get_running_loop()
+        
+        self.assertIs(client.run(current_loop(), timeout=5), client.loop)
+    
+    def test_shutdown_closes_http_pools(self):
+        """L'arrêt ferme les connexions HTTP du bot, même non initialisé"""
+        client = get_bot_client()
+        requests = client.bot._request
+        self.assertFalse(any(request._client.is_closed for request in requests))
+        
+        shutdown_bot_client()
+        
+        self.assertTrue(all(request._client.is_closed for request in requests))
+        self.assertFalse(client.loop.is_running())
+    
+    def test_service_awaits_bot_calls(self):
+        """Le service asynchrone attend réellement les appels au bot"""
+        service = get_bot_service()
+        
+        async def send():
+            return await service._send_message(42, 'Bonjour')
+        
+        with patch.object(type(service.bot), 'send_message') as mock_send:
+            get_bot_client().run(send(), timeout=5)
+        
+        mock_send.assert_awaited_once()
+        self.assertEqual(mock_send.await_args.kwargs['chat_id'], 42)
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+class OutboxTests(TestCase):
+    """Tests pour la file d'envoi des messages sortants"""
+    
+    def setUp(self):
+        self.client_bot = get_bot_client()
+        self.outbox = Outbox(
+            client=self.client_bot,
+            workers=1,
+            global_rate=100,
+            chat_rate=100,
+            chat_burst=100,
+            max_retries=3,
+            backoff_base=0.01
+        )
+    
+    def tearDown(self):
+        shutdown_bot_client()
+    
+    def test_token_bucket(self):
+        """Le seau de jetons impose un délai une fois la rafale consommée"""
+        bucket = TokenBucket(rate=1, capacity=2)
+        
+        self.assertEqual(bucket.reserve(now=bucket.updated_at), 0)
+        self.assertEqual(bucket.reserve(now=bucket.updated_at), 0)
+        self.assertAlmostEqual(bucket.reserve(now=bucket.updated_at), 1.0)
+        self.assertAlmostEqual(bucket.delay(now=bucket.updated_at + 1.5), 0.5)
+    
+    def test_messages_coalesced_per_chat(self):
+        """Les messages texte en attente pour un même chat partent en un seul envoi"""
+        async def send_burst():
+            futures = [self.outbox.send(42, f'Message {i}') for i in range(3)]
+            return await asyncio.gather(*futures)
+        
+        with patch.object(type(self.client_bot.bot), 'send_message') as mock_send:
+            self.client_bot.run(send_burst(), timeout=5)
+        
+        mock_send.assert_awaited_once()
+        self.assertEqual(mock_send.await_args.kwargs['text'], 'Message 0\n\nMessage 1\n\nMessage 2')
+        self.assertEqual(self.outbox.stats()['coalesced'], 2)
+        self.assertEqual(self.outbox.stats()['queue_depth'], 0)
+    
+    def test_retry_after_is_honoured(self):
+        """Une erreur 429 est réessayée au lieu de perdre le message"""
+        async def send_one():
+            return await self.outbox.send(42, 'Bonjour')
+        
+        with patch.object(type(self.client_bot.bot), 'send_message') as mock_send:
+            mock_send.side_effect = [RetryAfter(0), 'sent']
+            result = self.client_bot.run(send_one(), timeout=5)
+        
+        self.assertEqual(result, 'sent')
+        self.assertEqual(mock_send.await_count, 2)
+        stats = self.outbox.stats()
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['sent'], 1)
+        self.assertIsNotNone(stats['latency_avg_ms'])
+    
+    def test_unexpected_error_resolves_coalesced_messages(self):
+        """Une erreur hors Telegram résout tous les envois regroupés et vide la file"""
+        async def send_burst():
+            futures = [self.outbox.send(42, f'Message {i}') for i in range(2)]
+            return await asyncio.gather(*futures, return_exceptions=True)
+        
+        with patch.object(type(self.client_bot.bot), 'send_message') as mock_send:
+            mock_send.side_effect = ValueError('boom')
+            results = self.client_bot.run(send_burst(), timeout=5)
+        
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        stats = self.outbox.stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['failed'], 1)
+    
+    def test_send_outside_bot_loop(self):
+        """send() refuse une autre boucle ; send_threadsafe() passe par celle du bot"""
+        with self.assertRaises(RuntimeError):
+            self.outbox.send(42, 'Bonjour')
+        
+        with patch.object(type(self.client_bot.bot), 'send_message') as mock_send:
+            mock_send.return_value = 'sent'
+            result = self.outbox.send_threadsafe(42, 'Bonjour').result(timeout=5)
+        
+        self.assertEqual(result, 'sent')
+
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+class ConversationStoreTests(TestCase):
+    """Tests pour le cache des états de conversation"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.telegram_user = TelegramUser.objects.create(user=user, telegram_id=123456789)
+        self.store = ConversationStore(client=get_bot_client(), ttl=60, flush_interval=60)
+    
+    def tearDown(self):
+        shutdown_bot_client()
+        cache.clear()
+    
+    def test_state_read_from_cache(self):
+        """La conversation est créée au premier message puis lue depuis le cache"""
+        conversation = async_to_sync(self.store.get)(123456789)
+        
+        self.assertEqual(conversation.state, 'idle')
+        self.assertTrue(TelegramConversation.objects.filter(telegram_user=self.telegram_user).exists())
+        with self.assertNumQueries(0):
+            async_to_sync(self.store.get)(123456789)
+    
+    def test_unlinked_user_not_persisted(self):
+        """Un compte non lié a un état inactif jamais écrit en base"""
+        conversation = async_to_sync(self.store.get)(987654321)
+        async_to_sync(self.store.save)(conversation)
+        
+        self.assertFalse(conversation.is_persistent)
+        self.assertFalse(TelegramConversation.objects.exists())
+    
+    def test_write_behind(self):
+        """Les modifications sont visibles immédiatement et écrites en base au flush"""
+        conversation = async_to_sync(self.store.get)(123456789)
+        conversation.state = 'awaiting_images'
+        conversation.context_data = {'property_id': 7}
+        async_to_sync(self.store.save)(conversation)
+        
+        stored = TelegramConversation.objects.get(telegram_user=self.telegram_user)
+        self.assertEqual(stored.state, 'idle')
+        self.assertEqual(async_to_sync(self.store.get)(123456789).state, 'awaiting_images')
+        
+        async_to_sync(self.store.flush)()
+        stored.refresh_from_db()
+        self.assertEqual(stored.state, 'awaiting_images')
+        self.assertEqual(stored.context_data, {'property_id': 7})
+    
+    def test_database_edit_wins_over_pending_write(self):
+        """Une modification en base (admin) n'est pas écrasée par une écriture différée"""
+        conversation = async_to_sync(self.store.get)(123456789)
+        conversation.state = 'awaiting_images'
+        async_to_sync(self.store.save)(conversation)
+        
+        stored = TelegramConversation.objects.get(telegram_user=self.telegram_user)
+        stored.state = 'awaiting_property_confirmation'
+        stored.save()
+        
+        async_to_sync(self.store.flush)()
+        stored.refresh_from_db()
+        self.assertEqual(stored.state, 'awaiting_property_confirmation')
+        self.assertEqual(async_to_sync(self.store.get)(123456789).state, 'awaiting_property_confirmation')
+    
+    def test_save_during_flush_is_kept(self):
+        """Un message traité pendant l'écriture en base n'est ni écrasé ni perdu"""
+        conversation = async_to_sync(self.store.get)(123456789)
+        conversation.state = 'awaiting_property_confirmation'
+        async_to_sync(self.store.save)(conversation)
+        write = ConversationStore._write
+        
+        def slow_write(conversations):
+            time.sleep(0.2)
+            return write(conversations)
+        
+        async def handle():
+            await asyncio.sleep(0.05)
+            async with self.store.lock(123456789):
+                current = await self.store.get(123456789)
+                current.state = 'awaiting_images'
+                await self.store.save(current)
+        
+        async def run():
+            await asyncio.gather(self.store.flush(), handle())
+        
+        with patch.object(ConversationStore, '_write', side_effect=slow_write):
+            async_to_sync(run)()
+        self.assertEqual(async_to_sync(self.store.get)(123456789).state, 'awaiting_images')
+        
+        async_to_sync(self.store.flush)()
+        self.assertEqual(TelegramConversation.objects.get().state, 'awaiting_images')
+        self.assertEqual(async_to_sync(self.store.get)(123456789).state, 'awaiting_images')
+    
+    def test_failed_flush_is_retried(self):
+        """Les états non écrits (erreur en base) sont écrits au flush suivant"""
+        conversation = async_to_sync(self.store.get)(123456789)
+        conversation.state = 'awaiting_images'
+        async_to_sync(self.store.save)(conversation)
+        
+        with patch.object(ConversationStore, '_write', side_effect=Exception('db down')):
+            with self.assertRaises(Exception):
+                async_to_sync(self.store.flush)()
+        self.assertEqual(TelegramConversation.objects.get().state, 'idle')
+        
+        async_to_sync(self.store.flush)()
+        self.assertEqual(TelegramConversation.objects.get().state, 'awaiting_images')
+    
+    def test_lock_shared_between_processes(self):
+        """Le verrou d'un chat est pris dans le cache partagé : un autre processus attend"""
+        other = ConversationStore(client=get_bot_client(), ttl=60, flush_interval=60)
+        events = []
+        
+        async def hold():
+            async with self.store.lock(123456789):
+                events.append('first')
+                await asyncio.sleep(0.1)
+                events.append('first released')
+        
+        async def wait():
+            await asyncio.sleep(0.02)
+            async with other.lock(123456789):
+                events.append('second')
+        
+        async def run():
+            await asyncio.gather(hold(), wait())
+        
+        async_to_sync(run)()
+        self.assertEqual(events, ['first', 'first released', 'second'])
+        self.assertIsNone(cache.get('telegram:conversation-lock:123456789'))
+    
+    def test_flush_by_other_process_keeps_changes(self):
+        """Deux processus modifient le même chat : le premier flush écrit le dernier état"""
+        other = ConversationStore(client=get_bot_client(), ttl=60, flush_interval=60)
+        
+        async def handle(store, state):
+            async with store.lock(123456789):
+                conversation = await store.get(123456789)
+                conversation.state = state
+                await store.save(conversation)
+        
+        async_to_sync(handle)(self.store, 'awaiting_property_confirmation')
+        async_to_sync(handle)(other, 'awaiting_images')
+        async_to_sync(self.store.flush)()
+        self.assertEqual(TelegramConversation.objects.get().state, 'awaiting_images')
+        
+        # L'écriture en attente de l'autre processus est déjà faite : rien n'est abandonné
+        async_to_sync(other.flush)()
+        self.assertEqual(TelegramConversation.objects.get().state, 'awaiting_images')
+        self.assertEqual(async_to_sync(other.get)(123456789).state, 'awaiting_images')
+        
+        async_to_sync(handle)(other, 'idle')
+        async_to_sync(other.flush)()
+        self.assertEqual(TelegramConversation.objects.get().state, 'idle')
+    
+    def test_invalidation(self):
+        """Une invalidation abandonne l'écriture en attente et relit la base"""
+        conversation = async_to_sync(self.store.get)(123456789)
+        conversation.state = 'awaiting_images'
+        async_to_sync(self.store.save)(conversation)
+        
+        with patch('telegram_bot.conversations._store', self.store):
+            invalidate_conversations([123456789])
+        async_to_sync(self.store.flush)()
+        
+        self.assertEqual(TelegramConversation.objects.get().state, 'idle')
+        self.assertEqual(async_to_sync(self.store.get)(123456789).state, 'idle')
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+class PollingCommandTests(TransactionTestCase):
+    """Tests pour la réception des updates par long polling"""
+    
+    def tearDown(self):
+        shutdown_bot_client()
+    
+    def _updates(self, *update_ids):
+        return [
+            Update.de_json({
+                'update_id': update_id,
+                'message': {
+                    'message_id': update_id,
+                    'date': 1700000000,
+                    'chat': {'id': 42, 'type': 'private'},
+                    'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+                    'text': '/help'
+                }
+            }, None)
+            for update_id in update_ids
+        ]
+    
+    @patch('telegram_bot.services.TelegramBotService.handle_update')
+    def test_polling_resumes_from_confirmed_offset(self, mock_handle_update):
+        """Les updates sont persistés, traités, et l'offset confirmé par Telegram fait foi"""
+        get_seen_updates().clear()
+        cache.clear()
+        # Numérotation repartie plus bas après une période d'inactivité
+        TelegramUpdate.objects.create(update_id=500, payload={'update_id': 500}, status='done')
+        
+        with patch.object(Bot, 'get_updates') as mock_get_updates:
+            mock_get_updates.side_effect = [self._updates(11, 12), self._updates(13)]
+            call_command('run_telegram_polling', max_updates=3, concurrency=2, stdout=StringIO())
+        
+        self.assertIsNone(mock_get_updates.await_args_list[0].kwargs['offset'])
+        self.assertEqual(mock_get_updates.await_args_list[1].kwargs['offset'], 13)
+        self.assertEqual(
+            list(TelegramUpdate.objects.filter(status='done').values_list('update_id', flat=True)),
+            [500, 11, 12, 13]
+        )
+        self.assertEqual(mock_handle_update.call_count, 3)
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+class PhotoDownloadTests(TestCase):
+    """Tests pour le téléchargement des photos de propriété"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        owner = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.property = Property.objects.create(
+            owner=owner,
+            title='Terrain à Odza',
+            description='Terrain',
+            property_type='land',
+            price=1000000,
+            location='Odza',
+            size=500
+        )
+    
+    def tearDown(self):
+        shutdown_bot_client()
+    
+    def _sizes(self, name):
+        return [
+            PhotoSize(f'{name}-s', f'{name}-s', 90, 60, file_size=1000),
+            PhotoSize(f'{name}-x', f'{name}-x', 2560, 1706, file_size=30 * 1024 * 1024),
+            PhotoSize(f'{name}-m', f'{name}-m', 1280, 853, file_size=200000),
+        ]
+    
+    def test_select_largest_downloadable_size(self):
+        """La plus grande version sous la limite de taille est choisie"""
+        self.assertEqual(select_photo_size(self._sizes('a'), 20 * 1024 * 1024).file_id, 'a-m')
+        self.assertIsNone(select_photo_size(self._sizes('a')[1:2], 1024))
+    
+    def test_photos_downloaded_concurrently(self):
+        """Les photos sont téléchargées en parallèle (pool borné) et rattachées à la propriété"""
+        state = {'active': 0, 'max_active': 0, 'paths': []}
+        
+        async def handler(request):
+            state['active'] += 1
+            state['max_active'] = max(state['max_active'], state['active'])
+            state['paths'].append(request.url.path)
+            await asyncio.sleep(0.05)
+            state['active'] -= 1
+            return httpx.Response(200, content=b'\xff\xd8' + b'0' * 200000)
+        
+        async def get_file(file_id, *args, **kwargs):
+            return File(file_id, file_id, file_path=f'https://files.test/{file_id}.jpg')
+        
+        downloader = PhotoDownloader(
+            client=get_bot_client(),
+            workers=2,
+            max_file_size=20 * 1024 * 1024,
+            transport=httpx.MockTransport(handler)
+        )
+        
+        async def upload():
+            tasks = [
+                downloader.attach(self._sizes(name), self.property.pk, is_main=index == 0)
+                for index, name in enumerate('abcd')
+            ]
+            await downloader.wait(self.property.pk)
+            await downloader.close()
+            return [task.result() for task in tasks]
+        
+        with override_settings(MEDIA_ROOT=self.media_root.name), \
+                patch.object(Bot, 'get_file', side_effect=get_file):
+            images = async_to_sync(upload)()
+            self.assertEqual(images[0].image.size, 200002)
+        
+        self.assertEqual(state['max_active'], 2)
+        self.assertEqual(sorted(state['paths']), ['/a-m.jpg', '/b-m.jpg', '/c-m.jpg', '/d-m.jpg'])
+        self.assertEqual(PropertyImage.objects.filter(property=self.property).count(), 4)
+        self.assertEqual([image.is_main for image in images], [True, False, False, False])
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN', TELEGRAM_MEDIA_GROUP_WINDOW=0.05)
+class MediaGroupTests(TestCase):
+    """Tests pour le regroupement des albums photo"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        get_seen_updates().clear()
+        owner = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.telegram_user = TelegramUser.objects.create(user=owner, telegram_id=42)
+        self.property = Property.objects.create(
+            owner=owner,
+            title='Terrain à Odza',
+            description='Terrain',
+            property_type='land',
+            price=1000000,
+            location='Odza',
+            size=500
+        )
+        TelegramConversation.objects.create(
+            telegram_user=self.telegram_user,
+            state='awaiting_images',
+            context_data={'property_id': self.property.pk}
+        )
+    
+    def tearDown(self):
+        shutdown_bot_client()
+        cache.clear()
+    
+    def _store(self, index, **message):
+        """Persiste un update comme le webhook"""
+        return store_update({
+            'update_id': 5000 + index,
+            'message': {
+                'message_id': index,
+                'date': 1700000000,
+                'chat': {'id': 42, 'type': 'private'},
+                'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+                **message
+            }
+        })
+    
+    def _album(self, count):
+        return [
+            self._store(index, media_group_id='album-1', photo=[
+                {'file_id': f'photo-{index}', 'file_unique_id': f'photo-{index}', 'width': 1280, 'height': 853}
+            ])
+            for index in range(count)
+        ]
+    
+    def _process(self, update_pk, retry_later=None):
+        async def run():
+            result = await process_update(update_pk, retry_later)
+            await get_photo_downloader().wait(self.property.pk)
+            return result
+        return async_to_sync(run)()
+    
+    @override_settings(TELEGRAM_MEDIA_GROUP_WINDOW=0)
+    @patch('telegram_bot.services.TelegramBotService._send_message')
+    @patch('telegram_bot.photos.PhotoDownloader.store')
+    def test_album_handled_as_one_batch(self, mock_store, mock_send):
+        """Un album donne une transition, une insertion groupée et une seule réponse"""
+        mock_store.side_effect = lambda sizes: f'property_images/{sizes[0].file_id}.jpg'
+        parts = self._album(3)
+        
+        self.assertTrue(self._process(parts[1]))
+        # Les autres parties ont été traitées avec l'album
+        self.assertIsNone(self._process(parts[0]))
+        
+        async_to_sync(get_message_log().flush)()
+        async_to_sync(get_conversation_store().flush)()
+        self.assertEqual(TelegramMessage.objects.filter(message_type='photo').count(), 3)
+        self.assertEqual(set(TelegramUpdate.objects.values_list('status', flat=True)), {'done'})
+        images = PropertyImage.objects.filter(property=self.property).order_by('pk')
+        self.assertEqual(images.count(), 3)
+        self.assertEqual([image.is_main for image in images], [True, False, False])
+        mock_send.assert_called_once_with(42, '✅ 3 photo(s) ajoutée(s).')
+        
+        conversation = async_to_sync(get_conversation_store().get)(42)
+        self.assertEqual(conversation.context_data['image_count'], 3)
+    
+    @patch('telegram_bot.services.TelegramBotService._send_message')
+    def test_incomplete_album_stays_pending(self, mock_send):
+        """Tant que l'album peut recevoir des photos, ses parties restent en attente"""
+        parts = self._album(2)
+        delays = []
+        
+        self.assertIsNone(self._process(parts[0], delays.append))
+        
+        self.assertEqual(len(delays), 1)
+        self.assertLessEqual(delays[0], settings.TELEGRAM_MEDIA_GROUP_WINDOW)
+        self.assertEqual(set(TelegramUpdate.objects.values_list('status', flat=True)), {'pending'})
+        mock_send.assert_not_called()
+    
+    @patch('telegram_bot.services.TelegramBotService._send_message')
+    @patch('telegram_bot.photos.PhotoDownloader.store')
+    def test_album_processed_before_next_message(self, mock_store, mock_send):
+        """Un message reçu après l'album n'est traité qu'après lui"""
+        mock_store.side_effect = lambda sizes: f'property_images/{sizes[0].file_id}.jpg'
+        self._album(2)
+        help_message = self._store(10, text='/help')
+        
+        self.assertTrue(self._process(help_message))
+        
+        self.assertEqual(mock_send.call_count, 2)
+        self.assertEqual(mock_send.call_args_list[0].args, (42, '✅ 2 photo(s) ajoutée(s).'))
+        self.assertEqual(PropertyImage.objects.filter(property=self.property).count(), 2)
+        self.assertEqual(set(TelegramUpdate.objects.values_list('status', flat=True)), {'done'})
+    
+    def test_dispatcher_retries_album_in_its_shard(self):
+        """Une partie d'album en attente est revérifiée dans sa file, sans en sortir"""
+        client = get_bot_client()
+        dispatcher = UpdateDispatcher(client=client, workers=1, queue_size=10, sweep_delay=60)
+        calls = []
+        
+        async def fake_process(update_pk, retry_later):
+            calls.append(update_pk)
+            if len(calls) == 1:
+                retry_later(0.05)
+                return None
+            return True
+        
+        with patch('telegram_bot.dispatcher.process_update', side_effect=fake_process):
+            dispatcher.submit(1, 42)
+            client.run(dispatcher.join(), timeout=5)
+        dispatcher.shutdown()
+        
+        self.assertEqual(calls, [1, 1])
+        stats = dispatcher.stats()
+        self.assertEqual((stats['processed'], stats['skipped'], stats['waiting']), (1, 0, 0))
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN', TELEGRAM_LIST_PAGE_SIZE=5)
+class ListCommandTests(TestCase):
+    """Tests pour la commande /list paginée"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        self.owner = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        TelegramUser.objects.create(user=self.owner, telegram_id=42)
+        for index in range(12):
+            Property.objects.create(
+                owner=self.owner,
+                title=f'Terrain {index}',
+                description='Terrain',
+                property_type='land',
+                price=1000000 + index,
+                location='Odza',
+                size=500
+            )
+    
+    def tearDown(self):
+        shutdown_bot_client()
+        cache.clear()
+    
+    def test_listing_cached_and_invalidated(self):
+        """La projection est servie depuis le cache puis invalidée à la modification"""
+        self.assertEqual(len(get_owner_listing(self.owner.pk)), 12)
+        with self.assertNumQueries(0):
+            get_owner_listing(self.owner.pk)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Property.objects.filter(owner=self.owner).first().delete()
+        self.assertEqual(len(get_owner_listing(self.owner.pk)), 11)
+    
+    def test_pages_and_keyboard(self):
+        """Chaque page affiche au plus 5 propriétés avec les boutons de navigation"""
+        listing = get_owner_listing(self.owner.pk)
+        
+        text, keyboard = render_listing_page(listing, 1)
+        self.assertIn('page 2/3', text)
+        self.assertIn('6. Terrain 6', text)
+        self.assertNotIn('Terrain 1\n', text)
+        self.assertEqual(
+            [button.callback_data for button in keyboard.inline_keyboard[0]],
+            ['list:0', 'list:2']
+        )
+        
+        text, keyboard = render_listing_page(listing, 99)
+        self.assertIn('page 3/3', text)
+        self.assertEqual([button.callback_data for button in keyboard.inline_keyboard[0]], ['list:1'])
+    
+    @patch.object(CallbackQuery, 'edit_message_text')
+    @patch.object(CallbackQuery, 'answer')
+    def test_callback_query_changes_page(self, mock_answer, mock_edit):
+        """Un clic sur un bouton de navigation modifie le message avec la page demandée"""
+        update = Update.de_json({
+            'update_id': 1,
+            'callback_query': {
+                'id': 'cb-1',
+                'chat_instance': 'ci',
+                'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+                'data': 'list:2',
+                'message': {
+                    'message_id': 10,
+                    'date': 1700000000,
+                    'chat': {'id': 42, 'type': 'private'},
+                    'text': 'page 1/3'
+                }
+            }
+        }, get_bot_client().bot)
+        
+        async_to_sync(get_bot_service().handle_update)(update)
+        
+        mock_answer.assert_awaited_once()
+        self.assertIn('page 3/3', mock_edit.await_args.args[0])
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN', TELEGRAM_INLINE_PAGE_SIZE=2)
+class InlineSearchTests(TestCase):
+    """Tests pour la recherche inline de propriétés"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        self.owner = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.properties = [
+            Property.objects.create(
+                owner=self.owner,
+                title=title,
+                description='Annonce',
+                property_type=property_type,
+                price=price,
+                location=location,
+                size=300
+            )
+            for title, location, property_type, price in [
+                ('Villa avec piscine', 'Douala, Bonapriso', 'house', 90000000),
+                ('Villa familiale', 'Yaoundé, Bastos', 'house', 75000000),
+                ('Terrain titré', 'Douala, Logbessou', 'land', 15000000),
+                ('Appartement meublé', 'Douala, Akwa', 'apartment', 40000000),
+            ]
+        ]
+        self.index = PropertySearchIndex(refresh_interval=30, rebuild_interval=3600)
+        self.index.refresh()
+    
+    def tearDown(self):
+        shutdown_bot_client()
+    
+    def _titles(self, query, offset=0, limit=20):
+        results, _ = self.index.search(query, offset, limit)
+        return [document[0] for _, document in results]
+    
+    def test_search_terms_and_prefix(self):
+        """Tous les termes doivent correspondre, le dernier en préfixe, sans tenir compte des accents"""
+        self.assertEqual(self._titles('villa Douala'), ['Villa avec piscine'])
+        self.assertEqual(self._titles('villa yaou'), ['Villa familiale'])
+        self.assertEqual(self._titles('DOUALA'), ['Appartement meublé', 'Terrain titré', 'Villa avec piscine'])
+        self.assertEqual(self._titles('titre'), ['Terrain titré'])
+        self.assertEqual(self._titles('château'), [])
+        self.assertEqual(len(self._titles('')), 4)
+    
+    def test_search_pagination(self):
+        """Les résultats sont paginés par offset"""
+        results, next_offset = self.index.search('douala', 0, 2)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(next_offset, 2)
+        
+        results, next_offset = self.index.search('douala', next_offset, 2)
+        self.assertEqual(len(results), 1)
+        self.assertIsNone(next_offset)
+    
+    def test_index_follows_property_changes(self):
+        """Les signaux mettent l'index à jour après validation de la transaction"""
+        villa = self.properties[0]
+        with patch('telegram_bot.search.get_search_index', return_value=self.index):
+            with self.captureOnCommitCallbacks(execute=True):
+                villa.is_available = False
+                villa.save()
+            self.assertEqual(self._titles('piscine'), [])
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                self.properties[1].delete()
+            self.assertEqual(self._titles('villa'), [])
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                self.properties[2].title = 'Villa à rénover'
+                self.properties[2].save()
+            self.assertEqual(self._titles('villa'), ['Villa à rénover'])
+            self.assertEqual(self._titles('terrain'), [])
+    
+    def test_refresh_picks_up_external_changes(self):
+        """Les modifications faites sans signal (autre processus) sont rattrapées par refresh"""
+        Property.objects.filter(pk=self.properties[3].pk).update(
+            is_available=False,
+            updated_at=timezone.now() + timedelta(seconds=1)
+        )
+        self.index.refresh()
+        
+        self.assertEqual(self._titles('appartement'), [])
+    
+    @patch.object(InlineQuery, 'answer')
+    def test_inline_query_answered_with_next_offset(self, mock_answer):
+        """La requête inline est servie depuis l'index, paginée par next_offset"""
+        update = Update.de_json({
+            'update_id': 1,
+            'inline_query': {
+                'id': 'iq-1',
+                'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+                'query': 'douala',
+                'offset': ''
+            }
+        }, get_bot_client().bot)
+        
+        with patch('telegram_bot.services.get_search_index', return_value=self.index):
+            async_to_sync(get_bot_service().handle_update)(update)
+        
+        results = mock_answer.await_args.args[0]
+        self.assertEqual([result.id for result in results], [str(self.properties[3].pk), str(self.properties[2].pk)])
+        self.assertIn('40 000 000 FCFA', results[0].input_message_content.message_text)
+        self.assertEqual(mock_answer.await_args.kwargs['next_offset'], '2')
+
+
+    @patch('telegram_bot.views.get_dispatcher')
+    def test_webhook_answers_inline_query_directly(self, mock_get_dispatcher):
+        """Une requête inline est répondue sans être persistée ni mise en file"""
+        answered = threading.Event()
+        payload = {
+            'update_id': 2,
+            'inline_query': {
+                'id': 'iq-2',
+                'from': {'id': 42, 'is_bot': False, 'first_name': 'Test'},
+                'query': 'villa',
+                'offset': ''
+            }
+        }
+        
+        async def answer(*args, **kwargs):
+            answered.set()
+        
+        with patch('telegram_bot.services.get_search_index', return_value=self.index):
+            with patch.object(InlineQuery, 'answer', side_effect=answer):
+                response = self.client.post(reverse('telegram_webhook'), payload, content_type='application/json')
+                self.assertTrue(answered.wait(5))
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(TelegramUpdate.objects.exists())
+        mock_get_dispatcher.return_value.submit.assert_not_called()
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+class DigestTests(TestCase):
+    """Tests pour les notifications groupées des propriétaires"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        self.owner = User.objects.create_user(
+            username='owner',
+            email='owner@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.buyer = User.objects.create_user(
+            username='buyer',
+            email='buyer@example.com',
+            password='testpass123',
+            user_type='buyer'
+        )
+        TelegramUser.objects.create(user=self.owner, telegram_id=42)
+        self.property = Property.objects.create(
+            owner=self.owner,
+            title='Villa à Bastos',
+            description='Villa',
+            property_type='house',
+            price=75000000,
+            location='Yaoundé, Bastos',
+            size=400
+        )
+    
+    def tearDown(self):
+        shutdown_bot_client()
+        cache.clear()
+    
+    def _record(self, *texts):
+        for text in texts:
+            record_digest_event(self.owner.pk, text)
+    
+    @patch('telegram_bot.digests.get_outbox')
+    def test_events_grouped_in_one_message(self, mock_get_outbox):
+        """Les événements d'une fenêtre donnent un seul envoi"""
+        mock_send = mock_get_outbox.return_value.send = AsyncMock()
+        digests = DigestBuffer(client=get_bot_client(), window=0.05, max_events=2)
+        
+        async def run():
+            for index in range(3):
+                await sync_to_async(self._record)(f'Événement {index}')
+                digests._schedule(self.owner.pk, immediate=False)
+            self.assertEqual(digests.pending(), 1)
+            await asyncio.sleep(0.1)
+            await asyncio.gather(*digests._tasks)
+            await digests.drain()
+        
+        async_to_sync(run)()
+        
+        mock_send.assert_awaited_once()
+        chat_id, text = mock_send.await_args.args
+        self.assertEqual(chat_id, 42)
+        self.assertIn('3 nouveautés', text)
+        self.assertIn('• Événement 1', text)
+        self.assertIn('… et 1 autres', text)
+        self.assertEqual(digests.stats()['events'], 3)
+        self.assertFalse(TelegramDigestEvent.objects.exists())
+    
+    @patch('telegram_bot.digests.get_outbox')
+    def test_immediate_and_deferred_sends(self, mock_get_outbox):
+        """Un événement prioritaire part tout de suite ; un second envoi dans la fenêtre attend sa fin"""
+        mock_send = mock_get_outbox.return_value.send = AsyncMock()
+        digests = DigestBuffer(client=get_bot_client(), window=0.2, max_events=15)
+        
+        async def run():
+            await sync_to_async(self._record)('Nouvelle offre')
+            digests._schedule(self.owner.pk, immediate=False)
+            await sync_to_async(self._record)('Transaction acceptée')
+            digests._schedule(self.owner.pk, immediate=True)
+            await asyncio.gather(*digests._tasks)
+            self.assertEqual(mock_send.await_count, 1)
+            self.assertIn('Nouvelle offre', mock_send.await_args.args[1])
+            self.assertEqual(digests.pending(), 0)
+            
+            # Fenêtre encore ouverte : le digest suivant est reporté à sa fin
+            # (et non d'une fenêtre entière)
+            await asyncio.sleep(0.1)
+            await sync_to_async(self._record)('Demande de visite')
+            digests._flush(self.owner.pk)
+            await asyncio.gather(*digests._tasks)
+            self.assertEqual(mock_send.await_count, 1)
+            self.assertEqual(digests.pending(), 1)
+            self.assertEqual(digests.stats()['deferred'], 1)
+            
+            await asyncio.sleep(0.15)
+            await asyncio.gather(*digests._tasks)
+            self.assertEqual(mock_send.await_count, 2)
+            self.assertEqual(mock_send.await_args.args[1], 'Demande de visite')
+            await digests.drain()
+        
+        async_to_sync(run)()
+        self.assertEqual(mock_send.await_count, 2)
+    
+    @patch('telegram_bot.digests.get_outbox')
+    def test_sweep_sends_events_of_stopped_process(self, mock_get_outbox):
+        """Les événements d'un processus arrêté avant la fin de leur fenêtre sont envoyés par le balayage"""
+        mock_send = mock_get_outbox.return_value.send = AsyncMock()
+        self._record('Nouvelle offre', 'Demande de visite')
+        TelegramDigestEvent.objects.update(created_at=timezone.now() - timedelta(seconds=120))
+        # Événement récent : sa fenêtre est encore ouverte
+        other = User.objects.create_user(
+            username='other',
+            email='other@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        record_digest_event(other.pk, 'Signalement')
+        digests = DigestBuffer(client=get_bot_client(), window=60, max_events=15)
+        
+        async def run():
+            await digests._sweep()
+            await asyncio.gather(*digests._tasks)
+            await digests.drain()
+        
+        async_to_sync(run)()
+        
+        mock_send.assert_awaited_once()
+        self.assertIn('2 nouveautés', mock_send.await_args.args[1])
+        self.assertEqual(list(TelegramDigestEvent.objects.values_list('owner_id', flat=True)), [other.pk])
+    
+    @patch('telegram_bot.signals.get_digests')
+    def test_activity_signals_notify_owner(self, mock_get_digests):
+        """Demandes de visite, signalements et transactions notifient le propriétaire après validation"""
+        notify = mock_get_digests.return_value.notify
+        with self.captureOnCommitCallbacks(execute=True):
+            VisitRequest.objects.create(
+                property=self.property,
+                requester=self.buyer,
+                requested_date=timezone.now(),
+                description='Visite'
+            )
+            PropertyReport.objects.create(
+                property=self.property,
+                reporter=self.buyer,
+                title='Photos trompeuses',
+                description='Détails'
+            )
+            offer = Transaction.objects.create(
+                property=self.property,
+                buyer=self.buyer,
+                seller=self.owner,
+                agreed_price=70000000
+            )
+        self.assertEqual(notify.call_count, 3)
+        self.assertTrue(all(call.args == (self.owner.pk, False) for call in notify.call_args_list))
+        texts = list(TelegramDigestEvent.objects.filter(owner=self.owner).values_list('text', flat=True))
+        self.assertEqual(len(texts), 3)
+        self.assertIn('70 000 000 FCFA', texts[2])
+        
+        notify.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            transition(offer, 'accepted', user=self.owner)
+            offer.save()
+        notify.assert_called_once_with(self.owner.pk, True)
+        self.assertEqual(TelegramDigestEvent.objects.filter(owner=self.owner).count(), 4)
+
+
+class IdentityCacheTests(TestCase):
+    """Tests pour le cache telegram_id -> TelegramUser"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        get_local_identities().clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.telegram_user = TelegramUser.objects.create(user=self.user, telegram_id=555)
+    
+    def tearDown(self):
+        cache.clear()
+        get_local_identities().clear()
+    
+    def test_lookup_served_from_cache(self):
+        """Seule la première résolution interroge la base (utilisateur inclus)"""
+        before = identity_stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_telegram_user(555).user.username, 'testuser')
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(aresolve_telegram_user)(555).pk, self.telegram_user.pk)
+        
+        # Un autre processus (cache local vide) lit le cache partagé
+        get_local_identities().clear()
+        with self.assertNumQueries(0):
+            resolve_telegram_user(555)
+        
+        stats = identity_stats()
+        self.assertEqual(stats['shared']['hits'] - before['shared']['hits'], 1)
+        self.assertEqual(stats['local']['hits'] - before['local']['hits'], 1)
+    
+    def test_unlink_and_link_invalidate(self):
+        """Désactivation et liaison invalident l'identité mise en cache"""
+        resolve_telegram_user(555)
+        self.telegram_user.is_active = False
+        self.telegram_user.save()
+        self.assertIsNone(resolve_telegram_user(555))
+        
+        # Le compte non lié est mis en cache négatif jusqu'à la liaison
+        self.assertIsNone(resolve_telegram_user(777))
+        with self.assertNumQueries(0):
+            resolve_telegram_user(777)
+        other = User.objects.create_user(username='other', password='testpass123', user_type='buyer')
+        TelegramUser.objects.create(user=other, telegram_id=777)
+        self.assertEqual(resolve_telegram_user(777).user, other)
+    
+    def test_local_entries_expire(self):
+        """Les entrées locales expirent après leur durée de vie"""
+        lru = BoundedLRU(10, ttl=60)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), 1)
+        
+        with patch('telegram_bot.caches.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.stats()['hit_rate'], 0.5)
+
+
+class CleanupCommandTests(TestCase):
+    """Tests pour la commande de nettoyage des conversations"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        old_date = timezone.now() - timedelta(days=2)
+        self.conversations = []
+        for index in range(5):
+            user = User.objects.create_user(
+                username=f'user{index}',
+                email=f'user{index}@example.com',
+                password='testpass123',
+                user_type='landowner'
+            )
+            telegram_user = TelegramUser.objects.create(user=user, telegram_id=1000 + index)
+            self.conversations.append(TelegramConversation.objects.create(
+                telegram_user=telegram_user,
+                state='idle' if index == 0 else 'awaiting_images',
+                context_data={'property_id': index}
+            ))
+            TelegramLinkCode.objects.create(
+                user=user,
+                code=f'CODE{index:04d}',
+                expires_at=timezone.now() + timedelta(minutes=-10 if index % 2 else 10)
+            )
+        # La dernière conversation est encore active
+        TelegramConversation.objects.exclude(pk=self.conversations[-1].pk).update(updated_at=old_date)
+    
+    def test_cleanup_in_batches(self):
+        """Les conversations inactives sont réinitialisées par lots, les actives conservées"""
+        cache.set('telegram:conversation:1001', {'state': 'awaiting_images'})
+        out = StringIO()
+        call_command('cleanup_telegram_conversations', batch_size=2, stdout=out)
+        
+        states = dict(TelegramConversation.objects.values_list('telegram_user__telegram_id', 'state'))
+        self.assertEqual(states, {1000: 'idle', 1001: 'idle', 1002: 'idle', 1003: 'idle', 1004: 'awaiting_images'})
+        self.assertEqual(TelegramConversation.objects.get(telegram_user__telegram_id=1001).context_data, {})
+        self.assertIsNone(cache.get('telegram:conversation:1001'))
+        self.assertEqual(TelegramLinkCode.objects.count(), 3)
+        self.assertIn('3 conversations inactives réinitialisées', out.getvalue())
+    
+    def test_dry_run(self):
+        """Le mode simulation ne modifie rien"""
+        out = StringIO()
+        call_command('cleanup_telegram_conversations', dry_run=True, stdout=out)
+        
+        self.assertEqual(TelegramConversation.objects.exclude(state='idle').count(), 4)
+        self.assertEqual(TelegramLinkCode.objects.count(), 5)
+        self.assertIn('[DRY RUN] 3 conversations', out.getvalue())
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+class MessageLogTests(TestCase):
+    """Tests pour le journal des messages et sa rétention"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.telegram_user = TelegramUser.objects.create(user=user, telegram_id=123456789)
+    
+    def tearDown(self):
+        shutdown_bot_client()
+    
+    def _row(self, index):
+        return TelegramMessage(
+            telegram_user=self.telegram_user,
+            content=f'Message {index}',
+            telegram_message_id=index
+        )
+    
+    def test_rows_written_in_batches(self):
+        """Les lignes sont écrites en un seul INSERT une fois le seuil atteint"""
+        log = MessageLogBuffer(client=get_bot_client(), batch_size=3, flush_interval=60)
+        
+        async def log_rows(count):
+            for index in range(count):
+                log.add(self._row(index))
+            if log._flushing is not None:
+                await log._flushing
+        
+        async_to_sync(log_rows)(2)
+        self.assertFalse(TelegramMessage.objects.exists())
+        
+        with self.assertNumQueries(1):
+            async_to_sync(log_rows)(1)
+        self.assertEqual(TelegramMessage.objects.count(), 3)
+        self.assertEqual(log.stats()['written'], 3)
+    
+    def test_pending_rows_kept_on_error(self):
+        """Une erreur d'écriture conserve les lignes pour le lot suivant"""
+        log = MessageLogBuffer(client=get_bot_client(), batch_size=100, flush_interval=60)
+        log._rows = [self._row(1)]
+        
+        with patch.object(TelegramMessage.objects, 'bulk_create', side_effect=Exception('db down')):
+            async_to_sync(log.flush)()
+        self.assertEqual(log.stats()['buffered'], 1)
+        
+        async_to_sync(log.flush)()
+        self.assertEqual(TelegramMessage.objects.count(), 1)
+    
+    def test_prune_archives_old_messages(self):
+        """La purge archive puis supprime par lots les messages expirés"""
+        for index in range(5):
+            self._row(index).save()
+        recent = self._row(99)
+        recent.save()
+        TelegramMessage.objects.exclude(pk=recent.pk).update(created_at=timezone.now() - timedelta(days=120))
+        
+        with tempfile.TemporaryDirectory() as directory:
+            archive = Path(directory) / 'messages.jsonl.gz'
+            call_command(
+                'prune_telegram_messages', days=90, batch_size=2, archive=str(archive), stdout=StringIO()
+            )
+            with gzip.open(archive, 'rt', encoding='utf-8') as handle:
+                archived = [json.loads(line) for line in handle]
+        
+        self.assertEqual(len(archived), 5)
+        self.assertEqual(list(TelegramMessage.objects.values_list('pk', flat=True)), [recent.pk])
+
+
+@override_settings(TELEGRAM_BOT_TOKEN='123456:TEST-TOKEN')
+class MessageLogFailureTests(TransactionTestCase):
+    """Tests pour les erreurs d'écriture du journal (hors transaction de test)"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.telegram_user = TelegramUser.objects.create(user=user, telegram_id=123456789)
+    
+    def tearDown(self):
+        shutdown_bot_client()
+    
+    def _row(self, index):
+        return TelegramMessage(
+            telegram_user=self.telegram_user,
+            content=f'Message {index}',
+            telegram_message_id=index
+        )
+    
+    def test_invalid_row_does_not_block_batch(self):
+        """Une ligne invalide est abandonnée sans empêcher l'écriture des autres"""
+        log = MessageLogBuffer(client=get_bot_client(), batch_size=100, flush_interval=60)
+        invalid = self._row(2)
+        invalid.telegram_message_id = None
+        log._rows = [self._row(1), invalid, self._row(3)]
+        
+        async_to_sync(log.flush)()
+        
+        self.assertEqual(
+            sorted(TelegramMessage.objects.values_list('telegram_message_id', flat=True)),
+            [1, 3]
+        )
+        self.assertEqual(log.stats(), {'buffered': 0, 'written': 2, 'dropped': 1})
+
+
+class ReparseMessagesCommandTests(TestCase):
+    """Tests pour la commande de ré-analyse des messages"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.telegram_user = TelegramUser.objects.create(user=user, telegram_id=123456789)
+        self.messages = [
+            TelegramMessage.objects.create(
+                telegram_user=self.telegram_user,
+                content=f"Terrain de {size}m², localisation: Odza, prix {size * 100} fcfa",
+                telegram_message_id=index
+            )
+            for index, size in enumerate([300, 400, 500])
+        ]
+        self.done = TelegramMessage.objects.create(
+            telegram_user=self.telegram_user,
+            content="Maison à Douala 80000 euros",
+            telegram_message_id=99,
+            processed=True
+        )
+    
+    def test_reparse_unprocessed_messages(self):
+        """Les messages non traités sont analysés par lots et mis à jour"""
+        call_command('reparse_telegram_messages', batch_size=2, workers=2, stdout=StringIO())
+        
+        for message in self.messages:
+            message.refresh_from_db()
+            self.assertEqual(message.parser_version, PropertyParserService.VERSION)
+            self.assertEqual(message.parsed_data['location'], 'Odza')
+            self.assertEqual(message.parsed_data['property_type'], 'land')
+        
+        self.done.refresh_from_db()
+        self.assertEqual(self.done.parser_version, 0)
+        self.assertIsNone(self.done.parsed_data)
+    
+    def test_reparse_is_resumable(self):
+        """Une relance ignore les messages déjà à la version courante"""
+        call_command('reparse_telegram_messages', workers=1, limit=2, stdout=StringIO())
+        
+        out = StringIO()
+        call_command('reparse_telegram_messages', workers=1, stdout=out)
+        
+        self.assertIn('1 messages ré-analysés', out.getvalue())
+        self.assertFalse(
+            TelegramMessage.objects.filter(processed=False, parser_version=0).exists()
+        )
@@ -11,4 +11,7 @@ urlpatterns = [
     
     # Endpoint pour vérifier le statut de liaison
     path('link-status/', views.check_link_status, name='check_link_status'),
+    
+    # Endpoint de supervision de la file des updates
+    path('queue-status/', views.queue_status, name='telegram_queue_status'),
 ]
\ No newline at end of file
@@ -3,6 +3,7 @@ import logging
 import random
 import string
 from datetime import datetime, timedelta
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
@@ -10,13 +11,19 @@ from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
-from telegram import Update, Bot
 from telegram.constants import ParseMode
 
-from .models import TelegramUser, TelegramLinkCode, TelegramMessage
-from .services import TelegramBotService, PropertyParserService
+from .models import TelegramUser, TelegramLinkCode, TelegramMessage, TelegramUpdate
+from .services import PropertyParserService
+from .dispatcher import (
+    get_dispatcher, store_update, update_chat_id, is_supported_update, is_direct_update, answer_directly
+)
+from .outbox import get_outbox
+from .message_log import get_message_log
+from .identity import identity_stats
+from .digests import get_digests
 
 # Configuration du logging
 logger = logging.getLogger(__name__)
@@ -24,9 +31,9 @@ logger = logging.getLogger(__name__)
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def telegram_webhook(request):
+async def telegram_webhook(request):
     """
-    Endpoint webhook pour recevoir les messages de Telegram
+    Endpoint webhook asynchrone pour recevoir les messages de Telegram
     """
     try:
         # Vérification de la présence du token dans l'URL pour sécurité
@@ -34,20 +41,38 @@ def telegram_webhook(request):
             logger.error("Token Telegram non configuré")
             return HttpResponse(status=500)
         
+        # Journalisation échantillonnée du payload brut (formaté seulement si émis)
+        if random.random() < settings.TELEGRAM_WEBHOOK_LOG_SAMPLE_RATE:
+            logger.info("Webhook reçu: %s", request.body[:2000].decode('utf-8', 'replace'))
+        
         # Parsing du JSON reçu de Telegram
-        data = json.loads(request.body.decode('utf-8'))
-        logger.info(f"Webhook reçu: {data}")
+        data = json.loads(request.body)
+        
+        # Validation minimale de l'update
+        if not isinstance(data, dict) or not isinstance(data.get('update_id'), int):
+            return HttpResponse("Invalid update", status=400)
+        
+        # Types non traités par le bot : acquittés sans être persistés
+        if not is_supported_update(data):
+            logger.debug("Update %s ignoré (type non géré)", data['update_id'])
+            return HttpResponse("OK")
         
-        # Création de l'objet Update de python-telegram-bot
-        update = Update.de_json(data, Bot(settings.TELEGRAM_BOT_TOKEN))
+        # Requêtes inline : répondues tout de suite depuis l'index en mémoire,
+        # sans persistance, déduplication ni file par chat
+        if is_direct_update(data):
+            answer_directly(data)
+            return HttpResponse("OK")
         
-        # Traitement du message via le service
-        bot_service = TelegramBotService()
-        bot_service.handle_update(update)
+        # Persistance durable avant acquittement, le traitement se fait en arrière-plan
+        update_pk = await sync_to_async(store_update)(data)
+        if update_pk is None:
+            logger.info("Update %s déjà reçu, ignoré", data['update_id'])
+        else:
+            get_dispatcher().submit(update_pk, update_chat_id(data))
         
         return HttpResponse("OK")
         
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, UnicodeDecodeError):
         logger.error("Erreur de parsing JSON dans le webhook")
         return HttpResponse("Invalid JSON", status=400)
     except Exception as e:
@@ -167,4 +192,20 @@ def check_link_status(request):
         return Response({
             'linked': False,
             'error': 'Erreur lors de la vérification'
-        }, status=500)
\ No newline at end of file
+        }, status=500)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def queue_status(request):
+    """
+    Expose la profondeur des files de traitement et d'envoi du bot Telegram
+    """
+    stats = get_dispatcher().stats()
+    stats['pending_in_database'] = TelegramUpdate.objects.filter(status='pending').count()
+    stats['failed_in_database'] = TelegramUpdate.objects.filter(status='failed').count()
+    stats['outbox'] = get_outbox().stats()
+    stats['message_log'] = get_message_log().stats()
+    stats['identity'] = identity_stats()
+    stats['digests'] = get_digests().stats()
+    return Response(stats)
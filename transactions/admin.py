@@ -1,5 +1,6 @@
-from django.contrib import admin
-from .models import Transaction
+from django.contrib import admin, messages
+from .models import Transaction, TransactionEvent, TransactionSnapshot
+from .services import transition, TransitionError
 
 
 @admin.register(Transaction)
@@ -22,4 +23,51 @@ class TransactionAdmin(admin.ModelAdmin):
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         })
-    )
\ No newline at end of file
+    )
+    
+    def save_model(self, request, obj, form, change):
+        """Les changements de statut passent par la machine à états"""
+        if not change or 'status' not in form.changed_data:
+            return super().save_model(request, obj, form, change)
+        
+        new_status = obj.status
+        obj.status = form.initial['status']
+        try:
+            transition(obj, new_status, user=request.user)
+        except TransitionError as e:
+            self.message_user(request, str(e), level=messages.ERROR)
+        # Les autres champs sont enregistrés sans réécrire le statut
+        fields = [name for name in form.changed_data if name != 'status']
+        if fields:
+            obj.save(update_fields=fields + ['updated_at'])
+
+
+@admin.register(TransactionEvent)
+class TransactionEventAdmin(admin.ModelAdmin):
+    """Journal des transactions en lecture seule"""
+    list_display = ['id', 'transaction_id', 'status', 'actor_id', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['=transaction__id']
+    ordering = ['-id']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TransactionSnapshot)
+class TransactionSnapshotAdmin(admin.ModelAdmin):
+    """Instantanés du journal en lecture seule"""
+    list_display = ['last_event_id', 'as_of', 'created_at']
+    ordering = ['-last_event_id']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
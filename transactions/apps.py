@@ -4,4 +4,8 @@ from django.apps import AppConfig
 class TransactionsConfig(AppConfig):
     """Configuration de l'application Transactions"""
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'transactions'
\ No newline at end of file
+    name = 'transactions'
+    
+    def ready(self):
+        """Journal des événements de transaction"""
+        from . import signals  # noqa: F401
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from users.models import User
+from .models import TransactionEvent, TransactionSnapshot
+
+
+def record_events(changes: Iterable[Tuple[int, str]], actor: Optional[User] = None) -> List[TransactionEvent]:
+    """Ajoute au journal les nouveaux statuts (transaction_id, statut) en un seul INSERT"""
+    actor_id = actor.pk if actor is not None and actor.is_authenticated else None
+    return TransactionEvent.objects.bulk_create([
+        TransactionEvent(transaction_id=transaction_id, status=status, actor_id=actor_id)
+        for transaction_id, status in changes
+    ])
+
+
+def status_at(transaction_id: int, at: datetime) -> Optional[str]:
+    """Statut d'une transaction à une date donnée (None si elle n'existait pas encore)"""
+    return TransactionEvent.objects.filter(
+        transaction_id=transaction_id,
+        created_at__lte=at
+    ).order_by('-id').values_list('status', flat=True).first()
+
+
+def _apply(statuses: Dict[str, str], events, until: Optional[datetime] = None) -> Optional[Tuple[int, datetime]]:
+    """
+    Applique les événements (id, transaction_id, statut, date) dans l'ordre des
+    identifiants, en s'arrêtant au premier postérieur à `until`.
+    Retourne le dernier identifiant appliqué et la date la plus récente.
+    """
+    last = None
+    for event_id, transaction_id, status, created_at in events:
+        if until is not None and created_at > until:
+            break
+        statuses[str(transaction_id)] = status
+        last = (event_id, created_at if last is None else max(last[1], created_at))
+    return last
+
+
+def _events_after(last_event_id: int):
+    return TransactionEvent.objects.filter(id__gt=last_event_id).order_by('id').values_list(
+        'id', 'transaction_id', 'status', 'created_at'
+    )
+
+
+def state_at(at: datetime) -> Dict[str, str]:
+    """
+    Statut de chaque transaction à une date donnée : dernier instantané
+    antérieur, puis événements postérieurs à celui-ci jusqu'à `at`.
+    """
+    snapshot = TransactionSnapshot.objects.filter(as_of__lte=at).order_by('-last_event_id').first()
+    statuses = dict(snapshot.statuses) if snapshot else {}
+    last_event_id = snapshot.last_event_id if snapshot else 0
+    _apply(statuses, _events_after(last_event_id).filter(created_at__lte=at).iterator())
+    return statuses
+
+
+def take_snapshot(settle: timedelta = timedelta(seconds=60)) -> Optional[TransactionSnapshot]:
+    """
+    Enregistre un instantané des événements suivant le précédent, dans l'ordre
+    des identifiants et sans trou : le curseur s'arrête au premier événement
+    postérieur à `now - settle`. Un événement daté plus tôt mais validé plus
+    tard qu'un autre reste donc inclus dans un instantané suivant ; le délai
+    laisse aux transactions en cours le temps d'être validées.
+    Retourne None si aucun nouvel événement n'est à inclure.
+    """
+    with db_transaction.atomic():
+        previous = TransactionSnapshot.objects.order_by('-last_event_id').first()
+        statuses = dict(previous.statuses) if previous else {}
+        events = _events_after(previous.last_event_id if previous else 0)
+        last = _apply(statuses, events.iterator(), until=timezone.now() - settle)
+        if last is None:
+            return None
+        return TransactionSnapshot.objects.create(
+            last_event_id=last[0],
+            as_of=max(last[1], previous.as_of) if previous else last[1],
+            statuses=statuses
+        )
@@ -0,0 +1,33 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from transactions.ledger import take_snapshot
+
+
+class Command(BaseCommand):
+    """Commande pour enregistrer un instantané des statuts de transactions"""
+    help = (
+        'Enregistre un instantané du journal des transactions. À exécuter '
+        'périodiquement (cron) : les lectures historiques partent du dernier instantané.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--settle',
+            type=int,
+            default=60,
+            help='Ignore les événements des N dernières secondes, pas encore forcément validés (défaut: 60)'
+        )
+
+    def handle(self, *args, **options):
+        """Exécute la prise d'instantané"""
+        snapshot = take_snapshot(settle=timedelta(seconds=options['settle']))
+        if snapshot is None:
+            self.stdout.write('Aucun nouvel événement depuis le dernier instantané')
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Instantané enregistré : {len(snapshot.statuses)} transactions, '
+                f'jusqu\'à l\'événement {snapshot.last_event_id} ({snapshot.as_of:%d/%m/%Y %H:%M:%S})'
+            )
+        )
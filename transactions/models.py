@@ -19,5 +19,72 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        constraints = [
+            # Une seule offre en attente par acheteur et par propriété
+            models.UniqueConstraint(
+                fields=['property', 'buyer'],
+                condition=models.Q(status='pending'),
+                name='unique_pending_transaction'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Transaction for {self.property.title} - {self.status}"
+
+
+class TransactionEvent(models.Model):
+    """
+    Journal des changements de statut, en ajout seul.
+    Les clés étrangères sont sans contrainte : l'historique survit à la
+    suppression d'une transaction ou d'un utilisateur.
+    """
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='events'
+    )
+    status = models.CharField(max_length=20, choices=Transaction.TRANSACTION_STATUS)
+    actor = models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['transaction', 'id'], name='transaction_event_history'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Les événements de transaction ne peuvent pas être modifiés.")
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError("Les événements de transaction ne peuvent pas être supprimés.")
+    
+    def __str__(self):
+        return f"Transaction {self.transaction_id} -> {self.status}"
+
+
+class TransactionSnapshot(models.Model):
+    """
+    Statut de toutes les transactions après l'événement `last_event_id`.
+    Une lecture à une date donnée part du dernier instantané antérieur et
+    n'applique que les événements suivants.
+    """
+    last_event_id = models.BigIntegerField(unique=True)
+    as_of = models.DateTimeField(db_index=True, help_text="Date de l'événement inclus le plus récent")
+    statuses = models.JSONField(help_text="Statut par identifiant de transaction")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-last_event_id']
+    
     def __str__(self):
-        return f"Transaction for {self.property.title} - {self.status}"
\ No newline at end of file
+        return f"Instantané au {self.as_of:%d/%m/%Y %H:%M} ({len(self.statuses)} transactions)"
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Transaction
+from .models import Transaction, TransactionEvent
 from properties.models import Property
 from users.models import User
 
@@ -21,7 +21,8 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
     """Sérialiseur pour la création de transactions"""
     class Meta:
         model = Transaction
-        fields = ['property', 'agreed_price']
+        fields = ['id', 'property', 'agreed_price']
+        read_only_fields = ['id']
     
     def validate_property(self, value):
         """Vérifier que la propriété est disponible"""
@@ -34,5 +35,12 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
         # L'acheteur sera défini dans la vue
         # Le vendeur est le propriétaire de la propriété
         property_obj = validated_data['property']
-        validated_data['seller'] = property_obj.owner
-        return Transaction.objects.create(**validated_data)
\ No newline at end of file
+        validated_data['seller_id'] = property_obj.owner_id
+        return Transaction.objects.create(**validated_data)
+
+
+class TransactionEventSerializer(serializers.ModelSerializer):
+    """Sérialiseur des événements du journal des transactions"""
+    class Meta:
+        model = TransactionEvent
+        fields = ['id', 'status', 'actor', 'created_at']
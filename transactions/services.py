@@ -0,0 +1,89 @@
+from typing import Optional
+
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from properties.models import Property
+from users.models import User
+from .models import Transaction
+from .signals import status_changed
+from .ledger import record_events
+
+# Statuts atteignables depuis chaque statut
+TRANSITIONS = {
+    'pending': {'accepted', 'rejected'},
+    'accepted': {'completed', 'rejected'},
+    'rejected': set(),
+    'completed': set(),
+}
+
+# Statuts qu'une transaction ouverte peut encore quitter
+OPEN_STATUSES = ('pending', 'accepted')
+
+
+class TransitionError(Exception):
+    """Changement de statut non autorisé par la machine à états"""
+
+
+class TransitionConflict(TransitionError):
+    """Le statut a été modifié par une autre requête entre la lecture et l'écriture"""
+
+
+def transition(transaction: Transaction, new_status: str, user: Optional[User] = None) -> Transaction:
+    """
+    Fait passer la transaction de son statut courant à `new_status`.
+
+    L'écriture est un UPDATE conditionnel sur le statut lu : si une autre
+    requête l'a modifié entre-temps, aucune ligne n'est mise à jour et
+    TransitionConflict est levée au lieu d'écraser sa modification.
+
+    Finaliser une vente verrouille la propriété, la marque indisponible et
+    rejette les autres transactions ouvertes sur celle-ci, dans la même
+    transaction de base de données. Chaque changement de statut est ajouté
+    au journal des événements.
+    """
+    previous_status = transaction.status
+    if new_status not in TRANSITIONS.get(previous_status, ()):
+        raise TransitionError(f"Transition {previous_status} -> {new_status} non autorisée.")
+
+    now = timezone.now()
+    with db_transaction.atomic():
+        if new_status == 'completed':
+            # Sérialise les finalisations concurrentes d'une même propriété
+            property_obj = Property.objects.select_for_update().get(pk=transaction.property_id)
+
+        updated = Transaction.objects.filter(
+            pk=transaction.pk,
+            status=previous_status
+        ).update(status=new_status, updated_at=now)
+        if not updated:
+            raise TransitionConflict("La transaction a été modifiée entre-temps, rechargez-la.")
+
+        changes = [(transaction.pk, new_status)]
+        if new_status == 'completed':
+            competing = list(
+                Transaction.objects.select_for_update().filter(
+                    property_id=transaction.property_id,
+                    status__in=OPEN_STATUSES
+                ).exclude(pk=transaction.pk).values_list('pk', flat=True)
+            )
+            if competing:
+                Transaction.objects.filter(pk__in=competing).update(status='rejected', updated_at=now)
+                changes.extend((pk, 'rejected') for pk in competing)
+
+            if property_obj.is_available:
+                property_obj.is_available = False
+                property_obj.save(update_fields=['is_available', 'updated_at'])
+
+        record_events(changes, actor=user)
+
+        transaction.status = new_status
+        transaction.updated_at = now
+        status_changed.send(
+            sender=Transaction,
+            transaction=transaction,
+            previous_status=previous_status,
+            user=user
+        )
+
+    return transaction
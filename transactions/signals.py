@@ -0,0 +1,18 @@
+from django.db.models.signals import post_save
+from django.dispatch import Signal, receiver
+
+from .models import Transaction
+from .ledger import record_events
+
+# Envoyé par transactions.services.transition après un changement de statut,
+# avec les arguments `transaction`, `previous_status` et `user`. Les
+# modifications de statut passant par des UPDATE conditionnels, post_save
+# n'est pas émis pour elles.
+status_changed = Signal()
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_created(sender, instance, created, **kwargs):
+    """Premier événement du journal : le statut initial de la transaction"""
+    if created:
+        record_events([(instance.pk, instance.status)])
@@ -1,9 +1,17 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
+from django.db import connection, OperationalError
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
 from .models import Transaction
+from .models import TransactionEvent
+from .services import transition, TransitionError, TransitionConflict
+from .ledger import record_events, state_at, status_at, take_snapshot
 from properties.models import Property
 from decimal import Decimal
 
@@ -119,4 +127,360 @@ class TransactionAPITests(APITestCase):
             'agreed_price': '95000.00'
         }
         response = self.client.post(url, data)
-        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_duplicate_pending_transaction_rejected(self):
+        """Test qu'une seconde offre en attente sur la même propriété est refusée"""
+        self.client.force_authenticate(user=self.buyer)
+        url = reverse('transaction-list-create')
+        data = {
+            'property': self.property.id,
+            'agreed_price': '95000.00'
+        }
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        # Lecture de la propriété puis un seul INSERT (dans un savepoint), sans exists()
+        with self.assertNumQueries(5):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Transaction.objects.filter(buyer=self.buyer).count(), 1)
+    
+    def test_seller_accepts_transaction(self):
+        """Test d'acceptation d'une offre par le vendeur"""
+        transaction = Transaction.objects.create(
+            property=self.property,
+            buyer=self.buyer,
+            seller=self.seller,
+            agreed_price=Decimal('95000.00')
+        )
+        self.client.force_authenticate(user=self.seller)
+        url = reverse('transaction-detail', args=[transaction.pk])
+        response = self.client.patch(url, {'status': 'accepted'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'accepted')
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.status, 'accepted')
+    
+    def test_buyer_cannot_accept_transaction(self):
+        """Test qu'un acheteur ne peut qu'annuler sa transaction"""
+        transaction = Transaction.objects.create(
+            property=self.property,
+            buyer=self.buyer,
+            seller=self.seller,
+            agreed_price=Decimal('95000.00')
+        )
+        self.client.force_authenticate(user=self.buyer)
+        url = reverse('transaction-detail', args=[transaction.pk])
+        response = self.client.patch(url, {'status': 'accepted'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_invalid_transition_rejected(self):
+        """Test qu'une transaction rejetée ne peut plus être finalisée"""
+        transaction = Transaction.objects.create(
+            property=self.property,
+            buyer=self.buyer,
+            seller=self.seller,
+            agreed_price=Decimal('95000.00'),
+            status='rejected'
+        )
+        self.client.force_authenticate(user=self.seller)
+        url = reverse('transaction-detail', args=[transaction.pk])
+        response = self.client.patch(url, {'status': 'completed'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TransactionStateMachineTests(TestCase):
+    """Tests pour la machine à états des transactions"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        self.seller = User.objects.create_user(
+            username='seller',
+            email='seller@test.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.property = Property.objects.create(
+            owner=self.seller,
+            title='Test Property',
+            description='A test property',
+            property_type='house',
+            price=Decimal('100000.00'),
+            location='Test Location',
+            size=Decimal('150.5')
+        )
+        self.transactions = []
+        for index in range(3):
+            buyer = User.objects.create_user(
+                username=f'buyer{index}',
+                email=f'buyer{index}@test.com',
+                password='testpass123',
+                user_type='buyer'
+            )
+            self.transactions.append(Transaction.objects.create(
+                property=self.property,
+                buyer=buyer,
+                seller=self.seller,
+                agreed_price=Decimal('95000.00')
+            ))
+    
+    def test_completion_closes_the_sale(self):
+        """Test que la finalisation rejette les autres offres et retire la propriété"""
+        sale = self.transactions[0]
+        transition(sale, 'accepted')
+        transition(sale, 'completed')
+        
+        self.property.refresh_from_db()
+        self.assertFalse(self.property.is_available)
+        self.assertEqual(
+            list(Transaction.objects.order_by('pk').values_list('status', flat=True)),
+            ['completed', 'rejected', 'rejected']
+        )
+    
+    def test_stale_read_raises_conflict(self):
+        """Test qu'une modification basée sur un statut périmé n'écrase rien"""
+        seller_copy = Transaction.objects.get(pk=self.transactions[0].pk)
+        admin_copy = Transaction.objects.get(pk=self.transactions[0].pk)
+        
+        transition(seller_copy, 'accepted')
+        with self.assertRaises(TransitionConflict):
+            transition(admin_copy, 'rejected')
+        
+        self.transactions[0].refresh_from_db()
+        self.assertEqual(self.transactions[0].status, 'accepted')
+    
+    def test_transition_graph(self):
+        """Test des transitions interdites"""
+        with self.assertRaises(TransitionError):
+            transition(self.transactions[0], 'completed')
+        transition(self.transactions[0], 'rejected')
+        with self.assertRaises(TransitionError):
+            transition(self.transactions[0], 'accepted')
+
+
+class TransactionLedgerTests(APITestCase):
+    """Tests pour le journal des événements de transaction"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        self.seller = User.objects.create_user(
+            username='seller',
+            email='seller@test.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.admin = User.objects.create_user(
+            username='admin',
+            email='admin@test.com',
+            password='testpass123',
+            user_type='admin'
+        )
+        self.property = Property.objects.create(
+            owner=self.seller,
+            title='Test Property',
+            description='A test property',
+            property_type='house',
+            price=Decimal('100000.00'),
+            location='Test Location',
+            size=Decimal('150.5')
+        )
+        self.transactions = []
+        for index in range(2):
+            buyer = User.objects.create_user(
+                username=f'buyer{index}',
+                email=f'buyer{index}@test.com',
+                password='testpass123',
+                user_type='buyer'
+            )
+            self.transactions.append(Transaction.objects.create(
+                property=self.property,
+                buyer=buyer,
+                seller=self.seller,
+                agreed_price=Decimal('95000.00')
+            ))
+    
+    def _age_events(self, seconds):
+        """Vieillit les événements existants (dates distinctes pour les lectures historiques)"""
+        TransactionEvent.objects.update(created_at=timezone.now() - timedelta(seconds=seconds))
+    
+    def test_status_changes_recorded(self):
+        """Test que création, transitions et rejets en masse sont journalisés"""
+        sale = self.transactions[0]
+        transition(sale, 'accepted', user=self.seller)
+        transition(sale, 'completed', user=self.seller)
+        
+        self.assertEqual(
+            list(TransactionEvent.objects.order_by('id').values_list('transaction_id', 'status', 'actor_id')),
+            [
+                (sale.pk, 'pending', None),
+                (self.transactions[1].pk, 'pending', None),
+                (sale.pk, 'accepted', self.seller.pk),
+                (sale.pk, 'completed', self.seller.pk),
+                (self.transactions[1].pk, 'rejected', self.seller.pk),
+            ]
+        )
+        with self.assertRaises(ValueError):
+            TransactionEvent.objects.first().save()
+    
+    def test_state_rebuilt_from_snapshot(self):
+        """Test de lecture à une date donnée depuis un instantané et les événements suivants"""
+        self._age_events(300)
+        transition(self.transactions[0], 'accepted')
+        self._age_events(200)
+        self.assertIsNotNone(take_snapshot(settle=timedelta(0)))
+        self.assertIsNone(take_snapshot(settle=timedelta(0)))
+        
+        transition(self.transactions[0], 'completed')
+        before_sale = timezone.now() - timedelta(seconds=100)
+        
+        # Instantané puis événements postérieurs : deux requêtes, quel que soit l'historique
+        with self.assertNumQueries(2):
+            statuses = state_at(before_sale)
+        self.assertEqual(statuses, {
+            str(self.transactions[0].pk): 'accepted',
+            str(self.transactions[1].pk): 'pending',
+        })
+        self.assertEqual(state_at(timezone.now())[str(self.transactions[1].pk)], 'rejected')
+        self.assertIsNone(status_at(self.transactions[0].pk, timezone.now() - timedelta(days=1)))
+    
+    def test_snapshot_keeps_late_committed_events(self):
+        """Test qu'un événement validé tardivement n'est pas sauté par le curseur des instantanés"""
+        self._age_events(300)
+        transition(self.transactions[0], 'accepted')
+        late_event = TransactionEvent.objects.order_by('-id').first()
+        TransactionEvent.objects.filter(pk=late_event.pk).update(created_at=timezone.now())
+        # Événement d'identifiant supérieur mais daté plus tôt
+        record_events([(self.transactions[1].pk, 'rejected')])
+        TransactionEvent.objects.filter(pk__gt=late_event.pk).update(
+            created_at=timezone.now() - timedelta(seconds=200)
+        )
+        
+        snapshot = take_snapshot()
+        self.assertLess(snapshot.last_event_id, late_event.pk)
+        
+        TransactionEvent.objects.filter(pk=late_event.pk).update(
+            created_at=timezone.now() - timedelta(seconds=100)
+        )
+        self.assertIsNotNone(take_snapshot())
+        self.assertEqual(state_at(timezone.now()), {
+            str(self.transactions[0].pk): 'accepted',
+            str(self.transactions[1].pk): 'rejected',
+        })
+    
+    def test_history_api(self):
+        """Test de l'historique d'une transaction et du journal à une date donnée"""
+        self._age_events(300)
+        transition(self.transactions[0], 'rejected')
+        at = (timezone.now() - timedelta(seconds=100)).isoformat()
+        
+        self.client.force_authenticate(user=self.transactions[0].buyer)
+        url = reverse('transaction-history', args=[self.transactions[0].pk])
+        response = self.client.get(url, {'at': at})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(len(response.data['events']), 1)
+        self.assertEqual(self.client.get(url).data['status'], 'rejected')
+        self.assertEqual(self.client.get(url, {'at': 'hier'}).status_code, status.HTTP_400_BAD_REQUEST)
+        
+        # Journal global réservé aux admins
+        url = reverse('transaction-ledger')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(url, {'at': at})
+        self.assertEqual(response.data['counts'], {'pending': 2})
+
+
+class TransactionConcurrencyTests(TransactionTestCase):
+    """Test de charge : finalisations et rejets concurrents"""
+    
+    def test_concurrent_transitions_lose_no_update(self):
+        """Test qu'une seule vente aboutit et qu'aucune transition réussie n'est perdue"""
+        seller = User.objects.create_user(
+            username='seller',
+            email='seller@test.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        property_obj = Property.objects.create(
+            owner=seller,
+            title='Test Property',
+            description='A test property',
+            property_type='house',
+            price=Decimal('100000.00'),
+            location='Test Location',
+            size=Decimal('150.5')
+        )
+        transactions = []
+        for index in range(4):
+            buyer = User.objects.create_user(
+                username=f'buyer{index}',
+                email=f'buyer{index}@test.com',
+                password='testpass123',
+                user_type='buyer'
+            )
+            transactions.append(Transaction.objects.create(
+                property=property_obj,
+                buyer=buyer,
+                seller=seller,
+                agreed_price=Decimal('95000.00'),
+                status='accepted'
+            ))
+        
+        # Chaque offre est finalisée par le vendeur et rejetée par l'admin en même temps
+        attempts = [(transaction.pk, new_status) for transaction in transactions for new_status in ('completed', 'rejected')]
+        barrier = threading.Barrier(len(attempts))
+        outcomes = {}
+        lock = threading.Lock()
+        
+        def attempt(pk, new_status):
+            stale = Transaction.objects.get(pk=pk)
+            barrier.wait()
+            outcome = 'exhausted'
+            try:
+                for _ in range(100):
+                    try:
+                        transition(stale, new_status)
+                        outcome = 'success'
+                        break
+                    except TransitionConflict:
+                        outcome = 'conflict'
+                        break
+                    except OperationalError:
+                        # SQLite n'accepte qu'un écrivain : on réessaie
+                        time.sleep(0.01)
+            except Exception as e:
+                outcome = repr(e)
+            finally:
+                with lock:
+                    outcomes[pk, new_status] = outcome
+                connection.close()
+        
+        threads = [threading.Thread(target=attempt, args=args) for args in attempts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # Chaque tentative a abouti ou a été refusée : aucune n'a épuisé ses essais
+        self.assertEqual(len(outcomes), len(attempts))
+        for args, outcome in outcomes.items():
+            self.assertIn(outcome, ('success', 'conflict'), args)
+        succeeded = [args for args, outcome in outcomes.items() if outcome == 'success']
+        self.assertTrue(succeeded)
+        
+        final = dict(Transaction.objects.values_list('pk', 'status'))
+        completed = [pk for pk, value in final.items() if value == 'completed']
+        self.assertLessEqual(len(completed), 1)
+        # Au plus une transition réussie par transaction, et elle est visible en base ;
+        # sans transition réussie, l'offre a été rejetée par la vente concurrente
+        self.assertEqual(len({pk for pk, _ in succeeded}), len(succeeded))
+        for transaction in transactions:
+            statuses = [new_status for pk, new_status in succeeded if pk == transaction.pk]
+            if statuses:
+                self.assertEqual(final[transaction.pk], statuses[0])
+            else:
+                self.assertEqual(final[transaction.pk], 'rejected')
+                self.assertEqual(len(completed), 1)
+        property_obj.refresh_from_db()
+        self.assertEqual(property_obj.is_available, not completed)
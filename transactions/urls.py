@@ -5,4 +5,6 @@ from . import views
 urlpatterns = [
     path('transactions/', views.TransactionListCreateView.as_view(), name='transaction-list-create'),
     path('transactions/<int:pk>/', views.TransactionDetailView.as_view(), name='transaction-detail'),
+    path('transactions/<int:pk>/history/', views.TransactionHistoryView.as_view(), name='transaction-history'),
+    path('transactions/history/', views.TransactionLedgerView.as_view(), name='transaction-ledger'),
 ]
\ No newline at end of file
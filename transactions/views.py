@@ -1,10 +1,50 @@
-from rest_framework import generics, permissions, serializers
+from collections import Counter
+from django.db import models, transaction as db_transaction, IntegrityError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import generics, permissions, serializers, status
+from rest_framework.exceptions import APIException, PermissionDenied
 from rest_framework.response import Response
 from .models import Transaction
-from .serializers import TransactionSerializer, TransactionCreateSerializer
+from .services import transition, TransitionError, TransitionConflict
+from .ledger import status_at, state_at
+from .serializers import TransactionSerializer, TransactionCreateSerializer, TransactionEventSerializer
 from properties.models import Property
 
 
+class TransactionConflict(APIException):
+    """Modification concurrente d'une transaction"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The transaction was modified concurrently."
+    default_code = 'conflict'
+
+
+def _history_date(request):
+    """Date du paramètre ?at= (ISO 8601), maintenant par défaut"""
+    value = request.query_params.get('at')
+    if not value:
+        return timezone.now()
+    try:
+        at = parse_datetime(value)
+    except ValueError:
+        at = None
+    if at is None:
+        raise serializers.ValidationError({'at': "Invalid date, use ISO 8601 format."})
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
+    return at
+
+
+def _visible_transactions(user):
+    """Transactions visibles en détail : toutes pour un admin, sinon celles de l'utilisateur"""
+    if user.user_type == 'admin':
+        return Transaction.objects.all()
+    # Seuls les participants peuvent voir la transaction
+    return Transaction.objects.filter(
+        models.Q(buyer=user) | models.Q(seller=user)
+    )
+
+
 class TransactionListCreateView(generics.ListCreateAPIView):
     """Vue pour lister et créer des transactions"""
     serializer_class = TransactionSerializer
@@ -33,24 +73,20 @@ class TransactionListCreateView(generics.ListCreateAPIView):
     def perform_create(self, serializer):
         """Seuls les acheteurs peuvent initier des transactions"""
         if self.request.user.user_type != 'buyer':
-            raise permissions.PermissionDenied("Only buyers can initiate transactions.")
+            raise PermissionDenied("Only buyers can initiate transactions.")
         
-        # Vérifier si l'acheteur a déjà une transaction en cours pour cette propriété
+        # Vérifier que l'acheteur ne tente pas d'acheter sa propre propriété
         property_obj = serializer.validated_data['property']
-        existing_transaction = Transaction.objects.filter(
-            property=property_obj,
-            buyer=self.request.user,
-            status='pending'
-        ).exists()
+        if property_obj.owner_id == self.request.user.pk:
+            raise PermissionDenied("You cannot buy your own property.")
         
-        if existing_transaction:
+        # L'unicité de la transaction en attente est garantie par la contrainte
+        # unique_pending_transaction : un seul INSERT, sans fenêtre de concurrence
+        try:
+            with db_transaction.atomic():
+                serializer.save(buyer=self.request.user)
+        except IntegrityError:
             raise serializers.ValidationError("You already have a pending transaction for this property.")
-        
-        # Vérifier que l'acheteur ne tente pas d'acheter sa propre propriété
-        if property_obj.owner == self.request.user:
-            raise permissions.PermissionDenied("You cannot buy your own property.")
-            
-        serializer.save(buyer=self.request.user)
 
 
 class TransactionDetailView(generics.RetrieveUpdateAPIView):
@@ -61,35 +97,81 @@ class TransactionDetailView(generics.RetrieveUpdateAPIView):
     
     def get_queryset(self):
         """Filtrer selon les permissions"""
-        user = self.request.user
-        if user.user_type == 'admin':
-            return Transaction.objects.all()
-        # Seuls les participants peuvent voir la transaction
-        return Transaction.objects.filter(
-            models.Q(buyer=user) | models.Q(seller=user)
-        )
+        return _visible_transactions(self.request.user)
     
     def perform_update(self, serializer):
-        """Contrôler les modifications selon le rôle"""
-        transaction = self.get_object()
+        """
+        Contrôler les modifications selon le rôle.
+        Le statut change uniquement via la machine à états (UPDATE conditionnel),
+        les autres champs sont écrits sans réécrire le statut.
+        """
+        transaction = serializer.instance
         user = self.request.user
         
         if user.user_type == 'admin':
-            # Admin peut tout modifier
-            serializer.save()
+            # Admin peut effectuer toute transition autorisée
+            allowed_statuses = None
         elif user == transaction.buyer:
             # Acheteur peut seulement annuler (rejected)
-            if 'status' in serializer.validated_data:
-                allowed_statuses = ['rejected']
-                if serializer.validated_data['status'] not in allowed_statuses:
-                    raise permissions.PermissionDenied("Buyers can only reject transactions.")
-            serializer.save()
+            allowed_statuses = ['rejected']
         elif user == transaction.seller:
             # Vendeur peut accepter, rejeter ou marquer comme complété
-            if 'status' in serializer.validated_data:
-                allowed_statuses = ['accepted', 'rejected', 'completed']
-                if serializer.validated_data['status'] not in allowed_statuses:
-                    raise permissions.PermissionDenied("Invalid status change for seller.")
-            serializer.save()
+            allowed_statuses = ['accepted', 'rejected', 'completed']
         else:
-            raise permissions.PermissionDenied("You don't have permission to update this transaction.")
\ No newline at end of file
+            raise PermissionDenied("You don't have permission to update this transaction.")
+        
+        fields = dict(serializer.validated_data)
+        new_status = fields.pop('status', transaction.status)
+        
+        if new_status != transaction.status:
+            if allowed_statuses is not None and new_status not in allowed_statuses:
+                raise PermissionDenied("Invalid status change for your role.")
+            try:
+                transition(transaction, new_status, user=user)
+            except TransitionConflict as e:
+                raise TransactionConflict(str(e))
+            except TransitionError as e:
+                raise serializers.ValidationError({'status': str(e)})
+        
+        if fields:
+            for name, value in fields.items():
+                setattr(transaction, name, value)
+            transaction.save(update_fields=list(fields) + ['updated_at'])
+
+
+class TransactionHistoryView(generics.GenericAPIView):
+    """Vue de l'historique des statuts d'une transaction (participants et admins)"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        """Mêmes règles de visibilité que le détail de la transaction"""
+        return _visible_transactions(self.request.user)
+    
+    def get(self, request, pk):
+        """Renvoyer les événements jusqu'à ?at= et le statut à cette date"""
+        transaction = self.get_object()
+        at = _history_date(request)
+        events = transaction.events.filter(created_at__lte=at).order_by('id')
+        return Response({
+            'transaction': transaction.pk,
+            'at': at,
+            'status': status_at(transaction.pk, at),
+            'events': TransactionEventSerializer(events, many=True).data
+        })
+
+
+class TransactionLedgerView(generics.GenericAPIView):
+    """Vue des statuts de toutes les transactions à une date donnée (admins)"""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        """Reconstruire l'état à ?at= depuis le dernier instantané et les événements suivants"""
+        if request.user.user_type != 'admin':
+            raise PermissionDenied("Only admins can read the transaction ledger.")
+        at = _history_date(request)
+        statuses = state_at(at)
+        return Response({
+            'at': at,
+            'counts': Counter(statuses.values()),
+            'statuses': statuses
+        })
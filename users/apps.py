@@ -4,4 +4,8 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     """Configuration de l'application Users"""
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'users'
\ No newline at end of file
+    name = 'users'
+    
+    def ready(self):
+        """Invalidation des tableaux de bord mis en cache"""
+        from . import signals  # noqa: F401
@@ -0,0 +1,64 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+def _cache_key(key: str) -> str:
+    # Le token n'apparaît pas en clair dans le cache
+    return f"auth:token:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+# Champs de l'utilisateur mis en cache avec le token : ni mot de passe ni
+# coordonnées. Les autres champs sont chargés depuis la base à la demande.
+CACHED_USER_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name',
+    'user_type', 'is_active', 'is_staff', 'is_superuser',
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication sans requête en base pour les tokens déjà vus.
+
+    La date de création du token et une projection de son utilisateur
+    (CACHED_USER_FIELDS) sont mises en cache AUTH_TOKEN_CACHE_TTL secondes.
+    L'entrée est invalidée à la suppression du token (déconnexion,
+    suppression de l'utilisateur) et à chaque modification de l'utilisateur
+    (mot de passe, désactivation, type de compte) : voir users.signals.
+    """
+
+    def authenticate_credentials(self, key):
+        model = self.get_model()
+        user_model = model._meta.get_field('user').related_model
+        cached = cache.get(_cache_key(key))
+        if cached is not None:
+            db = router.db_for_read(model)
+            user = user_model.from_db(db, CACHED_USER_FIELDS, cached['user'])
+            token = model.from_db(db, ['key', 'user_id', 'created'], [key, user.pk, cached['created']])
+            token.user = user
+            return (user, token)
+
+        try:
+            token = model.objects.select_related('user').only(
+                'key', 'created', 'user_id', *(f'user__{field}' for field in CACHED_USER_FIELDS)
+            ).get(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        cache.set(_cache_key(key), {
+            'created': token.created,
+            'user': [getattr(token.user, field) for field in CACHED_USER_FIELDS],
+        }, settings.AUTH_TOKEN_CACHE_TTL)
+        return (token.user, token)
+
+
+def invalidate_token(key: str):
+    """Retire un token du cache d'authentification"""
+    cache.delete(_cache_key(key))
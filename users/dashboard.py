@@ -0,0 +1,118 @@
+import time
+from typing import Dict, Any, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum, Q
+
+from properties.models import Property, PropertyReport, VisitRequest
+from transactions.models import Transaction
+from .models import User
+
+# Nombre d'éléments récents renvoyés par catégorie
+RECENT_ITEMS = 5
+
+
+def _version_key(user_id: int) -> str:
+    return f"dashboard:version:{user_id}"
+
+
+def _data_key(user_id: int, version: int) -> str:
+    return f"dashboard:{user_id}:{version}"
+
+
+def _status_counts(choices) -> Dict[str, Count]:
+    """Un agrégat Count filtré par statut, pour tout compter en une requête"""
+    return {value: Count('id', filter=Q(status=value)) for value, _ in choices}
+
+
+def _recent(queryset, fields: Iterable[str]):
+    return list(queryset.order_by('-created_at', '-pk').values(*fields)[:RECENT_ITEMS])
+
+
+def _transactions_summary(queryset) -> Dict[str, Any]:
+    summary = queryset.aggregate(
+        total=Count('id'),
+        completed_amount=Sum('agreed_price', filter=Q(status='completed')),
+        **_status_counts(Transaction.TRANSACTION_STATUS)
+    )
+    summary['completed_amount'] = summary['completed_amount'] or 0
+    return summary
+
+
+def _owner_dashboard(user: User) -> Dict[str, Any]:
+    visits = VisitRequest.objects.filter(property__owner=user)
+    transactions = Transaction.objects.filter(seller=user)
+    return {
+        'properties': Property.objects.filter(owner=user).aggregate(
+            total=Count('id'),
+            available=Count('id', filter=Q(is_available=True))
+        ),
+        'visit_requests': visits.aggregate(**_status_counts(VisitRequest.STATUS_CHOICES)),
+        'reports': PropertyReport.objects.filter(property__owner=user).aggregate(
+            **_status_counts(PropertyReport.STATUS_CHOICES)
+        ),
+        'sales': _transactions_summary(transactions),
+        'recent_visit_requests': _recent(
+            visits, ['id', 'property_id', 'property__title', 'requester__username', 'requested_date', 'status']
+        ),
+        'recent_transactions': _recent(
+            transactions, ['id', 'property_id', 'property__title', 'buyer__username', 'agreed_price', 'status']
+        ),
+    }
+
+
+def _buyer_dashboard(user: User) -> Dict[str, Any]:
+    visits = VisitRequest.objects.filter(requester=user)
+    transactions = Transaction.objects.filter(buyer=user)
+    return {
+        'visit_requests': visits.aggregate(**_status_counts(VisitRequest.STATUS_CHOICES)),
+        'reports': PropertyReport.objects.filter(reporter=user).aggregate(
+            **_status_counts(PropertyReport.STATUS_CHOICES)
+        ),
+        'purchases': _transactions_summary(transactions),
+        'recent_visit_requests': _recent(
+            visits, ['id', 'property_id', 'property__title', 'requested_date', 'status']
+        ),
+        'recent_transactions': _recent(
+            transactions, ['id', 'property_id', 'property__title', 'agreed_price', 'status']
+        ),
+    }
+
+
+def build_dashboard(user: User) -> Dict[str, Any]:
+    """Tableau de bord calculé en base (nombre fixe de requêtes agrégées)"""
+    if user.user_type == 'landowner':
+        return _owner_dashboard(user)
+    return _buyer_dashboard(user)
+
+
+def get_dashboard(user: User) -> Dict[str, Any]:
+    """
+    Tableau de bord de l'utilisateur, depuis le cache.
+
+    La clé du cache contient un numéro de version propre à l'utilisateur,
+    incrémenté par invalidate_dashboards : un calcul concurrent d'une
+    invalidation est écrit sous l'ancienne version et n'est jamais relu.
+    """
+    # Version initiale tirée de l'horloge : si la clé de version est évincée,
+    # la nouvelle version ne retombe pas sur d'anciennes données encore en cache
+    version = cache.get_or_set(_version_key(user.pk), lambda: time.time_ns() // 1000, None)
+    key = _data_key(user.pk, version)
+    dashboard = cache.get(key)
+    if dashboard is None:
+        dashboard = build_dashboard(user)
+        cache.set(key, dashboard, settings.DASHBOARD_CACHE_TTL)
+    return dashboard
+
+
+def invalidate_dashboards(user_ids: Iterable[int]):
+    """Passe à une nouvelle version du tableau de bord de ces utilisateurs"""
+    for user_id in set(user_ids):
+        if user_id is None:
+            continue
+        try:
+            cache.incr(_version_key(user_id))
+        except ValueError:
+            # Pas encore de version en cache : rien à invalider
+            pass
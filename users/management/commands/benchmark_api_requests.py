@@ -0,0 +1,78 @@
+import time
+import uuid
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from users.authentication import invalidate_token
+from users.dashboard import invalidate_dashboards
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Commande pour mesurer le coût de la pile de middlewares sur l'API"""
+    help = (
+        'Mesure le nombre de requêtes d\'API authentifiées par token traitées par seconde, '
+        'avec et sans le chemin rapide des middlewares (API_FAST_PATH_ENABLED), '
+        'sous WSGI et sous ASGI (mode de déploiement, uvicorn)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=2000,
+            help='Nombre de requêtes par mesure (défaut: 2000)'
+        )
+
+    def _measure(self, client, url, headers, iterations):
+        client.get(url, headers=headers)  # Remplit les caches (token, tableau de bord)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            client.get(url, headers=headers)
+        return time.perf_counter() - start
+
+    async def _ameasure(self, client, url, headers, iterations):
+        await client.get(url, headers=headers)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await client.get(url, headers=headers)
+        return time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        """Exécute la mesure"""
+        iterations = options['iterations']
+        url = reverse('dashboard')
+
+        # Utilisateur temporaire, supprimé par l'annulation de la transaction
+        with transaction.atomic():
+            user = User.objects.create_user(username=f'benchmark-{uuid.uuid4().hex[:12]}', user_type='buyer')
+            token = Token.objects.create(user=user)
+            headers = {'Authorization': f'Token {token.key}'}
+            try:
+                results = {}
+                for enabled in (False, True):
+                    with override_settings(API_FAST_PATH_ENABLED=enabled, ALLOWED_HOSTS=['testserver']):
+                        # Chaque client charge la pile de middlewares à sa création
+                        results['WSGI', enabled] = self._measure(Client(), url, headers, iterations)
+                        # Requêtes ASGI exécutées depuis ce thread : même connexion, même transaction
+                        results['ASGI', enabled] = async_to_sync(self._ameasure)(
+                            AsyncClient(), url, headers, iterations
+                        )
+            finally:
+                invalidate_token(token.key)
+                invalidate_dashboards([user.pk])
+                transaction.set_rollback(True)
+
+        self.stdout.write(f'{iterations} requêtes GET {url}')
+        for handler in ('WSGI', 'ASGI'):
+            for enabled, label in ((False, 'pile complète'), (True, 'chemin rapide')):
+                elapsed = results[handler, enabled]
+                self.stdout.write(
+                    f'{handler} {label} : {iterations / elapsed:,.0f} requêtes/s '
+                    f'({elapsed / iterations * 1e6:,.0f} µs/requête)'
+                )
+            saved = (results[handler, False] - results[handler, True]) / iterations * 1e6
+            self.stdout.write(f'{handler} gain : {saved:,.0f} µs/requête')
@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from properties.models import Property, PropertyReport, VisitRequest
+from transactions.models import Transaction
+from transactions.signals import status_changed
+from .models import User
+from .dashboard import invalidate_dashboards
+from .authentication import invalidate_token
+
+
+def _invalidate_on_commit(*user_ids):
+    # Immédiatement et après validation : un calcul fait entre les deux depuis
+    # une autre connexion aurait lu l'état précédent
+    invalidate_dashboards(user_ids)
+    transaction.on_commit(lambda: invalidate_dashboards(user_ids))
+
+
+@receiver([post_save, post_delete], sender=Property)
+def property_changed(sender, instance, **kwargs):
+    _invalidate_on_commit(instance.owner_id)
+
+
+@receiver([post_save, post_delete], sender=VisitRequest)
+def visit_request_changed(sender, instance, **kwargs):
+    _invalidate_on_commit(instance.property.owner_id, instance.requester_id)
+
+
+@receiver([post_save, post_delete], sender=PropertyReport)
+def property_report_changed(sender, instance, **kwargs):
+    _invalidate_on_commit(instance.property.owner_id, instance.reporter_id)
+
+
+@receiver([post_save, post_delete], sender=Transaction)
+def transaction_changed(sender, instance, **kwargs):
+    _invalidate_on_commit(instance.seller_id, instance.buyer_id)
+
+
+@receiver(status_changed, sender=Transaction)
+def transaction_status_changed(sender, transaction, **kwargs):
+    user_ids = [transaction.seller_id, transaction.buyer_id]
+    if transaction.status == 'completed':
+        # Les autres offres sur la propriété ont été rejetées en masse
+        user_ids += Transaction.objects.filter(property_id=transaction.property_id).values_list('buyer_id', flat=True)
+    _invalidate_on_commit(*user_ids)
+
+
+def _invalidate_tokens_on_commit(keys):
+    for key in keys:
+        invalidate_token(key)
+    transaction.on_commit(lambda: [invalidate_token(key) for key in keys])
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Déconnexion ou suppression de l'utilisateur : le token n'est plus accepté"""
+    _invalidate_tokens_on_commit([instance.key])
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    """L'utilisateur est mis en cache avec son token (mot de passe, activation, type)"""
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    _invalidate_tokens_on_commit(list(Token.objects.filter(user=instance).values_list('key', flat=True)))
@@ -1,8 +1,18 @@
+from decimal import Decimal
+from io import StringIO
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from properties.models import Property, VisitRequest
+from transactions.models import Transaction
+from transactions.services import transition
+from .authentication import _cache_key
 
 User = get_user_model()
 
@@ -59,4 +69,248 @@ class UserAPITests(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('token', response.data)
-        self.assertIn('user', response.data)
\ No newline at end of file
+        self.assertIn('user', response.data)
+
+
+class DashboardAPITests(APITestCase):
+    """Tests pour le tableau de bord"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        self.owner = User.objects.create_user(
+            username='owner',
+            email='owner@example.com',
+            password='testpass123',
+            user_type='landowner'
+        )
+        self.buyers = [
+            User.objects.create_user(
+                username=f'buyer{index}',
+                email=f'buyer{index}@example.com',
+                password='testpass123',
+                user_type='buyer'
+            )
+            for index in range(2)
+        ]
+        self.property = Property.objects.create(
+            owner=self.owner,
+            title='Villa',
+            description='Villa',
+            property_type='house',
+            price=Decimal('100000.00'),
+            location='Douala',
+            size=Decimal('300')
+        )
+        Property.objects.create(
+            owner=self.owner,
+            title='Terrain',
+            description='Terrain',
+            property_type='land',
+            price=Decimal('20000.00'),
+            location='Kribi',
+            size=Decimal('500'),
+            is_available=False
+        )
+        self.transactions = [
+            Transaction.objects.create(
+                property=self.property,
+                buyer=buyer,
+                seller=self.owner,
+                agreed_price=Decimal('95000.00')
+            )
+            for buyer in self.buyers
+        ]
+        VisitRequest.objects.create(
+            property=self.property,
+            requester=self.buyers[0],
+            requested_date=timezone.now(),
+            description='Visite'
+        )
+        self.url = reverse('dashboard')
+    
+    def tearDown(self):
+        cache.clear()
+    
+    def test_owner_dashboard(self):
+        """Test des compteurs et éléments récents du propriétaire"""
+        self.client.force_authenticate(user=self.owner)
+        # properties, demandes, signalements, ventes, récents (x2)
+        with self.assertNumQueries(6):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['properties'], {'total': 2, 'available': 1})
+        self.assertEqual(response.data['visit_requests']['pending'], 1)
+        self.assertEqual(response.data['sales']['pending'], 2)
+        self.assertEqual(response.data['sales']['completed_amount'], 0)
+        self.assertEqual(len(response.data['recent_transactions']), 2)
+        
+        # Deuxième appel servi par le cache
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+    
+    def test_dashboard_invalidated_on_change(self):
+        """Test que les tableaux de bord concernés sont recalculés après une vente"""
+        self.client.force_authenticate(user=self.buyers[1])
+        self.assertEqual(self.client.get(self.url).data['purchases']['pending'], 1)
+        self.client.force_authenticate(user=self.owner)
+        self.client.get(self.url)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            transition(self.transactions[0], 'accepted')
+            transition(self.transactions[0], 'completed')
+        
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['sales']['completed'], 1)
+        self.assertEqual(response.data['sales']['completed_amount'], Decimal('95000.00'))
+        self.assertEqual(response.data['properties']['available'], 0)
+        
+        # Offre concurrente rejetée en masse : l'autre acheteur est aussi invalidé
+        self.client.force_authenticate(user=self.buyers[1])
+        purchases = self.client.get(self.url).data['purchases']
+        self.assertEqual((purchases['pending'], purchases['rejected']), (0, 1))
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    """Tests pour l'authentification par token mise en cache"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='buyer'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('dashboard')
+    
+    def tearDown(self):
+        cache.clear()
+    
+    def _assert_rejected(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['detail'].code, 'authentication_failed')
+    
+    def test_token_resolved_once(self):
+        """Test que seules les premières requêtes lisent le token en base"""
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        # Token et tableau de bord en cache : aucune requête
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.wsgi_request.user, self.user)
+        # Le hash du mot de passe n'est pas copié dans le cache partagé
+        self.assertNotIn(self.user.password, str(cache.get(_cache_key(self.token.key))))
+    
+    def test_logout_invalidates_token(self):
+        """Test qu'un token mis en cache est refusé après la déconnexion"""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('logout'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Token.objects.exists())
+        self._assert_rejected()
+    
+    def test_user_changes_invalidate_token(self):
+        """Test qu'un changement de mot de passe ou une désactivation est pris en compte"""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('newpass456')
+            self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.wsgi_request.user.check_password('newpass456'))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self._assert_rejected()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self._assert_rejected()
+
+
+class StatelessApiMiddlewareTests(APITestCase):
+    """Tests pour le chemin rapide des requêtes d'API par token"""
+    
+    def setUp(self):
+        """Configuration des tests"""
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpass123',
+            user_type='buyer'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.url = reverse('dashboard')
+    
+    def tearDown(self):
+        cache.clear()
+    
+    def _assert_full_stack(self, request):
+        self.assertFalse(request.stateless_api)
+        self.assertTrue(hasattr(request, 'session'))
+        self.assertTrue(hasattr(request, '_messages'))
+    
+    def test_token_request_skips_session_and_messages(self):
+        """Test qu'une requête par token ne charge ni session ni messages"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        request = response.wsgi_request
+        self.assertTrue(request.stateless_api)
+        self.assertFalse(hasattr(request, 'session'))
+        self.assertFalse(hasattr(request, '_messages'))
+        # L'utilisateur est fourni par l'authentification DRF
+        self.assertEqual(request.user, self.user)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('logout'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Token.objects.exists())
+    
+    def test_session_requests_keep_full_stack(self):
+        """Test que l'admin et les clients à session conservent la pile complète"""
+        self._assert_full_stack(self.client.get('/admin/login/').wsgi_request)
+        
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self._assert_full_stack(response.wsgi_request)
+        
+        # Cookie de session présent : la session reste chargée malgré le token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self._assert_full_stack(self.client.get(self.url).wsgi_request)
+    
+    def test_fast_path_disabled(self):
+        """Test que API_FAST_PATH_ENABLED=False rétablit la pile complète"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        with self.settings(API_FAST_PATH_ENABLED=False):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self._assert_full_stack(response.wsgi_request)
+    
+    async def test_token_request_skips_session_under_asgi(self):
+        """Test que le chemin rapide s'applique aussi sous ASGI"""
+        response = await self.async_client.get(
+            self.url,
+            headers={'Authorization': f'Token {self.token.key}'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        request = response.asgi_request
+        self.assertTrue(request.stateless_api)
+        self.assertFalse(hasattr(request, 'session'))
+        self.assertFalse(hasattr(request, '_messages'))
+    
+    def test_benchmark_command(self):
+        """Test que la mesure s'exécute sans laisser de données"""
+        out = StringIO()
+        call_command('benchmark_api_requests', iterations=2, stdout=out)
+        self.assertIn('WSGI chemin rapide', out.getvalue())
+        self.assertIn('ASGI chemin rapide', out.getvalue())
+        self.assertEqual(User.objects.count(), 1)
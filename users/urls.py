@@ -6,6 +6,7 @@ from . import views
 urlpatterns = [
     path('users/', views.UserListCreateView.as_view(), name='user-list-create'),
     path('users/<int:pk>/', views.UserDetailView.as_view(), name='user-detail'),
+    path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
     path('login/', views.LoginView.as_view(), name='login'),
     path('logout/', views.LogoutView.as_view(), name='logout'),
 ]
\ No newline at end of file
@@ -4,6 +4,7 @@ from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from .models import User
 from .serializers import UserSerializer, UserCreateSerializer
+from .dashboard import get_dashboard
 
 
 class UserListCreateView(generics.ListCreateAPIView):
@@ -37,6 +38,18 @@ class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     
+class DashboardView(generics.GenericAPIView):
+    """
+    Vue du tableau de bord : compteurs par statut, éléments récents et
+    montants des ventes ou achats de l'utilisateur connecté, en un seul appel
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        """Renvoyer le tableau de bord (mis en cache par utilisateur)"""
+        return Response(get_dashboard(request.user))
+
+
 class LoginView(generics.GenericAPIView):
     """Vue pour la connexion utilisateur avec création de token"""
     permission_classes = [permissions.AllowAny]
@@ -72,7 +85,9 @@ class LogoutView(generics.GenericAPIView):
     def post(self, request):
         """Supprimer le token de l'utilisateur pour le déconnecter"""
         try:
-            request.user.auth_token.delete()
+            # Le token authentifiant la requête (mis en cache) : pas de relecture en base
+            token = request.auth if isinstance(request.auth, Token) else request.user.auth_token
+            token.delete()
             return Response({
                 'message': 'Logged out successfully'
             })